@@ -0,0 +1,468 @@
+"""
+File Name:      async_data_handle.py
+
+Authors:        Benjamin Herrera
+
+Date Created:   17 OCT 2026
+
+Date Modified:  17 OCT 2026
+
+Description:    Asynchronous variant of the data handle that downloads files
+                over pooled keep-alive HTTP connections
+"""
+
+# Imports
+import os
+import asyncio
+import aiohttp
+import urllib.parse
+from data_handle import (
+    DataHandle,
+    RANGE_NOT_SATISFIABLE,
+    STORE,
+    COPY_MODE,
+    SHARDED_EXPORT,
+)
+from blob_store import BlobWriter, MAX_SIZE, check_response
+from download_scheduler import DownloadScheduler
+from metrics import METRICS
+
+# Constants
+MAX_TRANSFERS = 32  # Number of transfers allowed in flight at once
+MAX_PER_HOST = 8  # Number of open connections allowed per host
+KEEPALIVE_TIMEOUT = 30  # Seconds an idle connection is kept open
+CHUNK_SIZE = 1024 * 1024  # Bytes read from a response body at a time
+TIMEOUT = 120  # Seconds allowed for a single transfer
+
+
+class AsyncDataHandle(DataHandle):
+    """Asynchronous Data Handling Class
+
+    Description:
+        Extends the data handling class with an asyncio download engine.
+        Every transfer goes through a single aiohttp session, so connections
+        to a host are kept alive and reused between downloads instead of
+        being opened per file. The number of transfers in flight is bounded
+        by a semaphore and response bodies are streamed to disk in chunks.
+        Within that bound, the download scheduler adapts the number of
+        transfers to each host and retries transient failures. Blocking
+        work, such as storing blobs and flushing buffered records, runs on
+        worker threads so it never stalls the transfers in flight.
+
+        The downloader script still runs the synchronous data handle on its
+        pipeline's threads, so this class is only used as a library.
+
+        The session must be opened before downloading, either with
+        "async with" or through the insert_all wrapper:
+
+            handle = AsyncDataHandle("Data/Raw/")
+            results = handle.insert_all([
+                {"method": 1, "title": ..., "links": [...]},
+                ...
+            ])
+
+    Methods:
+        AsyncDataHandle(str, str, str, bool, int, int, int, int, int) -> None
+        open() -> None
+        close() -> None
+        insert_async(int, str, str) -> dict
+        insert_many(list) -> list
+        insert_all(list) -> list
+    """
+
+    def __init__(
+        self,
+        path: str,
+        store: str = STORE,
+        copy_mode: str = COPY_MODE,
+        sharded: bool = SHARDED_EXPORT,
+        max_transfers: int = MAX_TRANSFERS,
+        max_per_host: int = MAX_PER_HOST,
+        chunk_size: int = CHUNK_SIZE,
+        timeout: int = TIMEOUT,
+        max_size: int = MAX_SIZE,
+    ) -> None:
+        """Constructor for Asynchronous Data Handling Class
+
+        Description:
+            Creates the data handle for the given folder and stores the
+            download engine's settings. No connection is opened until the
+            session is opened.
+
+        Information:
+            :param path: Path to the folder
+            :type path: str
+            :param store: Scratch index store to use, "mongo" or "sqlite"
+            :type store: str
+            :param copy_mode: First copy mode tried by copy
+            :type copy_mode: str
+            :param sharded: Whether to export compressed shards
+            :type sharded: bool
+            :param max_transfers: Number of transfers allowed at once
+            :type max_transfers: int
+            :param max_per_host: Number of connections allowed per host
+            :type max_per_host: int
+            :param chunk_size: Bytes to read from a response at a time
+            :type chunk_size: int
+            :param timeout: Seconds allowed for a single transfer
+            :type timeout: int
+            :param max_size: Most bytes a downloaded file may hold
+            :type max_size: int
+            :return: None
+            :rtype: None
+        """
+
+        super().__init__(path, store, copy_mode, sharded)
+
+        # Store the download engine's settings
+        self.MAX_TRANSFERS = max_transfers
+        self.MAX_PER_HOST = max_per_host
+        self.CHUNK_SIZE = chunk_size
+        self.TIMEOUT = timeout
+        self.MAX_SIZE = max_size
+
+        # Adapts the transfers per host up to the connection limit
+        self.SCHEDULER = DownloadScheduler(max_limit=max_per_host)
+
+        # Session and transfer limiter are created when the session is opened
+        self.session = None
+        self.transfers = None
+        self.fetching = {}  # In-flight blob downloads by link
+
+    async def __aenter__(self) -> "AsyncDataHandle":
+        """Open the session when entering an "async with" block"""
+        await self.open()
+        return self
+
+    async def __aexit__(self, *exc_info: object) -> None:
+        """Close the session when leaving an "async with" block"""
+        await self.close()
+
+    async def open(self) -> None:
+        """Session Opening Method
+
+        Description:
+            Creates the pooled HTTP session and the transfer limiter. Must be
+            called from inside the running event loop.
+
+        Information:
+            :return: None
+            :rtype: None
+        """
+
+        # Pool connections per host and keep them alive between transfers
+        connector = aiohttp.TCPConnector(
+            limit=self.MAX_TRANSFERS,
+            limit_per_host=self.MAX_PER_HOST,
+            keepalive_timeout=KEEPALIVE_TIMEOUT,
+        )
+        self.session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=self.TIMEOUT),
+        )
+        self.transfers = asyncio.Semaphore(self.MAX_TRANSFERS)
+
+    async def close(self) -> None:
+        """Session Closing Method
+
+        Description:
+            Closes the pooled HTTP session and all of its connections.
+
+        Information:
+            :return: None
+            :rtype: None
+        """
+
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def _download(self, link: str, file_path: str) -> dict:
+        """File Download Method
+
+        Description:
+            Downloads a single link to the given path through the download
+            scheduler, which limits the transfers per host and retries
+            transient failures. Raises once the link fails for good.
+
+        Information:
+            :param link: The link to download
+            :type link: str
+            :param file_path: The path to write the file to
+            :type file_path: str
+            :return: The SHA-256 hash and size of the file
+            :rtype: dict
+        """
+
+        return await self.SCHEDULER.run(
+            urllib.parse.urlsplit(link).netloc,
+            lambda: self._transfer(link, file_path),
+        )
+
+    async def _transfer(self, link: str, file_path: str) -> dict:
+        """File Transfer Method
+
+        Description:
+            Transfers a single link to the given path, streaming the body to
+            disk in chunks. Raises on any HTTP or connection error. As with
+            download_file, the body is written to "<file_path>.part" and
+            renamed once complete, a left over partial file is resumed with
+            an HTTP Range request, and the body is hashed while it is
+            written.
+
+        Information:
+            :param link: The link to download
+            :type link: str
+            :param file_path: The path to write the file to
+            :type file_path: str
+            :return: The SHA-256 hash and size of the file
+            :rtype: dict
+        """
+
+        part_path = f"{file_path}.part"  # Path written to while downloading
+
+        # Request only the missing bytes if a partial file exists
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        headers = {"Range": f"bytes={offset}-"} if offset > 0 else {}
+
+        # Wait for a free transfer slot before requesting
+        async with self.transfers:
+            async with self.session.get(link, headers=headers) as response:
+                # A range starting at the end of the file means it is
+                # already complete
+                if offset > 0 and response.status == RANGE_NOT_SATISFIABLE:
+                    with BlobWriter(
+                        part_path, offset, self.MAX_SIZE
+                    ) as writer:
+                        pass
+                    os.replace(part_path, file_path)
+                    return writer.digest()
+                response.raise_for_status()
+
+                # Append if the server resumed at the offset, otherwise
+                # start over
+                resumed = response.status == 206 and response.headers.get(
+                    "Content-Range", ""
+                ).startswith(f"bytes {offset}-")
+                offset = offset if resumed else 0
+                check_response(response.headers, offset, self.MAX_SIZE)
+
+                # Write and hash the body as it arrives
+                with BlobWriter(part_path, offset, self.MAX_SIZE) as writer:
+                    async for chunk in response.content.iter_chunked(
+                        self.CHUNK_SIZE
+                    ):
+                        writer.write(chunk)
+
+        os.replace(part_path, file_path)  # Move the completed file into place
+        return writer.digest()
+
+    async def _store(self, link: str) -> dict:
+        """Blob Download Method
+
+        Description:
+            Downloads a link into the blob store.
+
+        Information:
+            :param link: The link to download
+            :type link: str
+            :return: The blob record of the file
+            :rtype: dict
+        """
+
+        temp_path = self.BLOBS.temp_path(link)
+        with METRICS.track("download"):
+            digest = await self._download(link, temp_path)
+        record = await asyncio.to_thread(
+            self.BLOBS.put, link, temp_path, digest
+        )
+        METRICS.count("bytes_total", record["size"], stage="download")
+        return record
+
+    async def _fetch_async(self, link: str, file_path: str) -> dict:
+        """Asynchronous Blob Fetching Method
+
+        Description:
+            Asynchronous counterpart of the _fetch method. Makes the file of a
+            link available under the given path through the blob store. If
+            the link is already being downloaded for another document, the
+            same download is awaited instead of starting a second one.
+
+        Information:
+            :param link: The link of the file
+            :type link: str
+            :param file_path: The path to make the file available at
+            :type file_path: str
+            :return: The blob record of the file
+            :rtype: dict
+        """
+
+        record = self.BLOBS.lookup(link)  # Check for an earlier download
+
+        # Download the link into the store, sharing in-flight downloads
+        if record is None:
+            task = self.fetching.get(link)
+            if task is None:
+                task = asyncio.ensure_future(self._store(link))
+                task.add_done_callback(lambda _: self.fetching.pop(link, None))
+                self.fetching[link] = task
+            record = await task
+
+        # Link the blob into place
+        await asyncio.to_thread(self.BLOBS.link, record, file_path)
+
+        return record
+
+    async def insert_async(
+        self,
+        method: int,
+        title: str,
+        composer: str,
+        text: str,
+        url: str,
+        links: list,
+        custom_id: str = None,
+        count: int = 0,
+        error_func: object = None,
+    ) -> dict:
+        """Asynchronous Document Insertion Method
+
+        Description:
+            Asynchronous counterpart of the insert method. Takes the same
+            parameters and returns the same status dict, but downloads all of
+            the document's links concurrently over the pooled session.
+
+        Information:
+            :param method: The methodology used to gather the information of
+                the datapoint
+            :type method: int
+            :param title: The name of the song to insert into the database
+            :type title: str
+            :param composer: The composer of the song
+            :type composer: str
+            :param text: The text associated to the datapoint
+            :type text: str
+            :param url: The url of the song page
+            :type url: str
+            :param links: The links to download the digital content for the
+                datapoint
+            :type links: list[str]
+            :param custom_id: The ID the callee would like to use instead of a
+                random one
+            :type custom_id: str
+            :param error_func: Function to call when an error occurs. Must
+                intake error and err'd data
+            :type error_func: Object
+            :return: Returns the status and a message of the insertion process
+            :rtype: dict
+        """
+
+        # Build the index document and filter the downloadable links
+        id, data, links = self._prepare_insert(
+            method, title, composer, text, url, links, custom_id, count
+        )
+
+        # Return early if there is nothing to download
+        if len(links) == 0:
+            await asyncio.to_thread(self._buffer_index, data)
+            return {
+                "Status": False,
+                "ID": id,
+                "Message": "Completed document insertion. "
+                + "0/0 files downloaded.",
+            }
+
+        # Create the datapoint's subdirectory into the DB
+        os.makedirs(f"{self.PATH}/data/{id}/", exist_ok=True)
+
+        # Fetch every link that was not completed by a previous run at once
+        paths = [f"{self.PATH}/data/{id}/{i.split('/')[-1]}" for i in links]
+        pending = [
+            (i, path)
+            for i, path in zip(links, paths)
+            if not os.path.exists(path)
+        ]
+        results = await asyncio.gather(
+            *[self._fetch_async(i, path) for i, path in pending],
+            return_exceptions=True,
+        )
+        fetched = dict(zip([i for i, _ in pending], results))
+
+        # Record the files of the document and buffer its index document
+        for i in links:
+            record = fetched.get(i) or self.BLOBS.lookup(i) or {"url": i}
+            if not isinstance(record, Exception):
+                data["files"].append({"name": i.split("/")[-1], **record})
+        await asyncio.to_thread(self._buffer_index, data)
+
+        # Handle the first failed link the same way the insert method does.
+        # Partial and completed files are kept so a rerun can resume.
+        for i, result in fetched.items():
+            if isinstance(result, Exception):
+                print(f"Can't Download: {i}")  # Print error message
+
+                # Call native error_handle function if none is provided
+                # If not, call the provided one
+                if error_func is None:
+                    await asyncio.to_thread(
+                        self.error_handle, data, str(result), i, links
+                    )
+                else:
+                    error_func(data, str(result))
+
+                return  # Return
+
+        # Return if every file was completed by a previous run
+        if pending == []:
+            return {
+                "Status": True,
+                "ID": id,
+                "Message": "Files already exist.",
+            }
+
+        # Return a success message
+        return {
+            "Status": True,
+            "ID": id,
+            "Message": "Completed document insertion. "
+            + f"{len(pending)}/{len(links)} files downloaded.",
+        }
+
+    async def insert_many(self, documents: list) -> list:
+        """Asynchronous Batch Insertion Method
+
+        Description:
+            Inserts every given document concurrently. Each document is a dict
+            of keyword arguments for the insert_async method. The session
+            must already be open.
+
+        Information:
+            :param documents: Keyword arguments for each insertion
+            :type documents: list[dict]
+            :return: The status dict of each insertion, in order
+            :rtype: list[dict]
+        """
+
+        return await asyncio.gather(
+            *[self.insert_async(**document) for document in documents]
+        )
+
+    def insert_all(self, documents: list) -> list:
+        """Batch Insertion Method
+
+        Description:
+            Synchronous wrapper around insert_many. Opens a session, inserts
+            every given document concurrently, and closes the session.
+
+        Information:
+            :param documents: Keyword arguments for each insertion
+            :type documents: list[dict]
+            :return: The status dict of each insertion, in order
+            :rtype: list[dict]
+        """
+
+        async def run() -> list:
+            async with self:
+                return await self.insert_many(documents)
+
+        return asyncio.run(run())
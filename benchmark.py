@@ -0,0 +1,873 @@
+"""
+File Name:      benchmark.py
+
+Authors:        Benjamin Herrera
+
+Date Created:   17 OCT 2026
+
+Date Modified:  17 OCT 2026
+
+Description:    Script to benchmark the throughput of the download and
+                sort/filter pipelines offline and reproducibly
+"""
+
+# Imports
+import os
+import sys
+import json
+import time
+import zlib
+import struct
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+import http.server
+import urllib.error
+from file_copy import MODES
+
+# Resource usage is only available on POSIX platforms
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Constants
+DOCUMENTS = 500  # Synthetic documents per pipeline
+LATENCY = 0.02  # Seconds the stand-in server waits before each response
+FAILURE_RATE = 0.0  # Share of the stand-in's paths that fail at first
+FAILED_ATTEMPTS = 1  # Requests of a failing path answered with a 503
+FILE_SIZE = 16 * 1024  # Bytes of each synthetic MIDI file
+PAGE_SIZE = 64 * 1024  # Bytes of each synthetic wiki page
+SHARD_SIZE = 4 * 1024  # Bytes of each shard of the synthetic Raw export
+FILES_PER_DOCUMENT = 2  # MIDI links of each synthetic document
+MXL_RATIO = 0.1  # Share of the source documents with only an MXL file
+EMPTY_RATIO = 0.05  # Share of the source documents without any file
+STORE = "sqlite"  # Scratch index store of the benchmarked data handles
+PAGE_THREADS = 8  # Threads parsing pages in the pages pipeline
+SORT_WORKERS = 4  # Processes of the sort/filter pipeline
+PIPELINES = ("download", "pages", "sort_filter")  # Pipelines to benchmark
+RESULTS_LOC = "benchmarks/"  # Folder of the saved results
+THRESHOLD = 0.1  # Relative change counted as a regression
+HIGHER_IS_BETTER = ("docs_per_sec",)  # Results where larger values win
+COMPARED = ("docs_per_sec", "p50", "p99", "peak_rss_mb")  # Compared results
+PARITY_PAGES = 50  # Synthetic pages checked when no stored pages are given
+EDGE_PAGES = (
+    b'<html><head><meta charset="utf-8"></head><body><div class="poem x">'
+    + b"<p>A &amp; b&nbsp;c<!-- note --><br/>d<script>var s;</script>"
+    + b"<style>p{}</style><ruby>k<rt>r</rt><rp>(</rp></ruby>"
+    + b"\xc3\xa9</p></div><div class='poem'><div class='poem'>inner</div>"
+    + b'</div><div class="Poem">case</div><div class="\tpoem\n">tab</div>'
+    + b"</body></html>",
+    b"<html><body><div class=poem>Caf\xe9 without a charset</div></body>"
+    + b"</html>",
+    b'<?xml version="1.0" encoding="utf-8"?><html><body><div class="poem">'
+    + b"XHTML</div></body></html>",
+    b"",
+)  # Pages with markup that parsers tend to disagree on
+REPO_LOC = os.path.dirname(os.path.abspath(__file__))  # Folder of the code
+
+
+def midi_file(seed: int, size: int) -> bytes:
+    """MIDI File Function
+
+    Description:
+        Builds a valid single-track MIDI file of about the given size, with
+        notes derived from the seed so every file is different.
+
+    Information:
+        :param seed: Seed of the notes
+        :type seed: int
+        :param size: Approximate size of the file in bytes
+        :type size: int
+        :return: Content of the MIDI file
+        :rtype: bytes
+    """
+
+    # Note on and note off pairs until the track reaches the size
+    events = bytearray()
+    note = seed % 60 + 30
+    while len(events) < size - 26:
+        events += bytes((0x00, 0x90, note, 0x40, 0x60, 0x80, note, 0x40))
+        note = (note * 7 + 3) % 60 + 30
+    events += b"\x00\xff\x2f\x00"  # End of track
+
+    return (
+        b"MThd"
+        + struct.pack(">IHHH", 6, 0, 1, 480)
+        + b"MTrk"
+        + struct.pack(">I", len(events))
+        + bytes(events)
+    )
+
+
+def wiki_page(name: str, size: int) -> bytes:
+    """Wiki Page Function
+
+    Description:
+        Builds a song page shaped like a CPDL wiki page: navigation and
+        filler content around poem blocks, one of which holds a link and is
+        therefore not a text.
+
+    Information:
+        :param name: Name of the page
+        :type name: str
+        :param size: Approximate size of the page in bytes
+        :type size: int
+        :return: Content of the page
+        :rtype: bytes
+    """
+
+    poems = (
+        f'<div class="poem"><p>English text of {name}, sung softly by the'
+        + " choir at the break of day.</p></div>"
+        + '<div class="poem"><p>Deutscher Text, see <a href="/wiki/index.php/'
+        + f'{name}_de">the German page</a>.</p></div>'
+        + f'<div class="poem"><p>Another verse of {name} for the choir to'
+        + " sing at night.</p></div>"
+    )
+    filler = (
+        '<table class="wikitable"><tr><td><a href="/wiki/index.php/Other">'
+        + "Other</a></td><td>Editor, Edition, Score information</td></tr>"
+        + "</table><p>Lorem ipsum dolor sit amet, consectetur adipiscing.</p>"
+    )
+    head = (
+        f"<html><head><title>{name} - ChoralWiki</title></head><body>"
+        + '<div id="mw-navigation"><ul><li><a href="/">Main Page</a></li>'
+        + '</ul></div><div id="content">'
+    )
+    body = filler * max(1, (size - len(head) - len(poems)) // len(filler))
+
+    half = len(body) // 2
+    return (
+        head + body[:half] + poems + body[half:] + "</div></body></html>"
+    ).encode()
+
+
+class StandInServer:
+    """Stand-In Server Class
+
+    Description:
+        Local HTTP server standing in for cpdl.org. It serves:
+
+            /wiki/index.php/<name>      Synthetic song pages
+            /files/<path>.mid           Synthetic MIDI files
+
+        Every response is delayed by the latency. The paths selected by the
+        failure rate, through a hash of the path so the same paths fail on
+        every run, are answered with a 503 for their first FAILED_ATTEMPTS
+        requests, which exercises the retries.
+
+    Methods:
+        StandInServer(float, float, int, int) -> None
+        start() -> str
+        stop() -> None
+    """
+
+    def __init__(
+        self,
+        latency: float = LATENCY,
+        failure_rate: float = FAILURE_RATE,
+        file_size: int = FILE_SIZE,
+        page_size: int = PAGE_SIZE,
+    ) -> None:
+        """Constructor for Stand-In Server Class
+
+        Description:
+            Stores the settings of the server. Nothing is served until the
+            server is started.
+
+        Information:
+            :param latency: Seconds to wait before each response
+            :type latency: float
+            :param failure_rate: Share of the paths that fail at first
+            :type failure_rate: float
+            :param file_size: Bytes of each MIDI file
+            :type file_size: int
+            :param page_size: Bytes of each wiki page
+            :type page_size: int
+            :return: None
+            :rtype: None
+        """
+
+        self.LATENCY = latency
+        self.FAILURE_RATE = failure_rate
+        self.FILE_SIZE = file_size
+        self.PAGE_SIZE = page_size
+        self.attempts = {}  # Requests made for each failing path
+        self.lock = threading.Lock()
+        self.server = None
+
+    def _fails(self, path: str) -> bool:
+        """Check whether a request for a path should be failed"""
+        if zlib.crc32(path.encode()) % 10000 >= self.FAILURE_RATE * 10000:
+            return False
+        with self.lock:
+            self.attempts[path] = self.attempts.get(path, 0) + 1
+            return self.attempts[path] <= FAILED_ATTEMPTS
+
+    def start(self) -> str:
+        """Start serving on a free localhost port and return the base URL"""
+        stand_in = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            """Serves the synthetic pages and files"""
+
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self) -> None:
+                time.sleep(stand_in.LATENCY)
+                path = self.path.split("?")[0]
+
+                # Fail the selected paths at first
+                if stand_in._fails(path):
+                    self.send_response(503)
+                    self.send_header("Retry-After", "0")
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+
+                # Build the requested content
+                name = path.rsplit("/", 1)[-1]
+                if path.startswith("/wiki/index.php/"):
+                    body = wiki_page(name, stand_in.PAGE_SIZE)
+                    content_type = "text/html; charset=utf-8"
+                elif path.startswith("/files/") and path.endswith(".mid"):
+                    body = midi_file(
+                        zlib.crc32(path.encode()), stand_in.FILE_SIZE
+                    )
+                    content_type = "audio/midi"
+                else:
+                    self.send_error(404)
+                    return
+
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args: object) -> None:
+                return  # Keep the benchmark's output clean
+
+        self.server = http.server.ThreadingHTTPServer(
+            ("127.0.0.1", 0), Handler
+        )
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def stop(self) -> None:
+        """Stop serving"""
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+
+def peak_rss() -> tuple:
+    """Peak RSS Function
+
+    Description:
+        Returns the peak resident set size of the current process and of its
+        largest finished child process, in megabytes. Both are None where
+        the resource module is unavailable.
+
+    Information:
+        :return: Peak RSS of the process and of its children
+        :rtype: tuple[float, float]
+    """
+
+    if resource is None:
+        return None, None
+
+    # Linux reports kilobytes and macOS bytes
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return (
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale,
+    )
+
+
+def latencies(merged: dict) -> dict:
+    """Return the count, p50, and p99 of every stage's latency histogram"""
+    from metrics import quantile
+
+    return {
+        key.split('"')[1]: {
+            "count": h["count"],
+            "p50": quantile(h, 0.5),
+            "p99": quantile(h, 0.99),
+        }
+        for key, h in merged["histograms"].items()
+    }
+
+
+def bench_download(args: argparse.Namespace) -> int:
+    """Run the downloader's pipeline on synthetic documents"""
+    import downloader
+    from data_handle import DataHandle
+
+    downloader.DATA_HANDLE = DataHandle("bench/Raw/", store=args.store)
+
+    # Documents as returned by the downloader's query
+    documents = [
+        {
+            "_id": f"doc{i}",
+            "link": f"{args.url}/wiki/index.php/Song_{i}",
+            "title": f"Song {i} (SATB)",
+            "general_information": {"composer": [f"Composer {i % 50}"]},
+            "download_links": {
+                "Edition 1": [
+                    f"{args.url}/files/doc{i}/song{j}.mid"
+                    for j in range(FILES_PER_DOCUMENT)
+                ]
+                + [f"{args.url}/files/doc{i}/score.pdf"]
+            },
+            "english_texts": [f"English text of song {i}, sung by the choir."],
+        }
+        for i in range(args.documents)
+    ]
+
+    downloader.run(documents, report_interval=None)
+    downloader.DATA_HANDLE.compile_index_and_errors()
+
+    return args.documents
+
+
+def bench_pages(args: argparse.Namespace) -> int:
+    """Fetch and parse synthetic song pages with the downloader's parser"""
+    import concurrent.futures
+    import downloader
+    from metrics import METRICS
+    from page_cache import PageCache
+
+    # Parse pages from the stand-in through an empty cache
+    downloader.WIKI_URL = f"{args.url}/wiki/index.php/"
+    downloader.PAGE_CACHE = PageCache("bench/pages")
+
+    def parse(i: int) -> list:
+        with METRICS.track("document"):
+            # Pages still failing after the retries count as failures
+            try:
+                return downloader.link_parser(f"Song_{i}")
+            except urllib.error.URLError:
+                METRICS.count("failures_total", stage="pages")
+                return None
+
+    with concurrent.futures.ThreadPoolExecutor(args.threads) as executor:
+        texts = list(executor.map(parse, range(args.documents)))
+
+    # Every page holds two texts, the linked poem is dropped
+    if any(t is not None and len(t) != 2 for t in texts):
+        raise RuntimeError("The parser returned the wrong texts")
+
+    return args.documents
+
+
+def bench_sort_filter(args: argparse.Namespace) -> int:
+    """Run the sort/filter pipeline on a synthetic Raw tree"""
+    import sort_filter
+
+    # Fake MuseScore that "converts" by copying, where scripts can run
+    musescore = os.path.abspath("bench/musescore.py")
+    with open(musescore, "w", encoding="utf-8") as file:
+        file.write(
+            f"#!{sys.executable}\n"
+            + "import json, shutil, sys\n"
+            + "for job in json.load(open(sys.argv[2])):\n"
+            + '    shutil.copy(job["in"], job["out"])\n'
+        )
+    os.chmod(musescore, 0o755)
+    mxl_ratio = MXL_RATIO if os.name == "posix" else 0.0
+
+    # Build the Raw tree: MIDI files, MXL files, empty folders, and a
+    # sharded export of the index with small shards
+    from shard_export import ShardWriter
+
+    os.makedirs("bench/Raw/data")
+    writer = ShardWriter("bench/Raw", "index_en", shard_size=SHARD_SIZE)
+    for i in range(args.documents):
+        id = f"doc{i}"
+        folder = f"bench/Raw/data/{id}"
+        os.makedirs(folder)
+        writer.write(
+            id, json.dumps({"_id": id, "title": f"song {i}", "composer": "c"})
+        )
+        share = (i * 0.618034) % 1  # Spreads the kinds evenly
+        if share < EMPTY_RATIO:
+            continue
+        kind = "mxl" if share < EMPTY_RATIO + mxl_ratio else "mid"
+        with open(f"{folder}/song.{kind}", "wb") as file:
+            file.write(midi_file(i, FILE_SIZE))
+    writer.close()
+
+    sort_filter.run(
+        source_loc="bench/Raw/",
+        target_loc="bench/Ready/",
+        store=args.store,
+        workers=args.workers,
+        packed=args.packed,
+        copy_mode=args.copy_mode,
+        musescore=musescore,
+        convert_cache="bench/cache/",
+        metrics_loc="bench/metrics/",
+        progress=False,
+    )
+
+    return args.documents
+
+
+def reference_poems(html: bytes) -> list:
+    """Parse the poems of a page with a full BS4 tree, as link_parser did"""
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(html, "lxml")
+    poems = soup.find_all("div", class_="poem")
+    return [poem.text for poem in poems if len(poem.find_all("a")) == 0]
+
+
+def check_parity(pages_loc: str) -> dict:
+    """Parity Check Method
+
+    Description:
+        Checks that the downloader's poem parser returns exactly what a full
+        BS4 parse returns, on the stored pages of a page cache folder, or
+        on synthetic and edge case pages if no folder is given. Both parsers
+        are timed on the same pages.
+
+    Information:
+        :param pages_loc: Path to a folder of stored ".html" pages, or None
+        :type pages_loc: str
+        :return: Pages checked, mismatching pages, and milliseconds per
+            page of each parser
+        :rtype: dict
+    """
+
+    import downloader
+
+    # Read the stored pages, or build synthetic ones
+    if pages_loc:
+        names = sorted(n for n in os.listdir(pages_loc) if n.endswith(".html"))
+        pages = []
+        for name in names:
+            with open(os.path.join(pages_loc, name), "rb") as file:
+                pages.append(file.read())
+    else:
+        names = [f"Song_{i}" for i in range(PARITY_PAGES)]
+        pages = [wiki_page(name, PAGE_SIZE) for name in names]
+        names += [f"edge_{i}" for i in range(len(EDGE_PAGES))]
+        pages += list(EDGE_PAGES)
+
+    # Parse every page with both parsers
+    timings = {}
+    outputs = {}
+    for label, parse in (
+        ("reference", reference_poems),
+        ("parser", downloader.parse_poems),
+    ):
+        start = time.perf_counter()
+        outputs[label] = [parse(page) for page in pages]
+        timings[label] = (time.perf_counter() - start) * 1000 / len(pages)
+
+    return {
+        "pages": len(pages),
+        "mismatches": [
+            name
+            for name, a, b in zip(
+                names, outputs["reference"], outputs["parser"]
+            )
+            if a != b
+        ],
+        "reference_ms": timings["reference"],
+        "parser_ms": timings["parser"],
+    }
+
+
+def run_worker(args: argparse.Namespace) -> None:
+    """Worker Method
+
+    Description:
+        Runs a single pipeline in the current process, which the parent
+        started in an empty folder, and writes its results to a JSON file.
+        Each pipeline gets its own process so its peak RSS is its own.
+
+    Information:
+        :param args: Parsed command line arguments
+        :type args: argparse.Namespace
+        :return: None
+        :rtype: None
+    """
+
+    # Run inside the pipeline's folder with a login file pointing at a
+    # MongoDB that is never contacted, as the scratch store is SQLite
+    os.chdir(args.workdir)
+    sys.path.insert(0, REPO_LOC)
+    with open("login.json", "w", encoding="utf-8") as file:
+        json.dump(
+            {
+                "address": "localhost",
+                "port": 27017,
+                "username": "",
+                "password": "",
+            },
+            file,
+        )
+    os.makedirs("bench")
+
+    from metrics import METRICS
+
+    METRICS.configure("bench/metrics/", interval=1)
+
+    # Check the parser instead of running a pipeline
+    if args.worker == "parity":
+        with open(args.result, "w", encoding="utf-8") as file:
+            json.dump(check_parity(args.parity), file, indent=4)
+        return
+
+    # Time the pipeline
+    pipeline = {
+        "download": bench_download,
+        "pages": bench_pages,
+        "sort_filter": bench_sort_filter,
+    }[args.worker]
+    start = time.perf_counter()
+    documents = pipeline(args)
+    seconds = time.perf_counter() - start
+
+    # Gather the latencies and failures of every process and the peak memory
+    merged = METRICS.merged()
+    stages = latencies(merged)
+    document = stages.pop("document", {"p50": None, "p99": None})
+    rss, children_rss = peak_rss()
+    with open(args.result, "w", encoding="utf-8") as file:
+        json.dump(
+            {
+                "documents": documents,
+                "seconds": seconds,
+                "docs_per_sec": documents / seconds,
+                "failures": sum(
+                    value
+                    for key, value in merged["counters"].items()
+                    if key.startswith("failures_total")
+                ),
+                "p50": document["p50"],
+                "p99": document["p99"],
+                "peak_rss_mb": rss,
+                "peak_children_rss_mb": children_rss,
+                "stages": stages,
+            },
+            file,
+            indent=4,
+        )
+
+
+def parity(args: argparse.Namespace) -> int:
+    """Parity Method
+
+    Description:
+        Runs the parity check of the poem parser in a fresh process and
+        folder and prints its outcome.
+
+    Information:
+        :param args: Parsed command line arguments
+        :type args: argparse.Namespace
+        :return: Exit code, 1 if a page was parsed differently
+        :rtype: int
+    """
+
+    workdir = tempfile.mkdtemp(prefix="vivy-parity-")
+    result_file = os.path.join(workdir, "parity.json")
+    subprocess.run(
+        [
+            sys.executable,
+            os.path.abspath(__file__),
+            "--worker",
+            "parity",
+            "--workdir",
+            workdir,
+            "--result",
+            result_file,
+            "--parity",
+            os.path.abspath(args.parity) if args.parity else "",
+        ],
+        stdout=None if args.verbose else subprocess.DEVNULL,
+        check=True,
+    )
+    with open(result_file, "r", encoding="utf-8") as file:
+        result = json.load(file)
+
+    print(
+        f"{result['pages']} pages, {len(result['mismatches'])} mismatches, "
+        + f"{result['reference_ms']:.2f} ms per page with a full BS4 tree, "
+        + f"{result['parser_ms']:.2f} ms per page with parse_poems"
+    )
+    for name in result["mismatches"]:
+        print(f"  Mismatch: {name}")
+
+    return 1 if result["mismatches"] else 0
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> dict:
+    """Comparison Method
+
+    Description:
+        Compares the results of every pipeline against a baseline run. A
+        result is a regression when it is worse than the baseline by more
+        than the threshold: lower for throughput, higher for latency and
+        memory.
+
+    Information:
+        :param results: Results of each pipeline
+        :type results: dict
+        :param baseline: Results of each pipeline in the baseline run
+        :type baseline: dict
+        :param threshold: Relative change counted as a regression
+        :type threshold: float
+        :return: Baseline, current value, change, and regression flag of
+            each compared result of each pipeline
+        :rtype: dict
+    """
+
+    comparison = {}
+    for pipeline, result in results.items():
+        if pipeline not in baseline:
+            continue
+        for key in COMPARED:
+            old, new = baseline[pipeline].get(key), result.get(key)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            worse = -change if key in HIGHER_IS_BETTER else change
+            comparison.setdefault(pipeline, {})[key] = {
+                "baseline": old,
+                "current": new,
+                "change": change,
+                "regression": worse > threshold,
+            }
+
+    return comparison
+
+
+def git_commit() -> str:
+    """Return the commit of the benchmarked code, if it is known"""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=REPO_LOC,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(args: argparse.Namespace) -> int:
+    """Main Method
+
+    Description:
+        Starts the stand-in server, runs every requested pipeline in its own
+        process and folder, saves the results, and compares them against
+        the baseline if one is given.
+
+    Information:
+        :param args: Parsed command line arguments
+        :type args: argparse.Namespace
+        :return: Exit code, 1 if a regression was found
+        :rtype: int
+    """
+
+    server = StandInServer(args.latency, args.failure_rate, args.file_size)
+    url = server.start()
+    workdir = tempfile.mkdtemp(prefix="vivy-benchmark-")
+
+    # Run each pipeline in a fresh process
+    results = {}
+    try:
+        for pipeline in args.pipelines:
+            folder = os.path.join(workdir, pipeline)
+            os.makedirs(folder)
+            result_file = os.path.join(workdir, f"{pipeline}.json")
+            print(f"Benchmarking {pipeline}...", flush=True)
+            subprocess.run(
+                [
+                    sys.executable,
+                    os.path.abspath(__file__),
+                    "--worker",
+                    pipeline,
+                    "--workdir",
+                    folder,
+                    "--result",
+                    result_file,
+                    "--url",
+                    url,
+                    "--documents",
+                    str(args.documents),
+                    "--store",
+                    args.store,
+                    "--threads",
+                    str(args.threads),
+                    "--workers",
+                    str(args.workers),
+                ]
+                + ["--copy-mode", args.copy_mode]
+                + (["--packed"] if args.packed else []),
+                stdout=None if args.verbose else subprocess.DEVNULL,
+                check=True,
+            )
+            with open(result_file, "r", encoding="utf-8") as file:
+                results[pipeline] = json.load(file)
+    finally:
+        server.stop()
+
+    # Save the results with everything needed to reproduce them
+    output = {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {
+            "documents": args.documents,
+            "latency": args.latency,
+            "failure_rate": args.failure_rate,
+            "file_size": args.file_size,
+            "store": args.store,
+            "threads": args.threads,
+            "workers": args.workers,
+            "packed": args.packed,
+            "copy_mode": args.copy_mode,
+        },
+        "results": results,
+    }
+    if args.baseline is not None:
+        with open(args.baseline, "r", encoding="utf-8") as file:
+            baseline = json.load(file)
+        output["comparison"] = compare(
+            results, baseline["results"], args.threshold
+        )
+
+    output_file = args.output or os.path.join(
+        RESULTS_LOC, f"benchmark-{time.strftime('%Y%m%d-%H%M%S')}.json"
+    )
+    os.makedirs(os.path.dirname(output_file) or ".", exist_ok=True)
+    with open(output_file, "w", encoding="utf-8") as file:
+        json.dump(output, file, indent=4)
+
+    # Print a summary
+    for pipeline, result in results.items():
+        p50 = result["p50"] or 0
+        p99 = result["p99"] or 0
+        rss = result["peak_rss_mb"] or 0
+        print(
+            f"{pipeline}: {result['docs_per_sec']:.1f} docs/sec, "
+            + f"p50 {p50 * 1000:.1f} ms, p99 {p99 * 1000:.1f} ms, "
+            + f"peak RSS {rss:.0f} MB, "
+            + f"{result.get('failures', 0)} failures"
+        )
+    regressions = 0
+    for pipeline, changes in output.get("comparison", {}).items():
+        for key, change in changes.items():
+            flag = "REGRESSION" if change["regression"] else "ok"
+            regressions += change["regression"]
+            print(f"  {pipeline} {key}: {change['change']:+.1%} {flag}")
+    print(f"Results saved to {output_file}")
+
+    return 1 if regressions else 0
+
+
+# Main run thread
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__.split("Description:")[-1].strip()
+    )
+    parser.add_argument(
+        "--documents",
+        type=int,
+        default=DOCUMENTS,
+        help="synthetic documents per pipeline",
+    )
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=LATENCY,
+        help="seconds of latency per response",
+    )
+    parser.add_argument(
+        "--failure-rate",
+        type=float,
+        default=FAILURE_RATE,
+        help="share of paths failing at first",
+    )
+    parser.add_argument(
+        "--file-size",
+        type=int,
+        default=FILE_SIZE,
+        help="bytes of each MIDI file",
+    )
+    parser.add_argument(
+        "--store",
+        default=STORE,
+        choices=("sqlite", "mongo"),
+        help="scratch index store",
+    )
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=PAGE_THREADS,
+        help="threads of the pages pipeline",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=SORT_WORKERS,
+        help="processes of the sort/filter pipeline",
+    )
+    parser.add_argument(
+        "--packed",
+        action="store_true",
+        help="pack the sort/filter output instead of copying the files",
+    )
+    parser.add_argument(
+        "--copy-mode",
+        default="reflink",
+        choices=MODES,
+        help="first copy mode tried by the sort/filter pipeline",
+    )
+    parser.add_argument(
+        "--pipelines", nargs="+", default=list(PIPELINES), choices=PIPELINES
+    )
+    parser.add_argument("--output", help="file to save the results to")
+    parser.add_argument("--baseline", help="results file to compare against")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=THRESHOLD,
+        help="relative change counted as a regression",
+    )
+    parser.add_argument(
+        "--verbose", action="store_true", help="show the pipelines' output"
+    )
+    parser.add_argument(
+        "--parity",
+        nargs="?",
+        const="",
+        help="check the poem parser against a full BS4 parse on the stored "
+        + "pages of a page cache folder, or on synthetic pages",
+    )
+    parser.add_argument(
+        "--worker", choices=PIPELINES + ("parity",), help=argparse.SUPPRESS
+    )
+    parser.add_argument("--workdir", help=argparse.SUPPRESS)
+    parser.add_argument("--result", help=argparse.SUPPRESS)
+    parser.add_argument("--url", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker is not None:
+        run_worker(args)
+    elif args.parity is not None:
+        sys.exit(parity(args))
+    else:
+        sys.exit(main(args))
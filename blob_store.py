@@ -0,0 +1,333 @@
+"""
+File Name:      blob_store.py
+
+Authors:        Benjamin Herrera
+
+Date Created:   17 OCT 2026
+
+Date Modified:  17 OCT 2026
+
+Description:    Class to handle a content-addressed store of downloaded files
+                shared by every document of a data handle
+"""
+
+# Imports
+import os
+import json
+import shutil
+import hashlib
+
+# Constants
+HASH_CHUNK_SIZE = 1024 * 1024  # Bytes read at a time when hashing a file
+MAX_SIZE = 256 * 1024 * 1024  # Most bytes a downloaded file may hold
+BLOCKED_TYPES = (
+    "text/html",
+    "application/xhtml+xml",
+)  # Content types of the error and login pages served in place of a file
+
+
+def check_response(headers: object, offset: int, max_size: int) -> None:
+    """Response Check Function
+
+    Description:
+        Rejects a response before its body is read if its Content-Type is
+        one of BLOCKED_TYPES, or if its Content-Length says the file would
+        hold more than max_size bytes. Raises a ValueError, which the
+        download scheduler doesn't retry.
+
+    Information:
+        :param headers: Headers of the response, from urllib or aiohttp
+        :type headers: object
+        :param offset: Bytes of the file already downloaded, if the response
+            resumes it
+        :type offset: int
+        :param max_size: Most bytes the file may hold
+        :type max_size: int
+        :return: None
+        :rtype: None
+    """
+
+    content_type = headers.get("Content-Type", "").split(";")[0]
+    if content_type.strip().lower() in BLOCKED_TYPES:
+        raise ValueError(f'Unexpected content type "{content_type}"')
+
+    length = headers.get("Content-Length", "")
+    if length.isdigit() and offset + int(length) > max_size:
+        raise ValueError(f"File is larger than {max_size} bytes")
+
+
+def hash_file(file_path: str) -> object:
+    """Return the SHA-256 hash object of a file's content"""
+    sha256 = hashlib.sha256()
+    with open(file_path, "rb") as file:
+        for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b""):
+            sha256.update(chunk)
+    return sha256
+
+
+class BlobWriter:
+    """Blob Writing Class
+
+    Description:
+        Writes a download to its temporary path as it arrives, hashing and
+        counting the bytes on the way, so the file never has to be read
+        again to be stored. A resumed download first hashes the bytes
+        already on disk.
+
+            with BlobWriter(part_path, offset) as writer:
+                for chunk in response:
+                    writer.write(chunk)
+            os.replace(part_path, file_path)
+            digest = writer.digest()
+
+        A file growing past the maximum size is removed and a ValueError is
+        raised, as a restarted download would only grow past it again.
+
+    Methods:
+        BlobWriter(str, int, int) -> None
+        write(bytes) -> None
+        digest() -> dict
+    """
+
+    def __init__(
+        self, file_path: str, offset: int = 0, max_size: int = MAX_SIZE
+    ) -> None:
+        """Constructor for Blob Writing Class
+
+        Description:
+            Opens the file, appending to it if the download is resumed, and
+            hashes the bytes already in it.
+
+        Information:
+            :param file_path: The path to write the download to
+            :type file_path: str
+            :param offset: Bytes already in the file to keep, or 0 to start
+                over
+            :type offset: int
+            :param max_size: Most bytes the file may hold
+            :type max_size: int
+            :return: None
+            :rtype: None
+        """
+
+        self.PATH = file_path
+        self.MAX_SIZE = max_size
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+
+        # Hash the bytes of the resumed download
+        if offset > 0:
+            self.sha256 = hash_file(file_path)
+            self.size = os.path.getsize(file_path)
+
+        self.file = open(file_path, "ab" if offset > 0 else "wb")
+
+    def __enter__(self) -> "BlobWriter":
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.file.close()
+
+    def write(self, chunk: bytes) -> None:
+        """Writing Method
+
+        Description:
+            Appends a chunk of the download to the file and to the hash.
+
+        Information:
+            :param chunk: The chunk to append
+            :type chunk: bytes
+            :return: None
+            :rtype: None
+        """
+
+        self.size += len(chunk)
+
+        # Drop the file once it grows past the maximum size
+        if self.size > self.MAX_SIZE:
+            self.file.close()
+            os.remove(self.PATH)
+            raise ValueError(f"File is larger than {self.MAX_SIZE} bytes")
+
+        self.sha256.update(chunk)
+        self.file.write(chunk)
+
+    def digest(self) -> dict:
+        """Return the SHA-256 hash and size of the bytes written"""
+        return {"sha256": self.sha256.hexdigest(), "size": self.size}
+
+
+class BlobStore:
+    """Blob Store Class
+
+    Description:
+        Stores every downloaded file once, under the SHA-256 hash of its
+        content, and remembers which URL each file came from:
+
+            <path_to_folder>
+            └───blobs
+                ├───urls.jsonl
+                ├───tmp
+                └───<first_two_hash_characters>
+                    └───<hash>.<extension>
+
+        The URL map is kept in memory and appended to urls.jsonl, so a URL
+        downloaded once, in this run or a previous one, is never downloaded
+        again. Documents get their files by hard linking the blob into their
+        own directory, which costs no extra disk space.
+
+    Methods:
+        BlobStore(str) -> None
+        lookup(str) -> dict
+        temp_path(str) -> str
+        put(str, str, dict) -> dict
+        link(dict, str) -> None
+    """
+
+    def __init__(self, path: str) -> None:
+        """Constructor for Blob Store Class
+
+        Description:
+            Creates the store's folders inside the given folder if they don't
+            exist and loads the URL map.
+
+        Information:
+            :param path: Path to the folder of the data handle
+            :type path: str
+            :return: None
+            :rtype: None
+        """
+
+        self.PATH = path
+        self.BLOBS = f"{path}/blobs"
+        self.URLS = f"{self.BLOBS}/urls.jsonl"
+        os.makedirs(f"{self.BLOBS}/tmp", exist_ok=True)
+
+        # Load the URL map written by previous runs
+        self.urls = {}
+        if os.path.exists(self.URLS):
+            with open(self.URLS, "r", encoding="utf-8") as file:
+                for line in file:
+                    record = json.loads(line)
+                    self.urls[record["url"]] = record
+
+    def lookup(self, url: str) -> dict:
+        """URL Lookup Method
+
+        Description:
+            Returns the blob record of a URL if it was already downloaded and
+            its blob still exists.
+
+        Information:
+            :param url: The URL to look up
+            :type url: str
+            :return: The blob record, or None if the URL is not stored
+            :rtype: dict
+        """
+
+        record = self.urls.get(url)
+
+        # Ignore records whose blob was removed
+        if record is None or not os.path.exists(
+            f"{self.PATH}/{record['blob']}"
+        ):
+            return None
+
+        return record
+
+    def temp_path(self, url: str) -> str:
+        """Temporary Path Method
+
+        Description:
+            Returns the path a URL is downloaded to before it is moved into
+            the store. The path only depends on the URL, so an interrupted
+            download is found again by the next run.
+
+        Information:
+            :param url: The URL to download
+            :type url: str
+            :return: The temporary path for the URL
+            :rtype: str
+        """
+
+        name = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        return f"{self.BLOBS}/tmp/{name}"
+
+    def put(self, url: str, file_path: str, digest: dict = None) -> dict:
+        """Blob Insertion Method
+
+        Description:
+            Moves a downloaded file into the store under the hash of its
+            content and records the URL it came from. If a blob with the same
+            content already exists, the file is discarded instead. The file
+            is only hashed if its hash and size aren't given, as they are by
+            a BlobWriter.
+
+            A blob record looks like this:
+
+                {
+                    "url": "https://www.cpdl.org/.../song.mid",
+                    "blob": "./blobs/3f/3f2a...9c.mid",
+                    "sha256": "3f2a...9c",
+                    "size": 20480
+                }
+
+        Information:
+            :param url: The URL the file was downloaded from
+            :type url: str
+            :param file_path: The path of the downloaded file
+            :type file_path: str
+            :param digest: The SHA-256 hash and size of the file, if known
+            :type digest: dict
+            :return: The blob record of the file
+            :rtype: dict
+        """
+
+        # Hash the file's content if it wasn't hashed while downloading
+        if digest is None:
+            digest = {
+                "sha256": hash_file(file_path).hexdigest(),
+                "size": os.path.getsize(file_path),
+            }
+        sha256 = digest["sha256"]
+        size = digest["size"]
+
+        # Blobs keep the extension of the URL's file
+        extension = os.path.splitext(url.split("/")[-1])[1].lower()
+        blob = f"./blobs/{sha256[:2]}/{sha256}{extension}"
+
+        # Move the file into the store unless the content is already there
+        if os.path.exists(f"{self.PATH}/{blob}"):
+            os.remove(file_path)
+        else:
+            os.makedirs(f"{self.BLOBS}/{sha256[:2]}", exist_ok=True)
+            os.replace(file_path, f"{self.PATH}/{blob}")
+
+        # Record the URL in memory and in the URL map file
+        record = {"url": url, "blob": blob, "sha256": sha256, "size": size}
+        self.urls[url] = record
+        with open(self.URLS, "a", encoding="utf-8") as file:
+            file.write(json.dumps(record) + "\n")
+
+        return record
+
+    def link(self, record: dict, file_path: str) -> None:
+        """Blob Linking Method
+
+        Description:
+            Makes a blob available under the given path with a hard link,
+            falling back to a copy where hard links are not supported.
+
+        Information:
+            :param record: The blob record to link
+            :type record: dict
+            :param file_path: The path to link the blob to
+            :type file_path: str
+            :return: None
+            :rtype: None
+        """
+
+        try:
+            os.link(f"{self.PATH}/{record['blob']}", file_path)
+        except OSError:
+            shutil.copy(f"{self.PATH}/{record['blob']}", file_path)
@@ -0,0 +1,213 @@
+"""
+File Name:      checkpoint_handle.py
+
+Authors:        Benjamin Herrera
+
+Date Created:   17 OCT 2026
+
+Date Modified:  17 OCT 2026
+
+Description:    Class to handle append-only checkpoint logs of a data handle's
+                index and error records
+"""
+
+# Imports
+import os
+import time
+import uuid
+import threading
+import contextlib
+from bson.json_util import dumps
+
+# Constants
+LOCK_POLL = 0.1  # Seconds between attempts to take the lock
+LOCK_STALE = 1800  # Seconds after which a lock is assumed to be abandoned
+LOCK_REFRESH = 60  # Seconds between touches of a held lock
+
+
+class CheckpointHandle:
+    """Checkpoint Handling Class
+
+    Description:
+        Keeps an append-only log of the index and error records written since
+        the last compaction, next to the full exports of a data handle:
+
+            <path_to_folder>
+            ├───index_en.json
+            ├───index_en.log.jsonl
+            ├───error_en.json
+            ├───error_en.log.jsonl
+            └───checkpoint.lock
+
+        The full exports are either the JSON files above or the sharded
+        exports with their manifests, the same format for every compaction
+        of a handle.
+
+        A checkpoint only appends the new records to the logs, so its cost
+        does not grow with the size of the index. A compaction rewrites the
+        full exports and empties the logs. The current state is the full
+        export with the log replayed on top of it: the last index record and
+        the first error record seen for an ID win.
+
+        Appends and compactions from every process are serialized through a
+        lock file, so only one writer touches the files at a time.
+
+    Methods:
+        CheckpointHandle(str) -> None
+        lock(bool) -> bool
+        append(list, list) -> None
+        compact(object, bool) -> bool
+    """
+
+    def __init__(self, path: str) -> None:
+        """Constructor for Checkpoint Handling Class
+
+        Description:
+            Sets up the paths of the logs and of the lock file inside the
+            given folder.
+
+        Information:
+            :param path: Path to the folder of the data handle
+            :type path: str
+            :return: None
+            :rtype: None
+        """
+
+        self.PATH = path
+        self.LOCK = f"{path}/checkpoint.lock"
+        self.LOGS = {
+            "index": f"{path}/index_en.log.jsonl",
+            "error": f"{path}/error_en.log.jsonl",
+        }
+
+    @contextlib.contextmanager
+    def lock(self, blocking: bool = True) -> bool:
+        """Lock Method
+
+        Description:
+            Context manager that takes the lock file for the duration of the
+            block. Yields True once the lock is held. If blocking is False and
+            another process holds the lock, yields False right away instead.
+            Lock files older than LOCK_STALE seconds are assumed to belong to
+            a crashed process and are removed. A held lock is touched every
+            LOCK_REFRESH seconds, so long compactions never look abandoned,
+            and it is only removed at the end if it still holds this owner's
+            token.
+
+        Information:
+            :param blocking: Whether to wait for the lock
+            :type blocking: bool
+            :return: Whether the lock was taken
+            :rtype: bool
+        """
+
+        # Try to create the lock file until it succeeds
+        while True:
+            try:
+                fd = os.open(self.LOCK, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                break
+            except FileExistsError:
+                pass
+
+            # Remove the lock if its owner has been gone for too long
+            try:
+                if time.time() - os.path.getmtime(self.LOCK) > LOCK_STALE:
+                    os.remove(self.LOCK)
+                    continue
+            except FileNotFoundError:
+                continue
+
+            # Give up if not waiting, otherwise wait and retry
+            if not blocking:
+                yield False
+                return
+            time.sleep(LOCK_POLL)
+
+        # Record the owner and keep the lock fresh until the block finishes
+        token = f"{os.getpid()}:{uuid.uuid4().hex}"
+        stopped = threading.Event()
+
+        def refresh() -> None:
+            """Touch the lock while it is held"""
+            while not stopped.wait(LOCK_REFRESH):
+                if self._owner() == token:
+                    os.utime(self.LOCK)
+
+        thread = threading.Thread(target=refresh, daemon=True)
+        try:
+            os.write(fd, token.encode())
+            os.close(fd)
+            thread.start()
+            yield True
+        finally:
+            stopped.set()
+            if thread.is_alive():
+                thread.join()
+            if self._owner() == token:
+                os.remove(self.LOCK)
+
+    def _owner(self) -> str:
+        """Return the token of the lock's owner, or None if it is free"""
+        try:
+            with open(self.LOCK, "r", encoding="utf-8") as file:
+                return file.read()
+        except FileNotFoundError:
+            return None
+
+    def append(self, index_docs: list, error_docs: list) -> None:
+        """Log Appending Method
+
+        Description:
+            Appends index and error records to their logs, one line of JSON
+            per record.
+
+        Information:
+            :param index_docs: Index records to append
+            :type index_docs: list[dict]
+            :param error_docs: Error records to append
+            :type error_docs: list[dict]
+            :return: None
+            :rtype: None
+        """
+
+        # Return if there is nothing to write
+        if index_docs == [] and error_docs == []:
+            return
+
+        # Append each kind of record to its log while holding the lock
+        with self.lock():
+            for kind, docs in (("index", index_docs), ("error", error_docs)):
+                if docs == []:
+                    continue
+                with open(self.LOGS[kind], "a", encoding="utf-8") as file:
+                    file.write("".join(dumps(doc) + "\n" for doc in docs))
+
+    def compact(self, export: object, blocking: bool = True) -> bool:
+        """Compaction Method
+
+        Description:
+            Rewrites the full exports with the given function and empties the
+            logs, all while holding the lock. If blocking is False and another
+            process is already writing, nothing is done.
+
+        Information:
+            :param export: Function that rewrites the full exports
+            :type export: object
+            :param blocking: Whether to wait for the lock
+            :type blocking: bool
+            :return: Whether the compaction ran
+            :rtype: bool
+        """
+
+        with self.lock(blocking) as locked:
+            # Skip if another process holds the lock
+            if not locked:
+                return False
+
+            export()  # Rewrite the full exports
+
+            # Empty the logs as their records are now in the exports
+            for log in self.LOGS.values():
+                open(log, "w", encoding="utf-8").close()
+
+        return True
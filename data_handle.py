@@ -5,7 +5,7 @@ Authors:        Benjamin Herrera
 
 Date Created:   21 JAN 2023
 
-Date Modified:  28 JAN 2023
+Date Modified:  17 OCT 2026
 
 Description:    Class to handle the downloading and storing of large files,
                 while also indexing miscellaneous information.
@@ -14,14 +14,104 @@ Description:    Class to handle the downloading and storing of large files,
 # Imports
 import os
 import re
-import json
+import time
 import uuid
 import shutil
+import textwrap
+import threading
+import concurrent.futures
+import urllib.error
+import urllib.parse
 import urllib.request
+import multiprocessing.util
 from bson.json_util import dumps
-from mongo_handle import MongoHandle
+from index_store import MongoIndexStore, SQLiteIndexStore
+from checkpoint_handle import CheckpointHandle
+from blob_store import BlobStore, BlobWriter, MAX_SIZE, check_response
+from shard_export import ShardWriter
+from packed_dataset import PackedWriter
+from file_copy import copy_file
+from memory_index import MemoryIndex
+from midi_check import CHUNKSIZE, validate_file, score
+from download_scheduler import DownloadScheduler
+from metrics import METRICS
+
+VERSION = "v1.2.0"  # Versioning for the documents
+BUFFER_SIZE = 500  # Number of buffered writes that triggers a flush
+BUFFER_INTERVAL = 5  # Seconds after which buffered writes are flushed
+STORE = "mongo"  # Scratch index store: "mongo", or "sqlite" to run locally
+EXPORT_BATCH_SIZE = 1000  # Documents fetched per cursor batch when exporting
+EXPORT_COMPRESSION = "gzip"  # Compression of sharded exports, or "zstd"
+SHARDED_EXPORT = False  # Export compressed shards instead of index_en.json
+CHUNK_SIZE = 1024 * 1024  # Bytes read from a response body at a time
+TIMEOUT = 120  # Seconds allowed for a connection to respond
+RANGE_NOT_SATISFIABLE = 416  # HTTP status for a range past the end of a file
+COPY_MODE = "copy"  # First copy mode tried by copy, see file_copy.copy_file
+COPY_WORKERS = 8  # Threads copying files in copy_many
+VALIDATE_WORKERS = 8  # Processes checking MIDI files in validate
+MIDI_EXTENSIONS = (".mid", ".midi")  # Extensions of the files validated
+
+
+def download_file(link: str, file_path: str, max_size: int = MAX_SIZE) -> dict:
+    """File Download Function
 
-VERSION = "v1.1.0"  # Versioning for the documents
+    Description:
+        Downloads a link to the given path. The body is written to
+        "<file_path>.part" and renamed to the final path once complete, so a
+        file under its final name is always whole. If a partial file is left
+        over from an interrupted transfer, only the missing bytes are
+        requested with an HTTP Range header. Servers that ignore the range
+        send the whole body, which replaces the partial file.
+
+        The body is hashed while it is written, and responses that are too
+        large or aren't files are rejected, see blob_store.check_response.
+
+    Information:
+        :param link: The link to download
+        :type link: str
+        :param file_path: The path to write the file to
+        :type file_path: str
+        :param max_size: Most bytes the file may hold
+        :type max_size: int
+        :return: The SHA-256 hash and size of the file
+        :rtype: dict
+    """
+
+    part_path = f"{file_path}.part"  # Path written to while downloading
+
+    # Request only the missing bytes if a partial file exists
+    offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    request = urllib.request.Request(link)
+    if offset > 0:
+        request.add_header("Range", f"bytes={offset}-")
+
+    try:
+        response = urllib.request.urlopen(request, timeout=TIMEOUT)
+
+    # A range starting at the end of the file means it is already complete
+    except urllib.error.HTTPError as e:
+        if offset > 0 and e.code == RANGE_NOT_SATISFIABLE:
+            with BlobWriter(part_path, offset, max_size) as writer:
+                pass
+            os.replace(part_path, file_path)
+            return writer.digest()
+        raise
+
+    # Append if the server resumed at the offset, otherwise start over
+    with response:
+        resumed = response.status == 206 and response.headers.get(
+            "Content-Range", ""
+        ).startswith(f"bytes {offset}-")
+        offset = offset if resumed else 0
+        check_response(response.headers, offset, max_size)
+
+        # Write and hash the body as it arrives
+        with BlobWriter(part_path, offset, max_size) as writer:
+            for chunk in iter(lambda: response.read(CHUNK_SIZE), b""):
+                writer.write(chunk)
+
+    os.replace(part_path, file_path)  # Move the completed file into place
+    return writer.digest()
 
 
 class DataHandle:
@@ -32,11 +122,28 @@ class DataHandle:
         of any data.
 
     Methods:
-        DataHandle(str) -> None
+        DataHandle(str, str, str, bool) -> None
         insert(int, str, str) -> dict
+        copy(str, dict, str) -> dict
+        copy_many(list, int) -> list
+        pack(PackedWriter, str, dict) -> dict
+        validate(int, list) -> list
+        error_handle(dict, str, str, list) -> None
+        remove_errors(list) -> None
+        flush() -> None
+        checkpoint(bool) -> None
+        is_complete(str) -> bool
+        mark_complete(str) -> None
+        compile_index_and_errors(bool, int) -> None
     """
 
-    def __init__(self, path: str) -> None:
+    def __init__(
+        self,
+        path: str,
+        store: str = STORE,
+        copy_mode: str = COPY_MODE,
+        sharded: bool = SHARDED_EXPORT,
+    ) -> None:
         """Constructor for Data Handling Class
 
         Description:
@@ -56,9 +163,28 @@ class DataHandle:
             The path parameter must have the "/" character to standardize
             discrepancies in path naming.
 
+            The index and error records are held in a scratch store until
+            they are exported. The "mongo" store keeps them in temp MongoDB
+            collections. The "sqlite" store keeps them in an embedded
+            database inside the folder and needs no MongoDB server.
+
+            Files are copied in with the given copy mode: "hardlink",
+            "reflink", "copy_file_range", or "copy". Modes the platform or
+            filesystem doesn't support fall back to the next one.
+
+            Every compaction, periodic or final, exports the index and errors
+            in the same format: sharded if sharded is True, else index_en.json
+            and error_en.json.
+
         Information:
             :param path: Path to the folder
             :type path: str
+            :param store: Scratch index store to use, "mongo" or "sqlite"
+            :type store: str
+            :param copy_mode: First copy mode tried by copy
+            :type copy_mode: str
+            :param sharded: Whether to export compressed shards
+            :type sharded: bool
             :return: None
             :rtype: None
         """
@@ -77,31 +203,210 @@ class DataHandle:
 
         self.PATH = os.path.abspath(path)  # Store the path as an absolute path
 
-        self.index = json.load(
-            open(path + "index.json", "r+")
-        )  # Get the contents of index.json
-
-        # Establish MongoDB DB connection for temp holding
-        suffix = self.PATH.split(os.sep)[-2]
-        self.MONGO_DB = MongoHandle()
-        self.COL = self.MONGO_DB.get_client()["VIVYDownload_en"][
-            f"{suffix}_INDEX"
-        ]
-        self.ERROR = self.MONGO_DB.get_client()["VIVYDownload_en"][
-            f"{suffix}_ERROR"
-        ]
-
-        # Seed it with index.json information
-        if self.index != []:
-            self.COL.insert_many(self.index)
-
-    def error_handle(self, data: dict, error: str, link: str) -> None:
+        # Documents of index.json by ID, only read once they are first used
+        self.INDEX = MemoryIndex(self.PATH)
+
+        # Open the scratch store for temp holding. The MongoDB collections
+        # are looked up through the process's shared client on every use.
+        self.SUFFIX = self.PATH.split(os.sep)[-2]
+        if store == "sqlite":
+            self.STORE = SQLiteIndexStore(self.PATH)
+        elif store == "mongo":
+            self.STORE = MongoIndexStore(self.SUFFIX)
+        else:
+            raise ValueError(f'Unknown index store "{store}"')
+        self.STORE_NAME = store
+
+        # Buffers holding index and error writes until they are flushed
+        self.index_buffer = []
+        self.error_buffer = []
+        self.buffer_lock = threading.Lock()
+        self.last_flush = time.monotonic()
+
+        # Load the IDs of the source documents completed by previous runs
+        self.MANIFEST = f"{self.PATH}/completed.txt"
+        self.completed = set()
+        if os.path.exists(self.MANIFEST):
+            with open(self.MANIFEST, "r", encoding="utf-8") as file:
+                self.completed = set(file.read().split())
+
+        self.COPY_MODE = copy_mode  # First copy mode tried by copy
+        self.SHARDED = sharded  # Export format of every compaction
+
+        # Retries transient download failures and honours Retry-After
+        self.SCHEDULER = DownloadScheduler()
+
+        # Content-addressed store holding every downloaded file once, and
+        # locks of the links being downloaded by this process's threads
+        self.BLOBS = BlobStore(self.PATH)
+        self.fetch_lock = threading.Lock()
+        self.fetch_locks = {}
+
+        # Append-only logs of the records flushed since the last compaction
+        self.CHECKPOINT = CheckpointHandle(self.PATH)
+
+        # Seed the scratch store with index.json information
+        self.SEEDED = f"{self.PATH}/index.seeded"
+        self._seed()
+
+        # Flush the buffers when the process exits. A multiprocessing
+        # finalizer is used instead of atexit as it also runs when pool
+        # worker processes shut down. Finalizers only run in the process
+        # that registered them, so forked workers register their own.
+        multiprocessing.util.Finalize(self, self.flush, exitpriority=10)
+        multiprocessing.util.register_after_fork(
+            self,
+            lambda handle: multiprocessing.util.Finalize(
+                handle, handle.flush, exitpriority=10
+            ),
+        )
+
+    def _seed(self) -> None:
+        """Seeding Method
+
+        Description:
+            Seeds the scratch store with the documents of index.json, once
+            per version of the file. The store and the version of index.json
+            last seeded are written to a marker file, so later handles of the
+            folder, like those of every worker process, only check the
+            marker instead of reading index.json.
+
+        Information:
+            :return: None
+            :rtype: None
+        """
+
+        def seeded() -> bool:
+            """Return whether the marker file matches"""
+            try:
+                with open(self.SEEDED, "r", encoding="utf-8") as file:
+                    return file.read() == self._seed_marker()
+            except FileNotFoundError:
+                return False
+
+        # Seed while holding the checkpoint lock, so only one process does
+        if seeded():
+            return
+        with self.CHECKPOINT.lock():
+            if seeded():
+                return
+            documents = list(self.INDEX)
+            if documents != []:
+                self.STORE.seed(documents)
+            self._mark_seeded()
+
+    def _seed_marker(self) -> str:
+        """Return the marker of the current store and index.json"""
+        return f"{self.STORE_NAME}:{self.SUFFIX}:{self.INDEX.stamp()}"
+
+    def _mark_seeded(self) -> None:
+        """Record the current store and index.json as seeded"""
+        with open(self.SEEDED, "w", encoding="utf-8") as file:
+            file.write(self._seed_marker())
+
+    def _buffer(self, buffer: list, document: dict) -> None:
+        """Write Buffering Method
+
+        Description:
+            Adds a record to the given buffer and flushes every buffer once
+            the size or time threshold is reached.
+
+        Information:
+            :param buffer: The buffer to add the record to
+            :type buffer: list
+            :param document: The record to write
+            :type document: dict
+            :return: None
+            :rtype: None
+        """
+
+        with self.buffer_lock:
+            buffer.append(document)
+            size = len(self.index_buffer) + len(self.error_buffer)
+            elapsed = time.monotonic() - self.last_flush
+
+        # Flush once either threshold is reached
+        if size >= BUFFER_SIZE or elapsed >= BUFFER_INTERVAL:
+            self.flush()
+
+    def _buffer_index(self, data: dict) -> None:
+        """Buffer an upsert of an index document"""
+        self._buffer(self.index_buffer, data)
+
+    def flush(self) -> None:
+        """Buffer Flushing Method
+
+        Description:
+            Writes every buffered index and error document to the scratch
+            store as one batch, then appends them to the checkpoint logs.
+
+        Information:
+            :return: None
+            :rtype: None
+        """
+
+        # Take the buffered records and reset the buffers
+        with self.buffer_lock:
+            index_docs, error_docs = self.index_buffer, self.error_buffer
+            self.index_buffer = []
+            self.error_buffer = []
+            self.last_flush = time.monotonic()
+
+        if index_docs == [] and error_docs == []:
+            return
+
+        # Write the batch, then log it for the next checkpoint
+        with METRICS.track("store_write"):
+            self.STORE.write(index_docs, error_docs)
+        METRICS.count("records_total", len(index_docs), table="index")
+        METRICS.count("records_total", len(error_docs), table="error")
+        self.CHECKPOINT.append(index_docs, error_docs)
+
+    def is_complete(self, id: str) -> bool:
+        """Completion Check Method
+
+        Description:
+            Checks the completion manifest for a source document, so finished
+            documents can be skipped before any network or DB work.
+
+        Information:
+            :param id: The ID of the source document
+            :type id: str
+            :return: Whether the document was completed
+            :rtype: bool
+        """
+
+        return str(id) in self.completed
+
+    def mark_complete(self, id: str) -> None:
+        """Completion Marking Method
+
+        Description:
+            Records a source document as completed in the completion manifest.
+            The manifest is append-only with one ID per line, so it survives
+            crashes and can be shared by several processes.
+
+        Information:
+            :param id: The ID of the source document
+            :type id: str
+            :return: None
+            :rtype: None
+        """
+
+        self.completed.add(str(id))
+        with open(self.MANIFEST, "a", encoding="utf-8") as file:
+            file.write(f"{id}\n")
+
+    def error_handle(
+        self, data: dict, error: str, link: str, links: list = None
+    ) -> None:
         """Data Handle Function
 
         Description:
             Handles the erred data when it could not be inserted into DB.
-            Specifically, stores the data and the error message into a MongoDB
-            collection.
+            Specifically, stores the data and the error message into the
+            scratch store. Failed insertions also store every link of the
+            document, so the insertion can be replayed.
 
         Information:
             :param data: Data that was erred
@@ -110,45 +415,332 @@ class DataHandle:
             :type error: str
             :param link: Link that could've been the error
             :type link: str
+            :param links: Every link of the failed insertion
+            :type links: list[str]
             :return: None
             :rtype: None
         """
 
-        # Return nothing if the ID exist
-        if self.ERROR.find_one({"_id": data["_id"]}) is not None:
-            return
+        record = {
+            "_id": data["_id"],
+            "data": data,
+            "error": error,
+            "link": link,
+        }
+        if links is not None:
+            record["links"] = links
 
-        # Insert error into error collection
-        self.ERROR.insert_one(
-            {"_id": data["_id"], "data": data, "error": error, "link": link}
-        )
+        # Buffer the error. The store keeps the first error recorded for an
+        # ID, as the previous find-then-insert did.
+        self._buffer(self.error_buffer, record)
+
+    def remove_errors(self, ids: list) -> None:
+        """Error Removal Method
+
+        Description:
+            Removes the error records of items that succeeded when they were
+            retried. Buffered records are flushed first, so none of them is
+            written back afterwards. The exports reflect the removal once
+            they are compiled again.
+
+        Information:
+            :param ids: The IDs of the error records to remove
+            :type ids: list[str]
+            :return: None
+            :rtype: None
+        """
+
+        self.flush()
+        if ids != []:
+            self.STORE.remove("error", ids)
+
+    def _export(
+        self, table: str, file_name: str, lines: bool, batch_size: int
+    ) -> None:
+        """Table Export Method
+
+        Description:
+            Streams a table of the scratch store to a file one document at a
+            time, so memory use stays flat regardless of its size. The file
+            is written under a temporary name and renamed once complete, so a
+            reader never sees a half-written export.
+
+            By default the output is the same indented JSON array that
+            json.dump produces. If lines is True, every document is instead
+            written as a single line of JSON (JSON Lines).
+
+        Information:
+            :param table: The table to export, "index" or "error"
+            :type table: str
+            :param file_name: The path of the file to write
+            :type file_name: str
+            :param lines: Whether to write JSON Lines instead of an array
+            :type lines: bool
+            :param batch_size: Documents fetched per cursor batch
+            :type batch_size: int
+            :return: None
+            :rtype: None
+        """
+
+        cursor = self.STORE.iterate(table, batch_size)  # Make cursor
+        temp_name = f"{file_name}.{os.getpid()}.tmp"  # Per-process temp file
+
+        # Write every document to a temp file as it is read from the cursor
+        with open(temp_name, "w", encoding="utf-8") as file:
+            if lines:
+                for document in cursor:
+                    file.write(dumps(document) + "\n")
+            else:
+                separator = "[\n"
+                for document in cursor:
+                    file.write(separator)
+                    file.write(
+                        textwrap.indent(dumps(document, indent=4), " " * 4)
+                    )
+                    separator = ",\n"
+                file.write("[]" if separator == "[\n" else "\n]")
+
+        os.replace(temp_name, file_name)  # Swap in the new export
+
+    def _export_shards(self, table: str, name: str, batch_size: int) -> None:
+        """Sharded Export Method
+
+        Description:
+            Streams a table of the scratch store to compressed JSON Lines
+            shards and a "<name>.manifest.json" manifest in the folder. See
+            ShardWriter for the layout.
+
+        Information:
+            :param table: The table to export, "index" or "error"
+            :type table: str
+            :param name: Name of the export, like "index_en"
+            :type name: str
+            :param batch_size: Documents fetched per cursor batch
+            :type batch_size: int
+            :return: None
+            :rtype: None
+        """
+
+        writer = ShardWriter(self.PATH, name, compression=EXPORT_COMPRESSION)
+        for document in self.STORE.iterate(table, batch_size):
+            writer.write(document["_id"], dumps(document))
+        writer.close()  # Swap in the manifest of the new export
 
-    def compile_index_and_errors(self) -> None:
+    def compile_index_and_errors(
+        self,
+        lines: bool = False,
+        batch_size: int = EXPORT_BATCH_SIZE,
+    ) -> None:
         """Index Compile Method
 
         Description:
-            Compile temp data from MongoDB temp collection to index.json file
+            Compile temp data from the scratch store to index_en.json and
+            error_en.json files. The tables are streamed to disk in
+            batches rather than loaded into memory. If lines is True, the
+            files are written as JSON Lines to index_en.jsonl and
+            error_en.jsonl instead. If the handle exports shards, the tables
+            are written as compressed JSON Lines shards with the
+            index_en.manifest.json and error_en.manifest.json manifests, which
+            ShardReader streams a shard at a time. Exports of the other
+            formats are removed, so only one is ever next to the logs.
+
+            This is the compaction step of the checkpoint logs. It waits for
+            any other process writing the files and empties the logs once the
+            full exports are written.
 
         Information:
+            :param lines: Whether to write JSON Lines instead of JSON arrays
+            :type lines: bool
+            :param batch_size: Documents fetched per cursor batch
+            :type batch_size: int
             :return: None
             :rtype: None
         """
 
-        cursor = self.COL.find({})  # Generate cursor
+        self.flush()  # Write out any buffered documents first
+        self._compact(lines, batch_size, blocking=True)
+
+    def _compact(self, lines: bool, batch_size: int, blocking: bool) -> bool:
+        """Compaction Method
+
+        Description:
+            Streams both tables to their export files in the handle's export
+            format, removes the exports of the other formats, and empties the
+            checkpoint logs while holding the checkpoint lock.
+
+        Information:
+            :param lines: Whether to write JSON Lines instead of JSON arrays
+            :type lines: bool
+            :param batch_size: Documents fetched per cursor batch
+            :type batch_size: int
+            :param blocking: Whether to wait for another writer to finish
+            :type blocking: bool
+            :return: Whether the compaction ran
+            :rtype: bool
+        """
+
+        def export() -> None:
+            """Stream both tables to their files"""
+            # Fold the changes to index.json in, which the store already has
+            if self.INDEX.compact():
+                self._mark_seeded()
+
+            extension = "jsonl" if lines else "json"
+            for table in ("index", "error"):
+                name = f"{table}_en"
+                if self.SHARDED:
+                    self._export_shards(table, name, batch_size)
+                else:
+                    self._export(
+                        table,
+                        f"{self.PATH}/{name}.{extension}",
+                        lines,
+                        batch_size,
+                    )
+
+                # Remove the exports of the other formats, which are stale
+                kept = "manifest.json" if self.SHARDED else extension
+                for stale in ("json", "jsonl", "manifest.json"):
+                    if stale != kept and os.path.exists(
+                        f"{self.PATH}/{name}.{stale}"
+                    ):
+                        os.remove(f"{self.PATH}/{name}.{stale}")
+
+        return self.CHECKPOINT.compact(export, blocking)
+
+    def checkpoint(self, compact: bool = False) -> None:
+        """Checkpoint Method
+
+        Description:
+            Flushes the buffered records, which appends them to the checkpoint
+            logs. The cost of a checkpoint only depends on the records written
+            since the last one. If compact is True, the full exports are also
+            rewritten, unless another process is already doing so.
+
+        Information:
+            :param compact: Whether to also compact the logs
+            :type compact: bool
+            :return: None
+            :rtype: None
+        """
+
+        self.flush()  # Write out and log the buffered documents
+
+        # Rewrite the full exports if requested and no one else is
+        if compact:
+            self._compact(False, EXPORT_BATCH_SIZE, blocking=False)
+
+    def _prepare_insert(
+        self,
+        method: int,
+        title: str,
+        composer: str,
+        text: str,
+        url: str,
+        links: list,
+        custom_id: str = None,
+        count: int = 0,
+    ) -> tuple:
+        """Insertion Preparation Method
+
+        Description:
+            Builds the index document for a datapoint and filters the given
+            links down to the MIDI files that will be downloaded. Shared by
+            the synchronous and asynchronous insertion paths.
+
+        Information:
+            :param method: The methodology used to gather the information of
+                the datapoint
+            :type method: int
+            :param title: The name of the song
+            :type title: str
+            :param composer: The composer of the song
+            :type composer: str
+            :param text: The text associated to the datapoint
+            :type text: str
+            :param url: The url of the song page
+            :type url: str
+            :param links: The links to the digital content for the datapoint
+            :type links: list[str]
+            :param custom_id: The ID to use instead of a random one
+            :type custom_id: str
+            :param count: Suffix appended to the document's ID
+            :type count: int
+            :return: The ID, the index document, and the MIDI links
+            :rtype: tuple[str, dict, list[str]]
+        """
+
+        id = (
+            str(uuid.uuid4()).replace("-", "")
+            if custom_id is None
+            else custom_id
+        )  # Create an unique ID
+
+        text = re.sub(r"'{2,}", "", text)
+
+        # Set up the document to input
+        data = {
+            "_id": f"{id}_{count}",
+            "title": re.sub("[^A-Za-z0-9 ]+", "", title).lower(),
+            "composer": composer.lower(),
+            "method": method,
+            "text": text,
+            "link": url,
+            "directory": f"./data/{id}/",
+            "files": [],
+            "version": VERSION,
+        }
+
+        # Only keep the links that point to MIDI files
+        links = [ln for ln in links if ".mid" in ln.split("/")[-1].lower()]
+
+        return id, data, links
+
+    def _fetch(self, link: str, file_path: str) -> dict:
+        """Blob Fetching Method
+
+        Description:
+            Makes the file of a link available under the given path through
+            the blob store. The link is only downloaded if the store does not
+            already hold it, so a file shared by several documents is
+            downloaded once. Threads fetching the same link wait for the
+            first one's download instead of starting their own.
+
+        Information:
+            :param link: The link of the file
+            :type link: str
+            :param file_path: The path to make the file available at
+            :type file_path: str
+            :return: The blob record of the file
+            :rtype: dict
+        """
+
+        # Take the link's lock so only one thread downloads it
+        with self.fetch_lock:
+            link_lock = self.fetch_locks.setdefault(link, threading.Lock())
+
+        with link_lock:
+            record = self.BLOBS.lookup(link)  # Check for an earlier download
 
-        # Overwrite index.json file for writing
-        with open(
-            f"{self.PATH}/index_en.json", "w+", encoding="utf-8"
-        ) as file:
-            json.dump(json.loads(dumps(cursor)), file, indent=4)
+            # Download the link into the store if it is not there yet,
+            # retrying transient failures
+            if record is None:
+                temp_path = self.BLOBS.temp_path(link)
+                with METRICS.track("download"):
+                    digest = self.SCHEDULER.run_sync(
+                        urllib.parse.urlsplit(link).netloc,
+                        lambda: download_file(link, temp_path),
+                    )
+                record = self.BLOBS.put(link, temp_path, digest)
+                METRICS.count("bytes_total", record["size"], stage="download")
 
-        cursor = self.ERROR.find({})  # Generate cursor
+        # Forget the lock once the link is stored
+        with self.fetch_lock:
+            self.fetch_locks.pop(link, None)
 
-        # Overwrite index.json file for writing
-        with open(
-            f"{self.PATH}/error_en.json", "w+", encoding="utf-8"
-        ) as file:
-            json.dump(json.loads(dumps(cursor)), file, indent=4)
+        self.BLOBS.link(record, file_path)  # Link the blob into place
+
+        return record
 
     def insert(
         self,
@@ -175,7 +767,8 @@ class DataHandle:
                 4. The methodology used to insert the document
                 5. The associating text to the datapoint
                 6. A filepath pointer to the data in the DB
-                7. A version to track what structure is the document in the
+                7. The blob records of the downloaded files
+                8. A version to track what structure is the document in the
                    index.json
 
             An example of the structure for an item in the index.json is
@@ -188,6 +781,15 @@ class DataHandle:
                     "method": 1,
                     "text": "Lorem Ipsum...",
                     "directory": "./data/c5741947f6ab466ca59fdd5853c8d779",
+                    "files": [
+                        {
+                            "name": "song.mid",
+                            "url": "https://www.cpdl.org/.../song.mid",
+                            "blob": "./blobs/3f/3f2a...9c.mid",
+                            "sha256": "3f2a...9c",
+                            "size": 20480
+                        }
+                    ],
                     "version": "v1.0.0"
                 }
 
@@ -229,67 +831,64 @@ class DataHandle:
 
         num_downloads = 0  # Variable declaration and initialization
 
-        id = (
-            str(uuid.uuid4()).replace("-", "")
-            if custom_id is None
-            else custom_id
-        )  # Create an unique ID
-
-        text = re.sub(r"'{2,}", "", text)
-
-        # Set up the document to input
-        data = {
-            "_id": f"{id}_{count}",
-            "title": re.sub("[^A-Za-z0-9 ]+", "", title).lower(),
-            "composer": composer.lower(),
-            "method": method,
-            "text": text,
-            "link": url,
-            "directory": f"./data/{id}/",
-            "version": VERSION,
-        }
+        # Build the index document and filter the downloadable links
+        id, data, links = self._prepare_insert(
+            method, title, composer, text, url, links, custom_id, count
+        )
 
-        # Insert new information to the temp MongoDB collection
-        self.COL.insert_one(data)
-        links = [ln for ln in links if ".mid" in ln.split("/")[-1].lower()]
         if len(links) > 0:
-            if not os.path.isdir(f"{self.PATH}/data/{id}/"):
-                # Create the datapoint's subdirectory into the DB
-                os.makedirs(f"{self.PATH}/data/{id}/")
+            # Create the datapoint's subdirectory into the DB
+            os.makedirs(f"{self.PATH}/data/{id}/", exist_ok=True)
 
-                # Iterate through the links and try to download them
+            # Iterate through the links and try to download them. The index
+            # document is buffered once its files are known, whether or not
+            # a download failed.
+            try:
                 for i in links:
-                    # Try to download the iterated link and increment download
+                    file_name = i.split("/")[-1]
+                    file_path = f"{self.PATH}/data/{id}/{file_name}"
+
+                    # Skip files completed by a previous run
+                    if os.path.exists(file_path):
+                        record = self.BLOBS.lookup(i) or {"url": i}
+                        data["files"].append({"name": file_name, **record})
+                        continue
+
+                    # Try to fetch the iterated link and increment download
                     # count
                     try:
-                        file_name = i.split("/")[-1]
-                        if ".mid" in file_name.lower():
-                            urllib.request.urlretrieve(
-                                i, f"{self.PATH}/data/{id}/{file_name}"
-                            )
+                        record = self._fetch(i, file_path)
+                        data["files"].append({"name": file_name, **record})
                         num_downloads += 1
 
-                    # Catch the exception and print the error, delete folder,
-                    # and return
+                    # Catch the exception, print the error, and return.
+                    # Partial and completed files are kept so a rerun can
+                    # resume.
                     except Exception as e:
                         print(f"Can't Download: {i}")  # Print error message
-                        shutil.rmtree(
-                            f"{self.PATH}/data/{id}/"
-                        )  # Remove folder
 
-                        # Call native error_handle function if none is provided
-                        # If not, call the provided one
+                        # Call native error_handle function if none is
+                        # provided. If not, call the provided one
                         if error_func is None:
-                            self.error_handle(data, str(e), i)
+                            self.error_handle(data, str(e), i, links)
                         else:
                             error_func(data, str(e))
 
                         return  # Return
-            return {
-                "Status": True,
-                "ID": id,
-                "Message": "Files already exist.",
-            }
+            finally:
+                self._buffer_index(data)
+
+            # Return if every file was completed by a previous run
+            if num_downloads == 0:
+                return {
+                    "Status": True,
+                    "ID": id,
+                    "Message": "Files already exist.",
+                }
+
+        # Buffer new information for the scratch store
+        else:
+            self._buffer_index(data)
 
         # Return a success message
         return {
@@ -299,7 +898,9 @@ class DataHandle:
             + f"{num_downloads}/{len(links)} files downloaded.",
         }
 
-    def copy(self, from_path: str, index_doc: dict) -> dict:
+    def copy(
+        self, from_path: str, index_doc: dict, file_name: str = None
+    ) -> dict:
         """Data Copier Method
 
         Description:
@@ -307,41 +908,220 @@ class DataHandle:
             Also applies the copied file's associated index information to this
             database's index. The parameter "from_path" must be a direct path.
 
+            The file is copied with the handle's copy mode, see
+            file_copy.copy_file. Copying a document again replaces its file,
+            so reruns succeed.
+
         Information:
             :param from_path: The path of the file to copy
             :type from_path: str
             :param index_doc: Index data associated to the file copied
             :type index_doc: dict
+            :param file_name: Name to give the copy instead of the name of
+                the copied file
+            :type file_name: str
             :return: Return status message
             :rtype: dict
         """
 
-        filename = from_path.split("\\")[-1]  # Get filename
-
-        os.makedirs(
-            f"{self.PATH}/data/{index_doc['_id']}/"
-        )  # Create the datapoint's subdirectory into the DB
+        # Get filename
+        filename = (
+            os.path.basename(from_path) if file_name is None else file_name
+        )
+        folder = f"{self.PATH}/data/{index_doc['_id']}/"
 
         # Try to copy
         try:
+            # Create the datapoint's subdirectory into the DB
+            os.makedirs(folder, exist_ok=True)
+
             # Copy files over to the directory
-            shutil.copy(
-                from_path, f"{self.PATH}/data/{index_doc['_id']}/{filename}"
+            with METRICS.track("copy"):
+                mode = copy_file(
+                    from_path, f"{folder}{filename}", self.COPY_MODE
+                )
+            METRICS.count("files_total", stage="copy", mode=mode)
+            METRICS.count(
+                "bytes_total", os.path.getsize(from_path), stage="copy"
             )
 
         # Catch error and handle
         except Exception as e:
-            shutil.rmtree(
-                f"{self.PATH}/data/{index_doc['_id']}/"
-            )  # Remove folder
+            # Remove the folder if it was left empty
+            try:
+                os.rmdir(folder)
+            except OSError:
+                pass
             self.error_handle(index_doc, str(e), from_path)  # Handle error
             return  # Return
 
-        self.COL.insert_one(index_doc)  # Add information to the index
+        self._buffer_index(index_doc)  # Add information to the index
 
         # Return a success message
         return {"Status": True, "Message": f"{index_doc['_id']} copied over."}
 
+    def copy_many(self, copies: list, workers: int = COPY_WORKERS) -> list:
+        """Batch Copier Method
+
+        Description:
+            Copy several files at once with a pool of threads. Each copy is
+            made and indexed like with copy, and failures are reported
+            through the error handle.
+
+        Information:
+            :param copies: The arguments of each copy: the path of the file,
+                its index data, and optionally the name to give the copy
+            :type copies: list[tuple]
+            :param workers: Threads copying files
+            :type workers: int
+            :return: The status message of each copy, or None if it failed
+            :rtype: list[dict]
+        """
+
+        with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+            return list(executor.map(lambda args: self.copy(*args), copies))
+
+    def pack(
+        self, writer: PackedWriter, from_path: str, index_doc: dict
+    ) -> dict:
+        """Data Packing Method
+
+        Description:
+            Append a file and its document's text to a packed dataset instead
+            of copying it into the data folder. The document's index entry
+            gets a "packed" field with the shard and position of its record.
+
+        Information:
+            :param writer: Writer of the packed dataset
+            :type writer: PackedWriter
+            :param from_path: The path of the file to pack
+            :type from_path: str
+            :param index_doc: Index data associated to the file packed
+            :type index_doc: dict
+            :return: Return status message
+            :rtype: dict
+        """
+
+        # Try to pack
+        try:
+            with METRICS.track("pack"):
+                with open(from_path, "rb") as file:
+                    midi = file.read()
+                location = writer.write(
+                    index_doc, midi, index_doc.get("text") or ""
+                )
+            METRICS.count("bytes_total", len(midi), stage="pack")
+
+        # Catch error and handle
+        except Exception as e:
+            self.error_handle(index_doc, str(e), from_path)  # Handle error
+            return  # Return
+
+        # Add information to the index
+        self._buffer_index({**index_doc, "packed": location})
+
+        # Return a success message
+        return {"Status": True, "Message": f"{index_doc['_id']} packed."}
+
+    def validate(
+        self, workers: int = VALIDATE_WORKERS, ids: list = None
+    ) -> list:
+        """MIDI Validation Method
+
+        Description:
+            Checks the downloaded MIDI files of the indexed documents with a
+            pool of processes, parsing only their chunk structure (see
+            midi_check.parse_midi). The result is recorded in the file's
+            record, so files already checked are skipped by later runs:
+
+                "files": [
+                    {
+                        "name": "song.mid",
+                        ...
+                        "midi": {
+                            "format": 1,
+                            "tracks": 4,
+                            "division": 480,
+                            "ticks": 92160,
+                            "duration": 96.0
+                        }
+                    }
+                ]
+
+            Files that aren't valid get a "midi" record with an "error"
+            message instead. Documents with MIDI files but no valid one are
+            reported through the error handle.
+
+        Information:
+            :param workers: Processes checking files
+            :type workers: int
+            :param ids: The IDs of the documents to check again, or None to
+                check the files of every document that weren't checked yet
+            :type ids: list[str]
+            :return: The IDs of the documents without a valid MIDI file
+            :rtype: list[str]
+        """
+
+        self.flush()
+
+        # List the files to check. Only their paths are kept in memory.
+        documents = (
+            self.STORE.iterate("index", EXPORT_BATCH_SIZE)
+            if ids is None
+            else filter(None, (self.STORE.find("index", id) for id in ids))
+        )
+        files = []  # Document ID, name, and path of each file to check
+        for document in documents:
+            for file in document.get("files", []):
+                extension = os.path.splitext(file["name"])[1].lower()
+                if extension in MIDI_EXTENSIONS and (
+                    ids is not None or "midi" not in file
+                ):
+                    path = os.path.join(
+                        self.PATH, document["directory"], file["name"]
+                    )
+                    files.append((document["_id"], file["name"], path))
+
+        # Check the files, a chunk of them per task
+        results = {}
+        with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+            checked = executor.map(
+                validate_file,
+                [path for _, _, path in files],
+                chunksize=CHUNKSIZE,
+            )
+            for (id, name, _), result in zip(files, checked):
+                results.setdefault(id, {})[name] = result
+        invalid = sum(
+            "error" in result
+            for found in results.values()
+            for result in found.values()
+        )
+        METRICS.count("files_total", len(files) - invalid, stage="validate")
+        METRICS.count("failures_total", invalid, stage="validate")
+
+        # Record the results and report the documents without a valid file
+        failed = []
+        for id, found in results.items():
+            document = self.STORE.find("index", id)
+            for file in document["files"]:
+                if file["name"] in found:
+                    file["midi"] = found[file["name"]]
+            self._buffer_index(document)
+
+            best = max(
+                (file for file in document["files"] if "midi" in file),
+                key=lambda file: score(file["midi"]),
+            )
+            if "error" in best["midi"]:
+                failed.append(id)
+                self.error_handle(
+                    document, best["midi"]["error"], best.get("url", id)
+                )
+
+        self.flush()
+        return failed
+
     def update(self, id: str, **kwargs: object) -> dict:
         """Document Update Method
 
@@ -438,12 +1218,15 @@ class DataHandle:
         num_downloads = 0
         success_message = "Update success."
 
-        # If the ID is not in index.json, return a false message
-        if id not in self.index:
+        # Look the document up in index.json, then in the scratch store
+        document = self.INDEX.get(id) or self.STORE.find("index", id)
+
+        # If the ID is not in the index, return a false message
+        if document is None:
             return {"Status": False, "Message": "ID not found in DB"}
 
         # If links was provided, but not add, return a false message
-        if "links" not in kwargs and "add" not in kwargs:
+        if "links" in kwargs and "add" not in kwargs:
             return {
                 "Status": False,
                 "Message": '"add" parameter not specified',
@@ -455,26 +1238,35 @@ class DataHandle:
             # update success message
             if item == "additional":
                 for field in kwargs["additional"]:
-                    self.index[id][field] = kwargs["additional"][field]
+                    document[field] = kwargs["additional"][field]
                     success_message += f'\nAdded "{field}" information'
 
             # Add or Replace the downloaded content if the iterated item is
             # "links"
-            if item == "links":
+            elif item == "links":
                 # If add is false, delete the folder and recreate it
                 if not kwargs["add"]:
-                    shutil.rmtree(f"{self.PATH}/data/{id}/")
-                    os.makedirs(f"{self.PATH}/data/{id}/")
+                    shutil.rmtree(
+                        f"{self.PATH}/data/{id}/", ignore_errors=True
+                    )
+                    document["files"] = []
+                os.makedirs(f"{self.PATH}/data/{id}/", exist_ok=True)
 
                 # Iterate through the links and try to download them
                 for i in kwargs["links"]:
-                    # Try to download the iterated link and increment download
-                    # count
+                    # Try to fetch the iterated link, record its blob in
+                    # place of a file with the same name, and increment
+                    # download count
                     try:
                         file_name = i.split("/")[-1]
-                        urllib.request.urlretrieve(
+                        record = self._fetch(
                             i, f"{self.PATH}/data/{id}/{file_name}"
                         )
+                        document["files"] = [
+                            file
+                            for file in document.get("files", [])
+                            if file.get("name") != file_name
+                        ] + [{"name": file_name, **record}]
                         num_downloads += 1
 
                     # Catch the exception and print the error
@@ -488,13 +1280,14 @@ class DataHandle:
                 )
 
             # Directly change the document's field if otherwise and update
-            # success message
-            else:
-                self.index[id][item] = kwargs[item]
-                success_message += f'\nUpdated "{field}" information'
-
-        # Write changes
-        self.__write_index()
+            # success message. "add" only qualifies "links".
+            elif item != "add":
+                document[item] = kwargs[item]
+                success_message += f'\nUpdated "{item}" information'
+
+        # Write changes to the journal of index.json and to the store
+        self.INDEX.put(document)
+        self._buffer_index(document)
 
         # Return a message
         return {"Status": True, "ID": id, "Message": success_message}
@@ -0,0 +1,439 @@
+"""
+File Name:      download_scheduler.py
+
+Authors:        Benjamin Herrera
+
+Date Created:   17 OCT 2026
+
+Date Modified:  17 OCT 2026
+
+Description:    Class to schedule downloads per host with adaptive concurrency,
+                rate limiting, and retries
+"""
+
+# Imports
+import time
+import random
+import asyncio
+import weakref
+import threading
+import contextlib
+import email.utils
+import http.client
+import urllib.error
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+# Constants
+INITIAL_LIMIT = 4  # Concurrent transfers allowed to a new host
+MIN_LIMIT = 1  # Lowest concurrency a host can be throttled to
+MAX_LIMIT = 16  # Highest concurrency a host can grow to
+RETRIES = 5  # Attempts made after the first one for a transient failure
+BASE_DELAY = 1.0  # Seconds of backoff before the first retry
+MAX_DELAY = 60.0  # Most seconds of backoff between two attempts
+SMOOTHING = 0.2  # Weight of the newest sample in the moving averages
+LATENCY_FACTOR = 3.0  # Slowdown over the best latency that stops growth
+RETRY_STATUSES = (408, 425, 429, 500, 502, 503, 504)  # Transient statuses
+NETWORK_ERRORS = (
+    urllib.error.URLError,
+    http.client.HTTPException,
+    ConnectionError,
+    TimeoutError,
+    asyncio.TimeoutError,
+) + (
+    (aiohttp.ClientError,) if aiohttp is not None else ()
+)  # Errors of a transfer that didn't get a response
+
+
+def backoff(attempt: int) -> float:
+    """Backoff Function
+
+    Description:
+        Returns the seconds to wait before a retry, using exponential
+        backoff with full jitter: a random delay between zero and
+        BASE_DELAY * 2 ** attempt, capped at MAX_DELAY.
+
+    Information:
+        :param attempt: The number of attempts made so far, starting at 0
+        :type attempt: int
+        :return: Seconds to wait
+        :rtype: float
+    """
+
+    return random.uniform(0, min(MAX_DELAY, BASE_DELAY * 2**attempt))
+
+
+def retry_after(error: Exception) -> float:
+    """Retry-After Function
+
+    Description:
+        Returns the seconds a server asked to wait through the Retry-After
+        header of an HTTP error, given either as seconds or as an HTTP date.
+        Returns None if the header is missing or can't be parsed.
+
+    Information:
+        :param error: The error raised for the response
+        :type error: Exception
+        :return: Seconds to wait, or None
+        :rtype: float
+    """
+
+    headers = getattr(error, "headers", None)
+    value = headers.get("Retry-After") if headers is not None else None
+    if value is None:
+        return None
+
+    # Parse the header as seconds, then as an HTTP date
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        date = email.utils.parsedate_to_datetime(value)
+        return max(0.0, date.timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def is_transient(error: Exception) -> bool:
+    """Transient Error Check Function
+
+    Description:
+        Checks whether a failed transfer is worth retrying. Works for both
+        urllib and aiohttp errors. HTTP errors are transient if their status
+        is one of RETRY_STATUSES. Errors without a status are transient if
+        they are one of NETWORK_ERRORS, such as timeouts and dropped
+        connections, unless they come from an invalid request. Local errors,
+        such as a full disk or a missing file, are raised right away.
+
+    Information:
+        :param error: The error raised by the transfer
+        :type error: Exception
+        :return: Whether the transfer should be retried
+        :rtype: bool
+    """
+
+    status = getattr(error, "status", None) or getattr(error, "code", None)
+    if isinstance(status, int):
+        return status in RETRY_STATUSES
+
+    return isinstance(error, NETWORK_ERRORS) and not isinstance(
+        error, ValueError
+    )
+
+
+class HostState:
+    """Host State Class
+
+    Description:
+        Holds the concurrency limit and the measurements of a single host.
+
+    Methods:
+        HostState() -> None
+    """
+
+    def __init__(self) -> None:
+        """Constructor for Host State Class
+
+        Description:
+            Starts a host at the initial concurrency limit with no
+            measurements.
+
+        Information:
+            :return: None
+            :rtype: None
+        """
+
+        self.limit = float(INITIAL_LIMIT)  # Allowed concurrent transfers
+        self.in_flight = 0  # Transfers currently running
+        self.latency = None  # Moving average of transfer seconds
+        self.best_latency = None  # Lowest transfer seconds seen
+        self.error_rate = 0.0  # Moving average of failed transfers
+        self.blocked_until = 0.0  # Time before which no transfer may start
+        # Wake transfers waiting for a free slot, one per event loop
+        self.conditions = weakref.WeakKeyDictionary()
+        self.gate = None  # Wakes blocking transfers waiting for a free slot
+
+
+class DownloadScheduler:
+    """Download Scheduling Class
+
+    Description:
+        Decides how many transfers may run against each host at once and
+        retries transient failures.
+
+        Each host's concurrency limit follows AIMD: every successful transfer
+        grows it by about one per round of transfers, as long as the host's
+        latency stays within LATENCY_FACTOR of the best seen. Every throttled
+        or failed transfer halves it. A Retry-After header pauses all new
+        transfers to the host for the requested time.
+
+        Transient failures are retried up to RETRIES times with jittered
+        exponential backoff, so only persistent failures reach the caller.
+
+        The blocking counterpart, run_sync, may be called from any number of
+        threads: the host states are only changed under a lock, and blocking
+        transfers wait for a slot under their host's limit as well.
+
+    Methods:
+        DownloadScheduler(int, int) -> None
+        run(str, object) -> object
+        run_sync(str, object) -> object
+        stats() -> dict
+    """
+
+    def __init__(
+        self, max_limit: int = MAX_LIMIT, retries: int = RETRIES
+    ) -> None:
+        """Constructor for Download Scheduling Class
+
+        Description:
+            Creates a scheduler with no known hosts.
+
+        Information:
+            :param max_limit: Highest concurrency a host can grow to
+            :type max_limit: int
+            :param retries: Attempts made after the first one
+            :type retries: int
+            :return: None
+            :rtype: None
+        """
+
+        self.MAX_LIMIT = max_limit
+        self.RETRIES = retries
+        self.hosts = {}
+        self.lock = threading.RLock()  # Guards the host states
+
+    def _host(self, host: str) -> HostState:
+        """Return the state of a host, creating it if it is new"""
+        with self.lock:
+            if host not in self.hosts:
+                self.hosts[host] = HostState()
+                self.hosts[host].gate = threading.Condition(self.lock)
+            return self.hosts[host]
+
+    def _record(
+        self, host: str, latency: float, error: Exception = None
+    ) -> None:
+        """Measurement Recording Method
+
+        Description:
+            Updates a host's measurements and concurrency limit after a
+            transfer.
+
+        Information:
+            :param host: The host of the transfer
+            :type host: str
+            :param latency: Seconds the transfer took
+            :type latency: float
+            :param error: The error of a failed transfer, if any
+            :type error: Exception
+            :return: None
+            :rtype: None
+        """
+
+        with self.lock:
+            state = self._host(host)
+            failed = error is not None
+            state.error_rate += SMOOTHING * (failed - state.error_rate)
+
+            # Multiplicative decrease on a throttled or failed transfer
+            if failed:
+                if is_transient(error):
+                    state.limit = max(MIN_LIMIT, state.limit / 2)
+                    wait = retry_after(error)
+                    if wait is not None:
+                        state.blocked_until = max(
+                            state.blocked_until, time.monotonic() + wait
+                        )
+                return
+
+            # Track the latency of successful transfers
+            state.latency = (
+                latency
+                if state.latency is None
+                else state.latency + SMOOTHING * (latency - state.latency)
+            )
+            state.best_latency = min(state.best_latency or latency, latency)
+
+            # Additive increase while the host keeps up, which may free a
+            # slot for a waiting blocking transfer
+            if state.latency <= state.best_latency * LATENCY_FACTOR:
+                state.limit = min(
+                    self.MAX_LIMIT, state.limit + 1 / state.limit
+                )
+                state.gate.notify_all()
+
+    @contextlib.asynccontextmanager
+    async def _slot(self, host: str) -> None:
+        """Slot Method
+
+        Description:
+            Asynchronous context manager that waits until the host is not
+            paused and has a free slot under its limit, and holds the slot
+            for the duration of the block.
+
+        Information:
+            :param host: The host to transfer from
+            :type host: str
+            :return: None
+            :rtype: None
+        """
+
+        # Conditions are bound to a loop, and every asyncio.run has its own
+        state = self._host(host)
+        loop = asyncio.get_running_loop()
+        with self.lock:
+            if loop not in state.conditions:
+                state.conditions[loop] = asyncio.Condition()
+            condition = state.conditions[loop]
+
+        # Wait out any pause, then for a free slot
+        async with condition:
+            while True:
+                wait = state.blocked_until - time.monotonic()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                elif state.in_flight < int(state.limit):
+                    break
+                else:
+                    await condition.wait()
+            state.in_flight += 1
+
+        # Release the slot and wake the waiting transfers
+        try:
+            yield
+        finally:
+            async with condition:
+                state.in_flight -= 1
+                condition.notify_all()
+
+    @contextlib.contextmanager
+    def _slot_sync(self, host: str) -> None:
+        """Blocking Slot Method
+
+        Description:
+            Blocking counterpart of the _slot method for transfers running
+            on threads. Waits until the host is not paused and has a free
+            slot under its limit, and holds the slot for the duration of the
+            block.
+
+        Information:
+            :param host: The host to transfer from
+            :type host: str
+            :return: None
+            :rtype: None
+        """
+
+        # Wait out any pause, then for a free slot
+        with self.lock:
+            state = self._host(host)
+            while True:
+                wait = state.blocked_until - time.monotonic()
+                if wait > 0:
+                    state.gate.wait(wait)
+                elif state.in_flight < int(state.limit):
+                    break
+                else:
+                    state.gate.wait()
+            state.in_flight += 1
+
+        # Release the slot and wake the waiting transfers
+        try:
+            yield
+        finally:
+            with self.lock:
+                state.in_flight -= 1
+                state.gate.notify_all()
+
+    async def run(self, host: str, func: object) -> object:
+        """Asynchronous Run Method
+
+        Description:
+            Runs a transfer coroutine function against a host within its
+            concurrency limit, retrying transient failures with backoff. The
+            last error is raised once the retries are used up.
+
+        Information:
+            :param host: The host of the transfer
+            :type host: str
+            :param func: Coroutine function that performs the transfer
+            :type func: object
+            :return: The result of the transfer
+            :rtype: object
+        """
+
+        for attempt in range(self.RETRIES + 1):
+            # Run the transfer within the host's limit and record the outcome
+            async with self._slot(host):
+                start = time.monotonic()
+                try:
+                    result = await func()
+                except Exception as e:
+                    self._record(host, time.monotonic() - start, e)
+                    if not is_transient(e) or attempt == self.RETRIES:
+                        raise
+                else:
+                    self._record(host, time.monotonic() - start)
+                    return result
+
+            await asyncio.sleep(backoff(attempt))  # Back off before retrying
+
+    def run_sync(self, host: str, func: object) -> object:
+        """Synchronous Run Method
+
+        Description:
+            Synchronous counterpart of the run method for blocking transfers,
+            which may run on any number of threads. Each transfer waits for
+            a slot under its host's limit and honours pauses, and transient
+            failures are retried with backoff.
+
+        Information:
+            :param host: The host of the transfer
+            :type host: str
+            :param func: Function that performs the transfer
+            :type func: object
+            :return: The result of the transfer
+            :rtype: object
+        """
+
+        for attempt in range(self.RETRIES + 1):
+            # Run the transfer within the host's limit and record the outcome
+            with self._slot_sync(host):
+                start = time.monotonic()
+                try:
+                    result = func()
+                except Exception as e:
+                    self._record(host, time.monotonic() - start, e)
+                    if not is_transient(e) or attempt == self.RETRIES:
+                        raise
+                else:
+                    self._record(host, time.monotonic() - start)
+                    return result
+
+            time.sleep(backoff(attempt))  # Back off before retrying
+
+    def stats(self) -> dict:
+        """Statistics Method
+
+        Description:
+            Returns the current limit and measurements of every host.
+
+        Information:
+            :return: The state of each host by name
+            :rtype: dict
+        """
+
+        with self.lock:
+            return {
+                host: {
+                    "limit": int(state.limit),
+                    "in_flight": state.in_flight,
+                    "latency": state.latency,
+                    "error_rate": state.error_rate,
+                }
+                for host, state in self.hosts.items()
+            }
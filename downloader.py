@@ -5,7 +5,7 @@ Authors:        Benjamin Herrera
 
 Date Created:   11 FEB 2023
 
-Date Modified:  11 FEB 2023
+Date Modified:  17 OCT 2026
 
 Description:    Script to download the data based on documents that have both
                 links and text associated to themselves in the CPDL Collection
@@ -14,24 +14,156 @@ Description:    Script to download the data based on documents that have both
 # Imports
 from mongo_handle import MongoHandle
 from data_handle import DataHandle
-from bs4 import BeautifulSoup
-from typing import List
+from page_cache import PageCache
+from download_scheduler import DownloadScheduler
+from pipeline import Pipeline
+from metrics import METRICS
+from work_queue import MongoWorkQueue, SQLiteWorkQueue
+from bs4 import BeautifulSoup, SoupStrainer
+from bs4.dammit import EncodingDetector
+from bson import ObjectId
 import concurrent.futures
-import urllib.request
+import lxml.etree
+import lxml.html
+import time
+import urllib.parse
 
 # Constants
 CHECKPOINT_FREQUENCY = 100
-TARGET_LOC = "Data/Raw"
-DATA_HANDLE = DataHandle(TARGET_LOC)
+COMPACTION_FREQUENCY = 5000
+EXTRACT_WORKERS = 2  # Threads extracting texts from documents
+DOWNLOAD_WORKERS = 16  # Threads downloading files
+QUEUE_SIZE = 256  # Items queued between two stages before blocking
+REPORT_INTERVAL = 30  # Seconds between pipeline progress reports
+BATCH_SIZE = 500  # Documents fetched per cursor batch
+DERIVED_COLLECTION = "cpdlCOL_en"  # Collection of the pre-filtered documents
+USE_DERIVED = False  # Read the derived collection instead of rebuilding it
+SAVE_DERIVED = False  # Save the pre-filtered documents when rebuilding
+MIN_TEXT_LENGTH = 20  # Shorter texts are just the name of a language
+TARGET_LOC = "Data/Raw/"
+INDEX_STORE = "mongo"  # Scratch index store, or "sqlite" to run locally
+SHARDED_EXPORT = True  # Export compressed shards instead of index_en.json
+DATA_HANDLE = DataHandle(TARGET_LOC, store=INDEX_STORE, sharded=SHARDED_EXPORT)
 MONGO_DB = MongoHandle()
 COL = MONGO_DB.get_client()["VIVY"]["cpdlCOL"]
+WIKI_URL = "https://cpdl.org/wiki/index.php/"  # Prefix of the song pages
+CACHE_LOC = "Data/Cache/pages"
+CACHE_SIZE = 512 * 1024 * 1024  # Bytes of pages kept before evicting
+OFFLINE = False  # Only serve pages from the cache if True
+PAGE_CACHE = PageCache(CACHE_LOC, max_bytes=CACHE_SIZE, offline=OFFLINE)
+PAGE_SCHEDULER = DownloadScheduler()  # Limits and retries page fetches
+METRICS_LOC = "Data/Metrics/"  # Folder of the snapshots and stats.json
+METRICS_PORT = 9464  # Port of the Prometheus endpoint on localhost
+QUEUE_MODE = None  # Claim documents from a "mongo" or "sqlite" work queue
+QUEUE_LOC = "Data/Queue/"  # Folder of the "sqlite" work queue
+QUEUE_BATCH_SIZE = 50  # Documents claimed from the work queue at a time
+QUEUE = None  # Work queue of the documents, set by open_queue
+METRICS.configure(METRICS_LOC)
+PAGE_WORKERS = 8  # Threads fetching pages for a single link_parsers call
+POEMS = SoupStrainer("div", class_="poem")  # Poems for the BS4 fallback
+POEM_XPATH = (
+    "//div[contains(concat(' ', normalize-space(@class), ' ')," + " ' poem ')]"
+)  # Every div with the "poem" class, like BS4's class_="poem"
+LINK_XPATH = ".//a"  # Links inside a poem
+POEM_TEXT = (
+    ".//text()[not(ancestor::script or ancestor::style or ancestor::template"
+    + " or ancestor::rt or ancestor::rp)]"
+)  # Text of a poem, without the strings BS4 leaves out of .text
+
+
+def parse_poems(html: bytes) -> list:
+    """Poem Parser Method
+
+    Description:
+        Get the text bodies of a page: the text of every "div.poem" element
+        that holds no link. Only the poems are materialised: the page is
+        parsed by lxml and the poems are selected with XPath, instead of
+        building a full BS4 tree and searching it. The page is decoded the
+        way BS4 decodes it, and the text leaves out the same strings as
+        BS4's .text, so the output is the same as with BS4. Pages lxml can't
+        take as a string are parsed with BS4 restricted to the poems.
+
+    Information:
+        :param html: Source of the page
+        :type html: bytes
+        :return: list of translated text
+        :rtype: list[str]
+    """
+
+    # Decode the page with the first encoding BS4 would hand to lxml
+    for encoding in EncodingDetector(html, is_html=True).encodings:
+        try:
+            markup = html.decode(encoding, errors="replace")
+            break
+        except LookupError:
+            continue
+    else:
+        markup = html.decode("utf-8", errors="replace")
+
+    # Parse the page
+    try:
+        root = lxml.html.document_fromstring(markup)
+
+    # Fall back to BS4 for empty pages and XML encoding declarations
+    except (ValueError, lxml.etree.ParserError):
+        soup = BeautifulSoup(html, "lxml", parse_only=POEMS)
+        poems = soup.find_all("div", class_="poem")
+        return [poem.text for poem in poems if len(poem.find_all("a")) == 0]
+
+    # Return the text of the poems that hold no link
+    return [
+        "".join(poem.xpath(POEM_TEXT))
+        for poem in root.xpath(POEM_XPATH)
+        if not poem.xpath(LINK_XPATH)
+    ]
+
+
+def link_parsers(links: list) -> list:
+    """Link Parsers Method
+
+    Description:
+        Get text bodies from several link texts at once. The pages are
+        fetched concurrently through the page cache and parsed as they
+        arrive. Fetches are limited per host and transient failures are
+        retried by the page scheduler.
+
+    Information:
+        :param links: Strings of the links to the linktexts
+        :type links: list[str]
+        :return: list of translated text of each link, in order
+        :rtype: list[list[str]]
+    """
+
+    def parse(link: str) -> list:
+        """Fetch and parse a single page"""
+        # Get page's source information
+        url = f"{WIKI_URL}{link}"
+        with METRICS.track("page_fetch"):
+            html = PAGE_SCHEDULER.run_sync(
+                urllib.parse.urlsplit(url).netloc,
+                lambda: PAGE_CACHE.fetch(url),
+            )
+        METRICS.count("bytes_total", len(html), stage="page_fetch")
+
+        # Get page's poems
+        with METRICS.track("page_parse"):
+            return parse_poems(html)
+
+    if len(links) == 1:
+        return [parse(links[0])]
+
+    with concurrent.futures.ThreadPoolExecutor(
+        min(PAGE_WORKERS, len(links)) or 1
+    ) as executor:
+        return list(executor.map(parse, links))
 
 
 def link_parser(link: str) -> list:
     """Link Parser Method
 
     Description:
-        Get text bodies from a link text. Parses the information using BS4.
+        Get text bodies from a link text. Pages are fetched through the page
+        cache and parsed by the parse_poems method.
 
     Information:
         :param link: String of the link to the linktext
@@ -40,61 +172,203 @@ def link_parser(link: str) -> list:
         :rtype: list[str]
     """
 
-    # Calculate the link to the page
-    page = f"https://cpdl.org/wiki/index.php/{link}"
+    return link_parsers([link])[0]
 
-    # Get page's source information
-    soup = BeautifulSoup(urllib.request.urlopen(page), "lxml")
 
-    # Get page's poems
-    poems = soup.find_all("div", class_="poem")
+def english_texts() -> dict:
+    """English Texts Expression Method
 
-    # Return poems
-    return [poem.text for poem in poems if len(poem.find_all("a")) == 0]
+    Description:
+        Build the aggregation expression that pulls the English texts out of
+        a cpdlCOL document on the server. Every list in "translations" is
+        scanned for entries equal to "english", and the entry following each
+        of them is taken, as long as it is at least MIN_TEXT_LENGTH long.
+
+    Information:
+        :return: Aggregation expression evaluating to a list of texts
+        :rtype: dict
+    """
 
+    def is_text(value: object) -> dict:
+        """Expression checking that a value is a string"""
+        return {"$eq": [{"$type": value}, "string"]}
 
-def process(intake: List[int, dict]) -> None:
-    """Process Download Method
+    # Entry before the index being looked at, and the entry at the index
+    previous = {"$arrayElemAt": ["$$texts", {"$subtract": ["$$i", 1]}]}
+    current = {"$arrayElemAt": ["$$texts", "$$i"]}
+
+    # Indexes of the list whose previous entry is "english"
+    after_english = {
+        "$filter": {
+            "input": {"$range": [1, {"$size": "$$texts"}]},
+            "as": "i",
+            "cond": {
+                "$and": [
+                    is_text(previous),
+                    is_text(current),
+                    {
+                        "$eq": [
+                            {"$toLower": {"$trim": {"input": previous}}},
+                            "english",
+                        ]
+                    },
+                    {"$gte": [{"$strLenCP": current}, MIN_TEXT_LENGTH]},
+                ]
+            },
+        }
+    }
+
+    # Concatenate the English texts of every list in "translations"
+    return {
+        "$reduce": {
+            "input": {"$objectToArray": "$translations"},
+            "initialValue": [],
+            "in": {
+                "$concatArrays": [
+                    "$$value",
+                    {
+                        "$cond": [
+                            {"$isArray": "$$this.v"},
+                            {
+                                "$let": {
+                                    "vars": {"texts": "$$this.v"},
+                                    "in": {
+                                        "$map": {
+                                            "input": after_english,
+                                            "as": "i",
+                                            "in": current,
+                                        }
+                                    },
+                                }
+                            },
+                            [],
+                        ]
+                    },
+                ]
+            },
+        }
+    }
+
+
+def query(
+    batch_size: int = BATCH_SIZE,
+    use_derived: bool = USE_DERIVED,
+    save_derived: bool = SAVE_DERIVED,
+    ids: list = None,
+) -> object:
+    """Query Method
 
     Description:
-        For the given dictionary instance, process the information for the
-        downloading of content. This is utilized with multithreaded processes.
+        Get a cursor over the cpdlCOL documents that have links and English
+        text. The filtering is done by MongoDB: documents are projected down
+        to the fields the extract method uses, their English texts are
+        pulled out into an "english_texts" field, and documents without any
+        are dropped, so only what is needed crosses the wire.
+
+        If save_derived is True, the results are also merged into the
+        derived collection. If use_derived is True, the derived collection
+        is read instead of running the aggregation again.
+
+        If ids is given, only the documents with those IDs are read.
 
     Information:
-        :param intake: Dictionary/document to process for downloading
-        :type intake: List[int, dict]
-        :return: None
-        :rtype: None
+        :param batch_size: Documents fetched per cursor batch
+        :type batch_size: int
+        :param use_derived: Whether to read the derived collection
+        :type use_derived: bool
+        :param save_derived: Whether to save the results to the derived
+            collection
+        :type save_derived: bool
+        :param ids: IDs of the documents to read, or None to read them all
+        :type ids: list[str]
+        :return: Cursor over the pre-filtered documents
+        :rtype: pymongo.cursor.Cursor
     """
 
-    # Bifurcate the intake information
-    index, document = intake
+    derived = MONGO_DB.get_client()["VIVY"][DERIVED_COLLECTION]
+    selected = {} if ids is None else {"_id": {"$in": ids}}  # IDs to read
 
-    # Save temporary and error information on the specified save frequency
-    if index % CHECKPOINT_FREQUENCY == 0:
-        DATA_HANDLE.compile_index_and_errors()
+    # Read the previously saved results
+    if use_derived:
+        return derived.find(selected).batch_size(batch_size)
 
-    def insert_data():
-        """Insert current song data to the database"""
-        # Discard short texts. Some texts are just the name of a language.
-        if len(text) < 20:
-            return
-        nonlocal count
-        message = DATA_HANDLE.insert(
-            method=1,
-            title=title,
-            composer=document["general_information"]["composer"][0],
-            text=text,
-            url=document["link"],
-            links=document["download_links"][
-                list(document["download_links"].keys())[0]
+    pipeline = [
+        # Keep the documents that have links and text
+        {
+            "$match": {
+                "$and": [
+                    {"translations": {"$gt": {}}},
+                    {"download_links": {"$gt": {}}},
+                ]
+            }
+        },
+        # Keep the fields used by the extract method, only the first list of
+        # download links, and the English texts
+        {
+            "$project": {
+                "link": 1,
+                "title": 1,
+                "general_information.title": 1,
+                "general_information.composer": 1,
+                "download_links": {
+                    "$arrayToObject": [
+                        [
+                            {
+                                "$arrayElemAt": [
+                                    {"$objectToArray": "$download_links"},
+                                    0,
+                                ]
+                            }
+                        ]
+                    ]
+                },
+                "english_texts": english_texts(),
+            }
+        },
+        # Drop the documents without English text
+        {"$match": {"english_texts.0": {"$exists": True}}},
+    ]
+
+    # Only read the requested documents
+    if ids is not None:
+        pipeline.insert(0, {"$match": selected})
+
+    # Save the results and read them back from the derived collection
+    if save_derived and ids is None:
+        COL.aggregate(
+            pipeline
+            + [
+                {
+                    "$merge": {
+                        "into": DERIVED_COLLECTION,
+                        "whenMatched": "replace",
+                    }
+                }
             ],
-            custom_id=f"{document['_id']}_{count}",
+            allowDiskUse=True,
         )
-        count += 1
-        print(message["Message"])
+        return derived.find({}).batch_size(batch_size)
+
+    return COL.aggregate(pipeline, batchSize=batch_size, allowDiskUse=True)
+
 
-    # Print ID of the iterated document and get the correct text key
+def extract(document: dict) -> list:
+    """Extract Method
+
+    Description:
+        For the given dictionary instance, find the English texts and build
+        an insertion task for each of them. Documents without any English
+        text are recorded as completed right away.
+
+    Information:
+        :param document: Dictionary/document to process for downloading
+        :type document: dict
+        :return: Insertion tasks of the document's English texts
+        :rtype: list[dict]
+    """
+
+    # Print ID of the iterated document and get the correct text key. The
+    # documents of the query only have their English texts.
     print(f"--- {document['_id']} ---")
     key_text = "translations" if "translations" in document else "translation"
 
@@ -104,9 +378,34 @@ def process(intake: List[int, dict]) -> None:
         if "title" in document["general_information"]
         else document["title"].partition("(")[0]
     )
-    count = 0
+
+    def insert_data():
+        """Add an insertion task for the current song data"""
+        # Discard short texts. Some texts are just the name of a language.
+        if len(text) < MIN_TEXT_LENGTH:
+            return
+        inserts.append(
+            {
+                "method": 1,
+                "title": title,
+                "composer": document["general_information"]["composer"][0],
+                "text": text,
+                "url": document["link"],
+                "links": document["download_links"][
+                    list(document["download_links"].keys())[0]
+                ],
+                "custom_id": f"{document['_id']}_{len(inserts)}",
+            }
+        )
+
+    inserts = []
+
+    # Use the English texts pulled out by the query when available
+    for text in document.get("english_texts", []):
+        insert_data()
+
     # Iterate through the information listed in the translation
-    for text_body in document[key_text]:
+    for text_body in document.get(key_text, {}):
         # Attempt to process document
         try:
             # Iterate through the linktext's poems if the iterated information
@@ -118,33 +417,265 @@ def process(intake: List[int, dict]) -> None:
                 if insert:
                     insert_data()
                     insert = False
-                if text.strip().lower() == 'english':
+                if text.strip().lower() == "english":
                     insert = True
 
         # Catch and print errors
         except Exception:
             print("Error Occurred While Processing Document")
 
+    # Nothing to download, so the document is already complete
+    if inserts == []:
+        finish(document["_id"])
 
-# Main run thread
-if __name__ == "__main__":
-    # Get a cursor with the documents that have links and text
-    cursor = COL.find(
+    started = time.monotonic()  # Start of the document's latency
+    return [
         {
-            "$and": [
-                {"translations": {"$gt": {}}},
-                {"download_links": {"$gt": {}}},
-            ]
+            "document": document["_id"],
+            "total": len(inserts),
+            "started": started,
+            "insert": i,
         }
+        for i in inserts
+    ]
+
+
+def finish(id: str, failed: bool = False) -> None:
+    """Finish Method
+
+    Description:
+        Record a document as finished. Completed documents are added to the
+        completion manifest. In work queue mode, they are also marked as
+        done in the queue, and failed documents are handed back to it to be
+        retried by any worker.
+
+    Information:
+        :param id: The ID of the document
+        :type id: str
+        :param failed: Whether an insertion of the document failed
+        :type failed: bool
+        :return: None
+        :rtype: None
+    """
+
+    if not failed:
+        DATA_HANDLE.mark_complete(id)
+    if QUEUE is not None:
+        (QUEUE.fail if failed else QUEUE.complete)([id])
+
+
+def open_queue(mode: str = QUEUE_MODE) -> object:
+    """Queue Opening Method
+
+    Description:
+        Open the work queue shared by every machine downloading the
+        documents, and fill it with the IDs of the query's documents if it
+        is empty. Enqueuing is idempotent, so several machines may fill it
+        at the same time.
+
+    Information:
+        :param mode: The work queue to use, "mongo" or "sqlite"
+        :type mode: str
+        :return: The work queue
+        :rtype: WorkQueue
+    """
+
+    if mode == "mongo":
+        queue = MongoWorkQueue("cpdlCOL")
+    elif mode == "sqlite":
+        queue = SQLiteWorkQueue(QUEUE_LOC)
+    else:
+        raise ValueError(f'Unknown work queue "{mode}"')
+
+    # Fill the queue with the IDs of the documents to process
+    if sum(queue.counts().values()) == 0:
+        ids = []
+        for document in query():
+            ids.append(document["_id"])
+            if len(ids) == BATCH_SIZE:
+                queue.enqueue(ids)
+                ids = []
+        queue.enqueue(ids)
+
+    return queue
+
+
+def queued_documents(
+    queue: object, batch_size: int = QUEUE_BATCH_SIZE
+) -> object:
+    """Queued Documents Method
+
+    Description:
+        Yield the documents of the batches claimed from the work queue.
+        Documents this machine already completed are marked as done right
+        away instead of being processed again, and so are the claimed IDs
+        the query doesn't return, such as deleted documents or documents
+        that no longer match, so their leases aren't renewed forever.
+
+        The SQLite queue stores IDs as strings, so IDs that are valid
+        ObjectIds are queried in both forms.
+
+    Information:
+        :param queue: The work queue
+        :type queue: WorkQueue
+        :param batch_size: Documents claimed at a time
+        :type batch_size: int
+        :return: Iterator over the claimed documents
+        :rtype: object
+    """
+
+    for ids in queue.batches(batch_size):
+        completed = [id for id in ids if DATA_HANDLE.is_complete(id)]
+        if completed != []:
+            queue.complete(completed)
+        pending = [id for id in ids if not DATA_HANDLE.is_complete(id)]
+        if pending == []:
+            continue
+
+        # Claimed IDs by the string of the document ID they stand for
+        claimed = {str(id): id for id in pending}
+        for document in query(
+            ids=pending
+            + [
+                ObjectId(id)
+                for id in pending
+                if isinstance(id, str) and ObjectId.is_valid(id)
+            ]
+        ):
+            claimed.pop(str(document["_id"]), None)
+            yield document
+
+        # Release the IDs that have no document to process
+        if claimed != {}:
+            queue.complete(list(claimed.values()))
+
+
+def download(task: dict) -> list:
+    """Download Method
+
+    Description:
+        Insert the song data of an insertion task into the database, which
+        downloads its files.
+
+    Information:
+        :param task: Insertion task built by the extract method
+        :type task: dict
+        :return: The task and whether its insertion succeeded
+        :rtype: list[tuple[dict, bool]]
+    """
+
+    message = DATA_HANDLE.insert(**task["insert"])
+
+    # Insert returns nothing when a download failed
+    if message is not None:
+        print(message["Message"])
+
+    return [(task, message is not None)]
+
+
+def run(
+    documents: object,
+    extract_workers: int = EXTRACT_WORKERS,
+    download_workers: int = DOWNLOAD_WORKERS,
+    queue_size: int = QUEUE_SIZE,
+    report_interval: int = REPORT_INTERVAL,
+) -> dict:
+    """Run Method
+
+    Description:
+        Stream the given documents through a pipeline of bounded stages:
+
+            documents -> extract -> download -> index
+
+        The index stage records each document as completed once all of its
+        insertions succeeded, and checkpoints the index on the checkpoint
+        and compaction frequencies. Documents completed by a previous run
+        are skipped before entering the pipeline.
+
+    Information:
+        :param documents: Iterable of the documents to process
+        :type documents: object
+        :param extract_workers: Threads extracting texts
+        :type extract_workers: int
+        :param download_workers: Threads downloading files
+        :type download_workers: int
+        :param queue_size: Items each stage's queue holds
+        :type queue_size: int
+        :param report_interval: Seconds between progress reports
+        :type report_interval: int
+        :return: Final statistics of each stage by name
+        :rtype: dict
+    """
+
+    # Insertions finished and failed so far for each unfinished document
+    progress = {}
+    recorded = 0
+
+    def index(result: tuple) -> list:
+        """Record a finished insertion and checkpoint on the frequency"""
+        nonlocal recorded
+        task, success = result
+
+        # Mark the document as completed once its last insertion finished.
+        # Documents with a failed download are left out so a rerun retries
+        # them.
+        done, failed = progress.get(task["document"], (0, False))
+        done, failed = done + 1, failed or not success
+        if done < task["total"]:
+            progress[task["document"]] = (done, failed)
+        else:
+            progress.pop(task["document"], None)
+            METRICS.observe("document", time.monotonic() - task["started"])
+            finish(task["document"], failed)
+
+        # Log new temporary and error information on the specified save
+        # frequency, and rewrite the full files on the compaction frequency
+        recorded += 1
+        if recorded % CHECKPOINT_FREQUENCY == 0:
+            DATA_HANDLE.checkpoint(
+                compact=recorded % COMPACTION_FREQUENCY == 0
+            )
+
+    def error_func(stage: str, item: object, error: Exception) -> None:
+        """Print the item that failed in a stage and hand it back"""
+        if isinstance(item, tuple):
+            item = item[0]
+        id = item.get("_id", item.get("document"))
+        print(f"Error in {stage} stage for {id}: {error}")
+        if QUEUE is not None:
+            QUEUE.fail([id])
+
+    # Chain the stages. The index stage has a single worker, so its
+    # bookkeeping needs no locking.
+    pipeline = Pipeline(error_func, queue_size, report_interval)
+    pipeline.add_stage("extract", extract, extract_workers)
+    pipeline.add_stage("download", download, download_workers)
+    pipeline.add_stage("index", index, 1)
+
+    # Run the documents that were not completed by a previous run
+    return pipeline.run(
+        document
+        for document in documents
+        if not DATA_HANDLE.is_complete(document["_id"])
     )
 
-    # MultiThreading process to quickly download content
-    with concurrent.futures.ProcessPoolExecutor() as executor:
-        _ = [
-            executor.submit(process, (index, i))
-            for index, i in enumerate(cursor)
-        ]
-    # for i in cursor: process(i)
 
-    # Compile index.json file
+# Main run thread
+if __name__ == "__main__":
+    METRICS.serve(METRICS_PORT)  # Publish the stats file and endpoint
+
+    # Claim the documents from the work queue shared with other machines
+    if QUEUE_MODE is not None:
+        QUEUE = open_queue(QUEUE_MODE)
+        QUEUE.start()  # Keep the leases of the claimed documents alive
+        run(queued_documents(QUEUE))
+        QUEUE.stop()
+
+    # Otherwise stream every document with links and English text
+    else:
+        run(query())
+
+    # Check the downloaded MIDI files, then compile the index into the
+    # handle's export format for sort_filter
+    DATA_HANDLE.validate()
     DATA_HANDLE.compile_index_and_errors()
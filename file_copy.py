@@ -0,0 +1,143 @@
+"""
+File Name:      file_copy.py
+
+Authors:        Benjamin Herrera
+
+Date Created:   17 OCT 2026
+
+Date Modified:  17 OCT 2026
+
+Description:    Functions to copy files with hard links, reflinks, or kernel
+                copies, falling back to a plain copy
+"""
+
+# Imports
+import os
+import errno
+import shutil
+import threading
+
+# ioctl is only available on POSIX platforms
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Constants
+MODES = ("hardlink", "reflink", "copy_file_range", "copy")  # Fallback order
+FICLONE = 0x40049409  # Linux ioctl cloning a whole file (reflink)
+UNSUPPORTED = {
+    errno.EXDEV,
+    errno.EPERM,
+    errno.EINVAL,
+    errno.ENOSYS,
+    errno.EMLINK,
+    errno.ENOTTY,
+    errno.EOPNOTSUPP,
+    getattr(errno, "ENOTSUP", errno.EOPNOTSUPP),
+}  # Error codes of a strategy the platform or filesystem doesn't support
+
+
+def hardlink(from_path: str, to_path: str) -> None:
+    """Link the destination to the source's data"""
+    os.link(from_path, to_path)
+
+
+def reflink(from_path: str, to_path: str) -> None:
+    """Clone the source's extents into the destination"""
+    if fcntl is None:
+        raise OSError(errno.ENOSYS, "reflinks need fcntl")
+    with open(from_path, "rb") as source, open(to_path, "wb") as target:
+        fcntl.ioctl(target.fileno(), FICLONE, source.fileno())
+
+
+def copy_file_range(from_path: str, to_path: str) -> None:
+    """Copy the source's bytes inside the kernel"""
+    if not hasattr(os, "copy_file_range"):
+        raise OSError(errno.ENOSYS, "os.copy_file_range is not available")
+    with open(from_path, "rb") as source, open(to_path, "wb") as target:
+        remaining = os.fstat(source.fileno()).st_size
+        while remaining > 0:
+            copied = os.copy_file_range(
+                source.fileno(), target.fileno(), remaining
+            )
+            # Some filesystems copy nothing instead of failing, so the
+            # copy falls back to the next mode instead of being truncated
+            if copied == 0:
+                raise OSError(
+                    errno.EOPNOTSUPP,
+                    f"copy_file_range stopped {remaining} bytes short",
+                )
+            remaining -= copied
+
+
+def copy(from_path: str, to_path: str) -> None:
+    """Copy the source's bytes with the fastest copy of the platform"""
+    shutil.copyfile(from_path, to_path)
+
+
+STRATEGIES = {
+    "hardlink": hardlink,
+    "reflink": reflink,
+    "copy_file_range": copy_file_range,
+    "copy": copy,
+}  # Function of each copy mode
+
+
+def copy_file(from_path: str, to_path: str, mode: str = "copy") -> str:
+    """File Copy Method
+
+    Description:
+        Copies a file with the given mode, falling back to the next mode of
+        MODES when the platform or filesystem doesn't support it:
+
+            "hardlink"          The copy shares the source's data, so it
+                                costs no bytes, but an edit of either file
+                                shows in both. Needs both on one volume.
+                                Downloaded files are already hard links
+                                into their blob store, so their copies
+                                must be treated as read-only.
+            "reflink"           The copy shares the source's extents until
+                                either is modified (Btrfs, XFS, ...).
+            "copy_file_range"   The bytes are copied inside the kernel,
+                                which some filesystems do server-side.
+            "copy"              The bytes are copied by shutil, which uses
+                                sendfile or the platform's copy call.
+
+        The copy is made under a temp name and renamed over the destination,
+        so copying over an existing file replaces it and an interrupted copy
+        leaves nothing behind.
+
+    Information:
+        :param from_path: The path of the file to copy
+        :type from_path: str
+        :param to_path: The path of the copy
+        :type to_path: str
+        :param mode: The first mode to try, one of MODES
+        :type mode: str
+        :return: The mode the file was copied with
+        :rtype: str
+    """
+
+    if mode not in STRATEGIES:
+        raise ValueError(f'Unknown copy mode "{mode}"')
+
+    # Nothing to do if the destination already is the source
+    if os.path.exists(to_path) and os.path.samefile(from_path, to_path):
+        return mode
+
+    temp_path = f"{to_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+    # Try each mode in order until one is supported
+    for name in MODES[MODES.index(mode) :]:
+        try:
+            STRATEGIES[name](from_path, temp_path)
+            os.replace(temp_path, to_path)
+            return name
+
+        # Move on to the next mode if this one isn't supported
+        except OSError as e:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            if name == "copy" or e.errno not in UNSUPPORTED:
+                raise
@@ -0,0 +1,384 @@
+"""
+File Name:      index_store.py
+
+Authors:        Benjamin Herrera
+
+Date Created:   17 OCT 2026
+
+Date Modified:  17 OCT 2026
+
+Description:    Classes to hold a data handle's scratch index and error
+                records in MongoDB or in an embedded SQLite database
+"""
+
+# Imports
+import os
+import abc
+import sqlite3
+import threading
+from bson.json_util import dumps, loads
+from pymongo import ReplaceOne, UpdateOne
+from pymongo.errors import BulkWriteError
+from mongo_handle import MongoHandle
+
+# Constants
+DUPLICATE_KEY = 11000  # MongoDB error code for duplicate keys
+BUSY_TIMEOUT = 30  # Seconds a SQLite write waits for another writer
+TABLES = ("index", "error")  # Names of the record tables
+
+
+class IndexStore(abc.ABC):
+    """Index Storing Class
+
+    Description:
+        Interface of the scratch store behind a data handle. A store holds
+        two tables of records keyed by "_id":
+
+            "index"     Index documents. Writing a record replaces the
+                        record with the same ID.
+            "error"     Error records. Writing a record keeps the first
+                        record written for an ID.
+
+        Subclasses implement every method below, except close, which
+        does nothing unless the store holds connections.
+
+    Methods:
+        seed(list) -> None
+        write(list, list) -> None
+        find(str, str) -> dict
+        iterate(str, int) -> object
+        remove(str, list) -> None
+        close() -> None
+    """
+
+    @abc.abstractmethod
+    def seed(self, documents: list) -> None:
+        """Seeding Method
+
+        Description:
+            Loads the documents of an existing index.json into the index
+            table.
+
+        Information:
+            :param documents: The index documents to load
+            :type documents: list[dict]
+            :return: None
+            :rtype: None
+        """
+
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def write(self, index_docs: list, error_docs: list) -> None:
+        """Batch Writing Method
+
+        Description:
+            Writes a batch of index and error records in as few round trips
+            as the backend allows.
+
+        Information:
+            :param index_docs: Index documents to upsert
+            :type index_docs: list[dict]
+            :param error_docs: Error records to insert if their ID is new
+            :type error_docs: list[dict]
+            :return: None
+            :rtype: None
+        """
+
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def find(self, table: str, id: str) -> dict:
+        """Lookup Method
+
+        Description:
+            Returns the record of a table with the given ID.
+
+        Information:
+            :param table: "index" or "error"
+            :type table: str
+            :param id: The ID of the record
+            :type id: str
+            :return: The record, or None if there is none
+            :rtype: dict
+        """
+
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def iterate(self, table: str, batch_size: int) -> object:
+        """Iteration Method
+
+        Description:
+            Yields every record of a table, fetching batch_size records at a
+            time so memory use stays flat.
+
+        Information:
+            :param table: "index" or "error"
+            :type table: str
+            :param batch_size: Records fetched at a time
+            :type batch_size: int
+            :return: Iterator over the records
+            :rtype: object
+        """
+
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def remove(self, table: str, ids: list) -> None:
+        """Removal Method
+
+        Description:
+            Deletes the records of a table with the given IDs.
+
+        Information:
+            :param table: "index" or "error"
+            :type table: str
+            :param ids: The IDs of the records to delete
+            :type ids: list[str]
+            :return: None
+            :rtype: None
+        """
+
+        raise NotImplementedError
+
+    def close(self) -> None:
+        """Close the store's connections"""
+
+
+class MongoIndexStore(IndexStore):
+    """MongoDB Index Storing Class
+
+    Description:
+        Keeps the records in the "VIVYDownload_en.<suffix>_INDEX" and
+        "<suffix>_ERROR" collections. Batches are written with unordered bulk
+        writes through the process's shared client.
+
+    Methods:
+        MongoIndexStore(str) -> None
+        seed(list) -> None
+        write(list, list) -> None
+        find(str, str) -> dict
+        iterate(str, int) -> object
+        remove(str, list) -> None
+    """
+
+    def __init__(self, suffix: str) -> None:
+        """Constructor for MongoDB Index Storing Class
+
+        Description:
+            Stores the suffix of the collections. No connection is made until
+            the store is first used.
+
+        Information:
+            :param suffix: Prefix of the collection names
+            :type suffix: str
+            :return: None
+            :rtype: None
+        """
+
+        self.SUFFIX = suffix
+        self.MONGO_DB = MongoHandle()
+
+    def _collection(self, table: str) -> object:
+        """Return the collection of a table"""
+        return self.MONGO_DB.get_client()["VIVYDownload_en"][
+            f"{self.SUFFIX}_{table.upper()}"
+        ]
+
+    def seed(self, documents: list) -> None:
+        """Insert the documents into the index collection if they're new"""
+        try:
+            self._collection("index").insert_many(documents, ordered=False)
+
+        # Keep the documents already in the collection
+        except BulkWriteError as e:
+            errors = e.details["writeErrors"]
+            if any(err["code"] != DUPLICATE_KEY for err in errors):
+                raise
+
+    def write(self, index_docs: list, error_docs: list) -> None:
+        """Write the records with an unordered bulk write per collection"""
+        # Replace index documents, and only insert new error records
+        writes = [
+            (
+                "index",
+                [ReplaceOne({"_id": d["_id"]}, d, True) for d in index_docs],
+            ),
+            (
+                "error",
+                [
+                    UpdateOne(
+                        {"_id": d["_id"]},
+                        {
+                            "$setOnInsert": {
+                                k: v for k, v in d.items() if k != "_id"
+                            }
+                        },
+                        upsert=True,
+                    )
+                    for d in error_docs
+                ],
+            ),
+        ]
+
+        # Bulk write each collection's operations
+        for table, operations in writes:
+            if operations == []:
+                continue
+
+            try:
+                self._collection(table).bulk_write(operations, ordered=False)
+
+            # Ignore IDs that another process upserted at the same time
+            except BulkWriteError as e:
+                errors = e.details["writeErrors"]
+                if any(err["code"] != DUPLICATE_KEY for err in errors):
+                    raise
+
+    def find(self, table: str, id: str) -> dict:
+        """Return the record with the given ID"""
+        return self._collection(table).find_one({"_id": id})
+
+    def iterate(self, table: str, batch_size: int) -> object:
+        """Return a cursor over the collection fetching in batches"""
+        return self._collection(table).find({}).batch_size(batch_size)
+
+    def remove(self, table: str, ids: list) -> None:
+        """Delete the records with the given IDs"""
+        self._collection(table).delete_many({"_id": {"$in": list(ids)}})
+
+
+class SQLiteIndexStore(IndexStore):
+    """SQLite Index Storing Class
+
+    Description:
+        Keeps the records in an embedded SQLite database, so a data handle
+        can run without a MongoDB server:
+
+            <path_to_folder>
+            └───index.sqlite3
+
+        Each table maps the "_id" primary key to the record stored as
+        Extended JSON, so lookups by ID use the primary key's index and the
+        records read back the same as from MongoDB. The database runs in WAL
+        mode: readers don't block the writer, and every batch is committed
+        as a single transaction.
+
+        Each thread uses its own connection, and connections are reopened
+        after a fork. Concurrent writers from other processes wait up to
+        BUSY_TIMEOUT seconds for each other.
+
+    Methods:
+        SQLiteIndexStore(str) -> None
+        seed(list) -> None
+        write(list, list) -> None
+        find(str, str) -> dict
+        iterate(str, int) -> object
+        remove(str, list) -> None
+        close() -> None
+    """
+
+    def __init__(self, path: str) -> None:
+        """Constructor for SQLite Index Storing Class
+
+        Description:
+            Creates the database and its tables in the given folder if they
+            don't exist.
+
+        Information:
+            :param path: Path to the folder of the data handle
+            :type path: str
+            :return: None
+            :rtype: None
+        """
+
+        self.FILE = os.path.join(path, "index.sqlite3")
+        self.local = threading.local()
+        self.connections = []  # Opened connections and their process IDs
+        self.connections_lock = threading.Lock()
+
+        # Switch the database to WAL mode and create the tables
+        connection = self._connect()
+        connection.execute("PRAGMA journal_mode=WAL")
+        with connection:
+            for table in TABLES:
+                connection.execute(
+                    f'CREATE TABLE IF NOT EXISTS "{table}" '
+                    + "(_id TEXT PRIMARY KEY, document TEXT NOT NULL)"
+                )
+
+    def _connect(self) -> sqlite3.Connection:
+        """Return the connection of the current thread and process"""
+        if getattr(self.local, "pid", None) != os.getpid():
+            connection = sqlite3.connect(
+                self.FILE, timeout=BUSY_TIMEOUT, check_same_thread=False
+            )
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self.local.connection = connection
+            self.local.pid = os.getpid()
+            with self.connections_lock:
+                self.connections.append((os.getpid(), connection))
+        return self.local.connection
+
+    def seed(self, documents: list) -> None:
+        """Upsert the documents into the index table"""
+        self.write(documents, [])
+
+    def write(self, index_docs: list, error_docs: list) -> None:
+        """Write the records of both tables in a single transaction"""
+        connection = self._connect()
+
+        # Replace index documents in place, and only insert new error records
+        with connection:
+            connection.executemany(
+                'INSERT INTO "index" (_id, document) VALUES (?, ?) '
+                + "ON CONFLICT (_id) DO UPDATE "
+                + "SET document = excluded.document",
+                [(str(d["_id"]), dumps(d)) for d in index_docs],
+            )
+            connection.executemany(
+                'INSERT OR IGNORE INTO "error" (_id, document) '
+                + "VALUES (?, ?)",
+                [(str(d["_id"]), dumps(d)) for d in error_docs],
+            )
+
+    def find(self, table: str, id: str) -> dict:
+        """Return the record with the given ID through the primary key"""
+        row = (
+            self._connect()
+            .execute(
+                f'SELECT document FROM "{table}" WHERE _id = ?', (str(id),)
+            )
+            .fetchone()
+        )
+        return None if row is None else loads(row[0])
+
+    def iterate(self, table: str, batch_size: int) -> object:
+        """Yield the records of the table in insertion order, in batches"""
+        cursor = self._connect().execute(
+            f'SELECT document FROM "{table}" ORDER BY rowid'
+        )
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                return
+            for row in rows:
+                yield loads(row[0])
+
+    def remove(self, table: str, ids: list) -> None:
+        """Delete the records with the given IDs in a single transaction"""
+        with self._connect() as connection:
+            connection.executemany(
+                f'DELETE FROM "{table}" WHERE _id = ?',
+                [(str(id),) for id in ids],
+            )
+
+    def close(self) -> None:
+        """Close the connections opened by this process"""
+        with self.connections_lock:
+            for pid, connection in self.connections:
+                if pid == os.getpid():
+                    connection.close()
+            self.connections = []
+        self.local = threading.local()
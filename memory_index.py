@@ -0,0 +1,315 @@
+"""
+File Name:      memory_index.py
+
+Authors:        Benjamin Herrera
+
+Date Created:   17 OCT 2026
+
+Date Modified:  17 OCT 2026
+
+Description:    Classes to hold a data handle's index.json in memory, keyed
+                by ID and persisted through an append-only journal
+"""
+
+# Imports
+import os
+import glob
+import json
+import uuid
+import threading
+
+# Constants
+FIELDS = (
+    "_id",
+    "title",
+    "composer",
+    "method",
+    "text",
+    "link",
+    "directory",
+    "files",
+    "version",
+)  # Fields every index document has, in order
+MISSING = object()  # Marks a field a document doesn't have
+
+
+class IndexRecord:
+    """Index Record Class
+
+    Description:
+        Holds an index document in slots instead of a dict, which takes a
+        fraction of the memory. Fields outside of FIELDS are kept in a dict
+        of their own, which most records don't need.
+
+    Methods:
+        IndexRecord(dict) -> None
+        to_dict() -> dict
+    """
+
+    __slots__ = FIELDS + ("extra",)
+
+    def __init__(self, document: dict) -> None:
+        """Constructor for Index Record Class
+
+        Description:
+            Copies the fields of an index document into the record.
+
+        Information:
+            :param document: The index document
+            :type document: dict
+            :return: None
+            :rtype: None
+        """
+
+        for field in FIELDS:
+            setattr(self, field, document.get(field, MISSING))
+        extra = {k: v for k, v in document.items() if k not in FIELDS}
+        self.extra = extra or None
+
+    def to_dict(self) -> dict:
+        """Return the index document of the record"""
+        document = {
+            field: getattr(self, field)
+            for field in FIELDS
+            if getattr(self, field) is not MISSING
+        }
+        document.update(self.extra or {})
+        return document
+
+
+class MemoryIndex:
+    """Memory Index Class
+
+    Description:
+        Holds the documents of a folder's index.json in a dict keyed by ID,
+        so documents are looked up and updated in constant time:
+
+            <path_to_folder>
+            ├───index.json
+            └───index.journal.jsonl
+
+        Nothing is read until the index is first used, so creating a data
+        handle costs the same however big its index is. Changes are appended
+        to the journal, one document per line, instead of rewriting
+        index.json. The index is index.json with the journal replayed on top
+        of it: the last line of an ID wins. compact folds the journal back
+        into index.json.
+
+        Changes appended by other processes are picked up on every use by
+        reading the journal from where the last read stopped. If index.json
+        was rewritten by a compaction, everything is read again.
+
+        compact moves the journal aside before replaying it, so lines that
+        other processes append meanwhile go to a new journal instead of
+        being lost. A journal left aside by an interrupted compaction is
+        replayed on load and folded in by the next compaction.
+
+    Methods:
+        MemoryIndex(str) -> None
+        stamp() -> str
+        get(str) -> dict
+        put(dict) -> None
+        compact() -> bool
+    """
+
+    def __init__(self, path: str) -> None:
+        """Constructor for Memory Index Class
+
+        Description:
+            Sets up the paths of index.json and of the journal. Nothing is
+            read until the index is first used.
+
+        Information:
+            :param path: Path to the folder of the data handle
+            :type path: str
+            :return: None
+            :rtype: None
+        """
+
+        self.FILE = f"{path}/index.json"
+        self.JOURNAL = f"{path}/index.journal.jsonl"
+        self.lock = threading.Lock()
+        self.records = None  # Records by ID, once loaded
+        self.loaded = None  # Stamp of the index.json that was loaded
+        self.offset = 0  # Bytes of the journal replayed
+        self.journal = None  # Inode of the journal replayed
+
+    def stamp(self) -> str:
+        """Return the modification time and size of index.json"""
+        try:
+            stat = os.stat(self.FILE)
+        except FileNotFoundError:
+            return None
+        return f"{stat.st_mtime_ns}:{stat.st_size}"
+
+    def _rotated(self) -> list:
+        """Return the journals moved aside by compactions, oldest first"""
+        journals = []
+        for journal in glob.glob(f"{self.JOURNAL}.*.compacting"):
+            try:
+                journals.append((os.path.getmtime(journal), journal))
+            except FileNotFoundError:
+                pass  # Removed by the compaction that finished meanwhile
+        return [journal for _, journal in sorted(journals)]
+
+    def _replay(self, journal: str) -> None:
+        """Replay the complete lines appended to a journal since last time"""
+        try:
+            with open(journal, "rb") as file:
+                # Start over if the journal was replaced by a compaction
+                inode = os.fstat(file.fileno()).st_ino
+                if inode != self.journal:
+                    self.journal = inode
+                    self.offset = 0
+                file.seek(self.offset)
+                data = file.read()
+        except FileNotFoundError:
+            return
+        data = data[: data.rfind(b"\n") + 1]
+        for line in data.splitlines():
+            document = json.loads(line)
+            self.records[document["_id"]] = IndexRecord(document)
+        self.offset += len(data)
+
+    def _refresh(self) -> None:
+        """Load index.json if needed and replay the journal's new lines"""
+        # Read everything again if index.json changed since it was loaded
+        stamp = self.stamp()
+        if self.records is None or stamp != self.loaded:
+            self.records = {}
+            self.loaded = stamp
+            self.journal = None
+            if stamp is not None:
+                with open(self.FILE, "r", encoding="utf-8") as file:
+                    for document in json.load(file):
+                        self.records[document["_id"]] = IndexRecord(document)
+
+            # Journals left aside by an interrupted compaction come first
+            for journal in self._rotated():
+                self._replay(journal)
+
+        self._replay(self.JOURNAL)
+
+    def __contains__(self, id: str) -> bool:
+        """Return whether a document with the ID is in the index"""
+        with self.lock:
+            self._refresh()
+            return id in self.records
+
+    def __len__(self) -> int:
+        """Return the number of documents of the index"""
+        with self.lock:
+            self._refresh()
+            return len(self.records)
+
+    def __iter__(self) -> object:
+        """Yield every document of the index"""
+        with self.lock:
+            self._refresh()
+            records = list(self.records.values())
+        for record in records:
+            yield record.to_dict()
+
+    def get(self, id: str) -> dict:
+        """Lookup Method
+
+        Description:
+            Returns a copy of the document with the given ID.
+
+        Information:
+            :param id: The ID of the document
+            :type id: str
+            :return: The document, or None if there is none
+            :rtype: dict
+        """
+
+        with self.lock:
+            self._refresh()
+            record = self.records.get(id)
+        return None if record is None else record.to_dict()
+
+    def put(self, document: dict) -> None:
+        """Upsert Method
+
+        Description:
+            Adds or replaces a document, and appends it to the journal as a
+            single write so appends from several processes don't interleave.
+            If a compaction moved the journal aside during the write, the
+            line is appended again to the new journal, as the compaction may
+            have replayed the old one before the line reached it.
+
+        Information:
+            :param document: The document to add or replace
+            :type document: dict
+            :return: None
+            :rtype: None
+        """
+
+        line = (json.dumps(document) + "\n").encode("utf-8")
+        with self.lock:
+            self._refresh()
+            self.records[document["_id"]] = IndexRecord(document)
+            while True:
+                fd = os.open(
+                    self.JOURNAL, os.O_WRONLY | os.O_APPEND | os.O_CREAT
+                )
+                try:
+                    os.write(fd, line)
+                    inode = os.fstat(fd).st_ino
+                finally:
+                    os.close(fd)
+
+                # Stop once the line is in the journal still in place
+                try:
+                    if os.stat(self.JOURNAL).st_ino == inode:
+                        break
+                except FileNotFoundError:
+                    pass
+
+    def compact(self) -> bool:
+        """Compaction Method
+
+        Description:
+            Rewrites index.json with the journal, and any journal left aside
+            by an interrupted compaction, folded in and removes them, if
+            there are any. The journal is moved aside and replayed before
+            index.json is written, so other processes may keep appending to
+            a new journal meanwhile. Only one process may compact at a time.
+
+        Information:
+            :return: Whether index.json was rewritten
+            :rtype: bool
+        """
+
+        with self.lock:
+            leftover = self._rotated()
+            if not os.path.exists(self.JOURNAL) and leftover == []:
+                return False
+
+            # Load everything again to replay the leftover journals whole
+            if leftover != []:
+                self.records = None
+            self._refresh()
+
+            # Move the journal aside and replay the lines appended to it
+            # before it was moved
+            if os.path.exists(self.JOURNAL):
+                rotated = (
+                    f"{self.JOURNAL}.{os.getpid()}.{uuid.uuid4().hex[:8]}"
+                    + ".compacting"
+                )
+                os.replace(self.JOURNAL, rotated)
+                self._replay(rotated)
+            documents = [record.to_dict() for record in self.records.values()]
+
+            # Swap in the new index.json, then remove the old journals
+            temp_name = f"{self.FILE}.{os.getpid()}.tmp"
+            with open(temp_name, "w", encoding="utf-8") as file:
+                json.dump(documents, file)
+            os.replace(temp_name, self.FILE)
+            for journal in self._rotated():
+                os.remove(journal)
+
+            self.loaded = self.stamp()
+            self.journal = None
+            return True
@@ -0,0 +1,550 @@
+"""
+File Name:      metrics.py
+
+Authors:        Benjamin Herrera
+
+Date Created:   17 OCT 2026
+
+Date Modified:  17 OCT 2026
+
+Description:    Class to record per-stage counters, latency histograms, bytes,
+                and in-flight counts, merged across worker processes
+"""
+
+# Imports
+import os
+import glob
+import json
+import time
+import bisect
+import threading
+import contextlib
+import http.server
+import multiprocessing.util
+
+# Constants
+PREFIX = "vivy"  # Prefix of every metric name
+INTERVAL = 10  # Seconds between snapshot and stats file writes
+PORT = 9464  # Port of the Prometheus endpoint on localhost
+BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+    120.0,
+    float("inf"),
+)  # Upper bounds in seconds of the latency histogram buckets
+QUANTILES = (0.5, 0.99)  # Latency quantiles estimated in the stats file
+
+
+def series(name: str, **labels: str) -> str:
+    """Series Function
+
+    Description:
+        Returns the Prometheus name of a series, such as
+        'vivy_stage_total{outcome="ok",stage="download"}'.
+
+    Information:
+        :param name: Name of the metric without its prefix
+        :type name: str
+        :param **labels: Labels of the series
+        :type **labels: str
+        :return: Name of the series
+        :rtype: str
+    """
+
+    pairs = ",".join(f'{k}="{v}"' for k, v in sorted(labels.items()))
+    return f"{PREFIX}_{name}{{{pairs}}}" if pairs else f"{PREFIX}_{name}"
+
+
+def quantile(histogram: dict, q: float) -> float:
+    """Quantile Function
+
+    Description:
+        Estimates a quantile of a latency histogram the way Prometheus'
+        histogram_quantile does, by interpolating linearly inside the
+        bucket the quantile falls in. Returns None for an empty histogram.
+
+    Information:
+        :param histogram: Histogram with "buckets" counts and a "count"
+        :type histogram: dict
+        :param q: Quantile to estimate, between 0 and 1
+        :type q: float
+        :return: Estimated seconds
+        :rtype: float
+    """
+
+    if histogram["count"] == 0:
+        return None
+
+    # Find the bucket holding the quantile's rank and interpolate in it
+    rank, seen, lower = q * histogram["count"], 0, 0.0
+    for bound, count in zip(BUCKETS, histogram["buckets"]):
+        if count and seen + count >= rank:
+            if bound == float("inf"):
+                return lower  # Nothing is known above the last bound
+            return lower + (bound - lower) * (rank - seen) / count
+        seen += count
+        lower = bound if bound != float("inf") else lower
+    return lower
+
+
+class Metrics:
+    """Metrics Class
+
+    Description:
+        Records what the pipelines spend their time on, per stage:
+
+            vivy_stage_total{stage, outcome}    Calls that succeeded ("ok")
+                                                or raised ("error")
+            vivy_stage_seconds{stage}           Latency histogram of calls
+            vivy_stage_in_flight{stage}         Calls currently running
+            vivy_bytes_total{stage}             Bytes transferred
+
+        along with any other counter or gauge set through the count and set
+        methods. Recording is thread-safe and cheap, and nothing is written
+        until the metrics are configured with a folder.
+
+        Once configured, every process writes a snapshot of its own metrics
+        to "<path>/metrics.<pid>.json" every INTERVAL seconds and when it
+        exits. The serve method, called in the parent process, merges the
+        snapshots of every process into "<path>/stats.json" and serves them
+        in the Prometheus text format on localhost:
+
+            <path_to_folder>
+            ├───metrics.<pid>.json
+            └───stats.json
+
+        A module-level instance, METRICS, is shared by every handle.
+
+            METRICS.configure("Data/Metrics/")
+            with METRICS.track("download"):
+                ...
+            METRICS.serve()
+
+    Methods:
+        Metrics() -> None
+        configure(str, int) -> None
+        count(str, float, **str) -> None
+        set(str, float, **str) -> None
+        observe(str, float) -> None
+        track(str) -> None
+        snapshot() -> dict
+        write() -> None
+        merged() -> dict
+        stats() -> dict
+        write_stats() -> None
+        prometheus() -> str
+        serve(int) -> None
+    """
+
+    def __init__(self) -> None:
+        """Constructor for Metrics Class
+
+        Description:
+            Creates an empty, unconfigured set of metrics.
+
+        Information:
+            :return: None
+            :rtype: None
+        """
+
+        self.PATH = None
+        self.INTERVAL = INTERVAL
+        self.reset()
+
+        # Reset the metrics in forked children where the platform supports
+        # it, so a child doesn't report its parent's numbers as its own
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self.reset)
+
+    def reset(self) -> None:
+        """Forget every recorded value and the writer of the process"""
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self.writer_pid = None  # Process whose writer thread is running
+
+    def configure(self, path: str, interval: int = INTERVAL) -> None:
+        """Configuring Method
+
+        Description:
+            Sets the folder the snapshots are written to, creating it if it
+            doesn't exist. Should be called at module level by the scripts,
+            so worker processes that import them are configured too.
+
+        Information:
+            :param path: Path to the metrics folder
+            :type path: str
+            :param interval: Seconds between snapshot writes
+            :type interval: int
+            :return: None
+            :rtype: None
+        """
+
+        os.makedirs(path, exist_ok=True)
+        self.PATH = path
+        self.INTERVAL = interval
+
+    def _start_writer(self) -> None:
+        """Start the snapshot writer of the current process once"""
+        with self.lock:
+            if self.PATH is None or self.writer_pid == os.getpid():
+                return
+            self.writer_pid = os.getpid()
+
+        def write_periodically() -> None:
+            while True:
+                time.sleep(self.INTERVAL)
+                self.write()
+
+        threading.Thread(target=write_periodically, daemon=True).start()
+
+        # Write a last snapshot when the process exits. A multiprocessing
+        # finalizer also runs when pool worker processes shut down.
+        multiprocessing.util.Finalize(self, self.write, exitpriority=5)
+
+    def count(self, name: str, value: float = 1, **labels: str) -> None:
+        """Counting Method
+
+        Description:
+            Adds a value to a counter.
+
+        Information:
+            :param name: Name of the metric without its prefix
+            :type name: str
+            :param value: Amount to add
+            :type value: float
+            :param **labels: Labels of the series
+            :type **labels: str
+            :return: None
+            :rtype: None
+        """
+
+        key = series(name, **labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+        self._start_writer()
+
+    def set(self, name: str, value: float, **labels: str) -> None:
+        """Gauge Setting Method
+
+        Description:
+            Sets a gauge to a value. Gauges of different processes are added
+            together when merged.
+
+        Information:
+            :param name: Name of the metric without its prefix
+            :type name: str
+            :param value: Value of the gauge
+            :type value: float
+            :param **labels: Labels of the series
+            :type **labels: str
+            :return: None
+            :rtype: None
+        """
+
+        key = series(name, **labels)
+        with self.lock:
+            self.gauges[key] = value
+        self._start_writer()
+
+    def observe(self, stage: str, seconds: float) -> None:
+        """Observing Method
+
+        Description:
+            Adds a latency to a stage's histogram.
+
+        Information:
+            :param stage: Name of the stage
+            :type stage: str
+            :param seconds: Latency of the call
+            :type seconds: float
+            :return: None
+            :rtype: None
+        """
+
+        key = series("stage_seconds", stage=stage)
+        with self.lock:
+            histogram = self.histograms.setdefault(
+                key, {"buckets": [0] * len(BUCKETS), "sum": 0.0, "count": 0}
+            )
+            histogram["buckets"][bisect.bisect_left(BUCKETS, seconds)] += 1
+            histogram["sum"] += seconds
+            histogram["count"] += 1
+        self._start_writer()
+
+    @contextlib.contextmanager
+    def track(self, stage: str) -> None:
+        """Tracking Method
+
+        Description:
+            Context manager that records a call of a stage: it is counted as
+            in flight for the duration of the block, its latency is added to
+            the stage's histogram, and it is counted as "ok" or, if the block
+            raises, as "error". Works around awaits in coroutines too.
+
+        Information:
+            :param stage: Name of the stage
+            :type stage: str
+            :return: None
+            :rtype: None
+        """
+
+        key = series("stage_in_flight", stage=stage)
+        with self.lock:
+            self.gauges[key] = self.gauges.get(key, 0) + 1
+
+        start = time.monotonic()
+        outcome = "error"
+        try:
+            yield
+            outcome = "ok"
+        finally:
+            with self.lock:
+                self.gauges[key] -= 1
+            self.observe(stage, time.monotonic() - start)
+            self.count("stage_total", stage=stage, outcome=outcome)
+
+    def snapshot(self) -> dict:
+        """Return a copy of the metrics recorded by this process"""
+        with self.lock:
+            return {
+                "counters": dict(self.counters),
+                "gauges": dict(self.gauges),
+                "histograms": {
+                    key: {**h, "buckets": list(h["buckets"])}
+                    for key, h in self.histograms.items()
+                },
+            }
+
+    def write(self) -> None:
+        """Snapshot Writing Method
+
+        Description:
+            Writes this process's snapshot to its file in the metrics folder.
+            The file is replaced atomically, so readers never see a partial
+            snapshot.
+
+        Information:
+            :return: None
+            :rtype: None
+        """
+
+        if self.PATH is None:
+            return
+
+        file_name = os.path.join(self.PATH, f"metrics.{os.getpid()}.json")
+        with open(f"{file_name}.tmp", "w", encoding="utf-8") as file:
+            json.dump(self.snapshot(), file)
+        os.replace(f"{file_name}.tmp", file_name)
+
+    def merged(self) -> dict:
+        """Merging Method
+
+        Description:
+            Adds up this process's metrics and the latest snapshots of every
+            other process. Counters, gauges, and histogram buckets are summed
+            series by series.
+
+        Information:
+            :return: Merged counters, gauges, and histograms
+            :rtype: dict
+        """
+
+        snapshots = [self.snapshot()]
+        if self.PATH is not None:
+            own = os.path.join(self.PATH, f"metrics.{os.getpid()}.json")
+            for file_name in glob.glob(
+                os.path.join(self.PATH, "metrics.*.json")
+            ):
+                if file_name == own:
+                    continue
+                try:
+                    with open(file_name, "r", encoding="utf-8") as file:
+                        snapshots.append(json.load(file))
+                except (OSError, ValueError):
+                    continue
+
+        # Sum every series across the snapshots
+        merged = {"counters": {}, "gauges": {}, "histograms": {}}
+        for snapshot in snapshots:
+            for kind in ("counters", "gauges"):
+                for key, value in snapshot[kind].items():
+                    merged[kind][key] = merged[kind].get(key, 0) + value
+            for key, h in snapshot["histograms"].items():
+                total = merged["histograms"].setdefault(
+                    key,
+                    {"buckets": [0] * len(BUCKETS), "sum": 0.0, "count": 0},
+                )
+                total["buckets"] = [
+                    a + b for a, b in zip(total["buckets"], h["buckets"])
+                ]
+                total["sum"] += h["sum"]
+                total["count"] += h["count"]
+
+        return merged
+
+    def stats(self) -> dict:
+        """Statistics Method
+
+        Description:
+            Returns the merged metrics of every process, with the count, mean,
+            and estimated quantiles of each latency histogram instead of its
+            buckets.
+
+        Information:
+            :return: Merged statistics
+            :rtype: dict
+        """
+
+        merged = self.merged()
+        return {
+            "time": time.time(),
+            "counters": merged["counters"],
+            "gauges": merged["gauges"],
+            "latency": {
+                key: {
+                    "count": h["count"],
+                    "mean": h["sum"] / h["count"] if h["count"] else None,
+                    **{
+                        f"p{round(q * 100)}": quantile(h, q) for q in QUANTILES
+                    },
+                }
+                for key, h in merged["histograms"].items()
+            },
+        }
+
+    def prometheus(self) -> str:
+        """Prometheus Rendering Method
+
+        Description:
+            Renders the merged metrics of every process in the Prometheus
+            text exposition format.
+
+        Information:
+            :return: The metrics as Prometheus text
+            :rtype: str
+        """
+
+        merged = self.merged()
+        lines = []
+
+        # Counters and gauges are one line per series
+        for kind, type_name in (("counters", "counter"), ("gauges", "gauge")):
+            typed = set()
+            for key, value in sorted(merged[kind].items()):
+                name = key.split("{")[0]
+                if name not in typed:
+                    lines.append(f"# TYPE {name} {type_name}")
+                    typed.add(name)
+                lines.append(f"{key} {value}")
+
+        # Histograms are cumulative buckets, a sum, and a count
+        typed = set()
+        for key, h in sorted(merged["histograms"].items()):
+            name, _, labels = key.partition("{")
+            labels = labels.rstrip("}")
+            if name not in typed:
+                lines.append(f"# TYPE {name} histogram")
+                typed.add(name)
+            cumulative = 0
+            for bound, count in zip(BUCKETS, h["buckets"]):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                prefix = f"{labels}," if labels else ""
+                lines.append(
+                    f'{name}_bucket{{{prefix}le="{le}"}} {cumulative}'
+                )
+            suffix = f"{{{labels}}}" if labels else ""
+            lines.append(f"{name}_sum{suffix} {h['sum']}")
+            lines.append(f"{name}_count{suffix} {h['count']}")
+
+        return "\n".join(lines) + "\n"
+
+    def write_stats(self) -> None:
+        """Write the merged stats of every process to the stats file"""
+        if self.PATH is None:
+            return
+
+        file_name = os.path.join(self.PATH, "stats.json")
+        with open(f"{file_name}.tmp", "w", encoding="utf-8") as file:
+            json.dump(self.stats(), file, indent=4)
+        os.replace(f"{file_name}.tmp", file_name)
+
+    def serve(self, port: int = PORT) -> None:
+        """Serving Method
+
+        Description:
+            Called once by the parent process. Clears the snapshots left by
+            earlier runs, then starts a thread that writes the merged stats
+            to "<path>/stats.json" every INTERVAL seconds and an HTTP server
+            on 127.0.0.1 that serves the merged metrics at /metrics in the
+            Prometheus text format. A port of None skips the HTTP server.
+
+        Information:
+            :param port: Port of the Prometheus endpoint
+            :type port: int
+            :return: None
+            :rtype: None
+        """
+
+        # Clear the snapshots of earlier runs
+        if self.PATH is not None:
+            for file_name in glob.glob(
+                os.path.join(self.PATH, "metrics.*.json")
+            ):
+                os.remove(file_name)
+
+            # Write the merged stats file periodically and at exit
+            def write_periodically() -> None:
+                while True:
+                    time.sleep(self.INTERVAL)
+                    self.write_stats()
+
+            threading.Thread(target=write_periodically, daemon=True).start()
+            multiprocessing.util.Finalize(
+                self, self.write_stats, exitpriority=4
+            )
+
+        if port is None:
+            return
+
+        metrics = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            """Serves the merged metrics at /metrics"""
+
+            def do_GET(self) -> None:
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header(
+                    "Content-Type", "text/plain; version=0.0.4; charset=utf-8"
+                )
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args: object) -> None:
+                return  # Keep the scripts' output clean
+
+        # Serve from a daemon thread so it never keeps the process alive
+        server = http.server.ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+
+METRICS = Metrics()  # Metrics shared by every handle of the process
@@ -0,0 +1,271 @@
+"""
+File Name:      midi_check.py
+
+Authors:        Benjamin Herrera
+
+Date Created:   17 OCT 2026
+
+Date Modified:  17 OCT 2026
+
+Description:    Functions to validate MIDI files by parsing their chunk
+                structure, without a MIDI library
+"""
+
+# Imports
+import os
+import concurrent.futures
+
+# Constants
+WORKERS = 8  # Processes validating files
+CHUNKSIZE = 32  # Files handed to a worker process at a time
+MAX_SIZE = 64 * 1024 * 1024  # Larger files are not read, as no MIDI is
+DEFAULT_TEMPO = 500000  # Microseconds per quarter note until a tempo event
+INVALID = "Invalid MIDI file"  # Prefix of the validation errors
+DATA_BYTES = (0,) * 8 + (2, 2, 2, 2, 1, 1, 2)  # By channel event type
+
+
+def read_vlq(data: bytes, position: int) -> tuple:
+    """Read a variable-length quantity, returning it and the next position"""
+    value = 0
+    for _ in range(4):
+        byte = data[position]
+        position += 1
+        value = (value << 7) | (byte & 0x7F)
+        if byte < 0x80:
+            return value, position
+    raise ValueError("Variable-length quantity is longer than 4 bytes")
+
+
+def parse_track(data: bytes, start: int, end: int, tempos: list) -> int:
+    """Track Parsing Function
+
+    Description:
+        Walks the events of an MTrk chunk, with running status, to find the
+        tick its last event is at. Tempo events are appended to the tempos
+        list as (tick, microseconds per quarter note) pairs.
+
+    Information:
+        :param data: The file's bytes
+        :type data: bytes
+        :param start: Position of the chunk's first event
+        :type start: int
+        :param end: Position after the chunk's last byte
+        :type end: int
+        :param tempos: List the tempo events are appended to
+        :type tempos: list[tuple[int, int]]
+        :return: The tick of the track's last event
+        :rtype: int
+    """
+
+    position = start
+    tick = 0
+    status = 0  # Running status, set by the first channel event
+
+    try:
+        while position < end:
+            # Delta times mostly fit in a single byte
+            byte = data[position]
+            if byte < 0x80:
+                tick += byte
+                position += 1
+            else:
+                delta, position = read_vlq(data, position)
+                tick += delta
+            byte = data[position]
+
+            # Channel events, starting with a status byte or running status
+            if byte < 0xF0:
+                if byte >= 0x80:
+                    status = byte
+                    position += 1
+                elif status == 0:
+                    raise ValueError("Data byte without a running status")
+                position += DATA_BYTES[status >> 4]
+
+            # Meta events, with their type and length
+            elif byte == 0xFF:
+                kind = data[position + 1]
+                length, position = read_vlq(data, position + 2)
+                if kind == 0x51 and length == 3:
+                    tempo = data[position : position + 3]
+                    tempos.append((tick, int.from_bytes(tempo, "big")))
+                position += length
+                if kind == 0x2F:
+                    break  # End of track
+
+            # System exclusive events, with their length
+            elif byte == 0xF0 or byte == 0xF7:
+                length, position = read_vlq(data, position + 1)
+                position += length
+                status = 0
+
+            else:
+                raise ValueError(f"Unknown status byte {byte:#04x}")
+
+    except IndexError:
+        raise ValueError("Track ends in the middle of an event")
+
+    if position > end:
+        raise ValueError("Track ends in the middle of an event")
+
+    return tick
+
+
+def seconds(ticks: int, tempos: list, division: int) -> float:
+    """Return the seconds taken to play up to a tick with a tempo map"""
+    # SMPTE divisions count frames per second and ticks per frame
+    if division & 0x8000:
+        frames = 256 - (division >> 8)
+        return ticks / (frames * (division & 0xFF))
+
+    total = 0.0
+    last_tick = 0
+    tempo = DEFAULT_TEMPO
+    for tick, new_tempo in sorted(tempos):
+        if tick >= ticks:
+            break
+        total += (tick - last_tick) * tempo
+        last_tick = tick
+        tempo = new_tempo
+    total += (ticks - last_tick) * tempo
+    return total / division / 1000000
+
+
+def parse_midi(data: bytes) -> dict:
+    """MIDI Parsing Function
+
+    Description:
+        Checks that the bytes are a whole Standard MIDI File: an MThd chunk
+        followed by as many MTrk chunks as it declares, none of them cut
+        short. Chunks of unknown types are skipped, as the specification
+        asks. Raises a ValueError describing the first problem found.
+
+        The summary of a valid file looks like this:
+
+            {
+                "format": 1,
+                "tracks": 4,
+                "division": 480,
+                "ticks": 92160,
+                "duration": 96.0
+            }
+
+        "ticks" is the tick of the last event of the longest track, and
+        "duration" the seconds it takes to play up to it.
+
+    Information:
+        :param data: The file's bytes
+        :type data: bytes
+        :return: The summary of the file
+        :rtype: dict
+    """
+
+    # Check the header chunk
+    if data[:4] != b"MThd":
+        raise ValueError("Missing MThd header")
+    length = int.from_bytes(data[4:8], "big")
+    if length < 6 or len(data) < 8 + length:
+        raise ValueError("Truncated MThd header")
+    format = int.from_bytes(data[8:10], "big")
+    declared = int.from_bytes(data[10:12], "big")
+    division = int.from_bytes(data[12:14], "big")
+    if format > 2:
+        raise ValueError(f"Unknown MIDI format {format}")
+    if division == 0:
+        raise ValueError("Division of zero ticks")
+
+    # Walk the chunks that follow
+    position = 8 + length
+    tracks = 0
+    ticks = 0
+    tempos = []
+    while position + 8 <= len(data) and tracks < declared:
+        kind = data[position : position + 4]
+        length = int.from_bytes(data[position + 4 : position + 8], "big")
+        start = position + 8
+        position = start + length
+        if position > len(data):
+            raise ValueError(f"Truncated {kind.decode('latin-1')} chunk")
+        if kind == b"MTrk":
+            ticks = max(ticks, parse_track(data, start, position, tempos))
+            tracks += 1
+
+    if tracks < declared:
+        raise ValueError(f"Found {tracks} of the {declared} MTrk chunks")
+
+    return {
+        "format": format,
+        "tracks": tracks,
+        "division": division,
+        "ticks": ticks,
+        "duration": round(seconds(ticks, tempos, division), 3),
+    }
+
+
+def validate_file(path: str) -> dict:
+    """File Validation Function
+
+    Description:
+        Reads and parses a MIDI file. Never raises, so it can be mapped over
+        a process pool: problems are returned as an error message.
+
+    Information:
+        :param path: The path of the file
+        :type path: str
+        :return: The summary of the file, see parse_midi, or a dict with
+            an "error" message
+        :rtype: dict
+    """
+
+    try:
+        if os.path.getsize(path) > MAX_SIZE:
+            raise ValueError(f"File is larger than {MAX_SIZE} bytes")
+        with open(path, "rb") as file:
+            return parse_midi(file.read())
+    except (OSError, ValueError) as e:
+        return {"error": f"{INVALID}: {e}"}
+
+
+def validate_files(paths: list, workers: int = WORKERS) -> dict:
+    """Files Validation Function
+
+    Description:
+        Validates several files with a pool of processes, handing them out
+        in chunks so the workers keep up with reading the files.
+
+    Information:
+        :param paths: The paths of the files
+        :type paths: list[str]
+        :param workers: Processes validating files
+        :type workers: int
+        :return: The result of validate_file by path
+        :rtype: dict
+    """
+
+    if paths == []:
+        return {}
+
+    with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+        return dict(
+            zip(paths, executor.map(validate_file, paths, chunksize=CHUNKSIZE))
+        )
+
+
+def score(result: dict) -> tuple:
+    """Score Function
+
+    Description:
+        Ranks the validation results of the candidate files of a document.
+        Valid files come first, then the ones with more tracks, as the
+        voices of a piece are usually split into tracks, then the longest.
+
+    Information:
+        :param result: The result of validate_file
+        :type result: dict
+        :return: Sort key, higher is better
+        :rtype: tuple
+    """
+
+    if "error" in result:
+        return (0, 0, 0.0)
+    return (1, result["tracks"], result["duration"])
@@ -5,18 +5,50 @@ Authors:        Benjamin Herrera
 
 Date Created:   19 JAN 2023
 
-Date Modified:  19 JAN 2023
+Date Modified:  17 OCT 2026
 
 Description:    Class to handle MongoDB access and manipulation of collection
 """
 
 # Imports
+import os
 import json
 import pymongo
+import threading
 
 # Constant variable for Mongo URI
 MONGO_BASE_URI = "mongodb://"
 
+# Clients of the current process, shared by every handle in it
+CLIENTS = {}
+CLIENTS_PID = os.getpid()
+CLIENTS_LOCK = threading.Lock()
+
+
+def reset_clients() -> None:
+    """Client Reset Function
+
+    Description:
+        Forgets the clients created by the current process. Runs in forked
+        child processes, as a MongoClient must not be used across a fork.
+        The inherited clients are dropped without being closed, since their
+        sockets are still in use by the parent.
+
+    Information:
+        :return: None
+        :rtype: None
+    """
+
+    global CLIENTS, CLIENTS_PID, CLIENTS_LOCK
+    CLIENTS = {}
+    CLIENTS_PID = os.getpid()
+    CLIENTS_LOCK = threading.Lock()
+
+
+# Reset the clients in forked children where the platform supports it
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=reset_clients)
+
 
 class MongoHandle:
     """Mongo Handling Class
@@ -25,6 +57,11 @@ class MongoHandle:
         Handles the reading, parsing, and manipulation of a mongoDD.
         Utilizes a file pointer to a JSON file to parse login information.
 
+        Clients are created lazily, the first time one is asked for, and
+        only once per process: every handle with the same connection
+        settings in a process shares one pooled client. A process created by
+        a fork gets clients of its own.
+
     Methods:
         MongoHandle(str) -> None
         get_client() -> pymongo.MongoClient
@@ -36,7 +73,18 @@ class MongoHandle:
         Description:
             Parses the given json file and assign values to the following
             instance variables: (1) Address, (2) Port, (3) Username,
-            (4) Password.
+            (4) Password. No connection is made until get_client is called.
+
+            The following keys of the json file are optional and tune the
+            client:
+
+                pool_size: Most connections the client keeps open
+                timeout_ms: Milliseconds allowed for server selection and
+                    for connecting
+                compressors: Comma separated wire compressors to offer,
+                    e.g. "zstd,zlib"
+                write_concern: Write concern of the client, e.g. 1 or
+                    "majority"
 
         Information:
             :param file: File to parse for MongoDB connection
@@ -54,27 +102,54 @@ class MongoHandle:
         self.PASSWORD = login_info["password"]
 
         # Connect to the MongoDB instance based on the given information.
-        # If a localhost connection is specified, then the `client` instance
-        # variable will connect directly to localhost's MongoDB instance.
+        # If a localhost connection is specified, then the client will
+        # connect directly to localhost's MongoDB instance.
         # Else if otherwise.
         if self.ADDRESS.lower() == "localhost":
-            self.client = pymongo.MongoClient(f"{MONGO_BASE_URI}localhost/")
+            self.URI = f"{MONGO_BASE_URI}localhost/"
         else:
-            self.client = pymongo.MongoClient(
+            self.URI = (
                 f"{MONGO_BASE_URI}{self.USERNAME}:{self.PASSWORD}@"
                 + f"{self.ADDRESS}:{self.PORT}/"
             )
 
+        # Read the optional client settings
+        self.OPTIONS = {}
+        if "pool_size" in login_info:
+            self.OPTIONS["maxPoolSize"] = int(login_info["pool_size"])
+        if "timeout_ms" in login_info:
+            self.OPTIONS["serverSelectionTimeoutMS"] = int(
+                login_info["timeout_ms"]
+            )
+            self.OPTIONS["connectTimeoutMS"] = int(login_info["timeout_ms"])
+        if login_info.get("compressors"):
+            self.OPTIONS["compressors"] = login_info["compressors"]
+        if "write_concern" in login_info:
+            self.OPTIONS["w"] = login_info["write_concern"]
+
     def get_client(self) -> pymongo.MongoClient:
         """Getter Method for the Connected Client
 
         Description:
             Returns the Pymongo MongoClient instance of the connected MongoDB
-            instance. Parsable for a multitude of things.
+            instance. Parsable for a multitude of things. The client is
+            created on the first call in each process and shared with every
+            other handle of the process using the same settings.
 
         Information:
             :return: Pymongo MongoClient instance of the connected MongoDB
             :rtype: pymongo.MongoClient
         """
 
-        return self.client  # Return the mongo client instance
+        # Forget the parent's clients in processes that weren't reset by
+        # a fork hook
+        if os.getpid() != CLIENTS_PID:
+            reset_clients()
+
+        # Create the process's client for these settings if there is none
+        key = (self.URI, tuple(sorted(self.OPTIONS.items())))
+        with CLIENTS_LOCK:
+            if key not in CLIENTS:
+                CLIENTS[key] = pymongo.MongoClient(self.URI, **self.OPTIONS)
+
+        return CLIENTS[key]  # Return the mongo client instance
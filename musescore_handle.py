@@ -0,0 +1,251 @@
+"""
+File Name:      musescore_handle.py
+
+Authors:        Benjamin Herrera
+
+Date Created:   17 OCT 2026
+
+Date Modified:  17 OCT 2026
+
+Description:    Class to handle batched conversion of MXL files to MIDI files
+                with MuseScore
+"""
+
+# Imports
+import os
+import json
+import hashlib
+import subprocess
+import concurrent.futures
+from metrics import METRICS
+
+# Constants
+BATCH_SIZE = 50  # Files converted by a single MuseScore invocation
+WORKERS = 2  # MuseScore invocations running at once
+TIMEOUT = 600  # Seconds a single MuseScore invocation may run
+HASH_CHUNK_SIZE = 1024 * 1024  # Bytes read at a time when hashing a file
+
+
+class MuseScoreConverter:
+    """MuseScore Converting Class
+
+    Description:
+        Converts MXL files to MIDI files with MuseScore's batch job mode.
+        Instead of starting MuseScore once per file, pending files are
+        grouped into job files of up to batch_size conversions:
+
+            [
+                {"in": "<source>.mxl", "out": "<cache>/tmp/<hash>.mid"},
+                ...
+            ]
+
+        and a small pool of MuseScore processes works through the job files.
+        Converted files are cached under the SHA-256 hash of their source, so
+        a source is only ever converted once:
+
+            <path_to_cache>
+            ├───<hash>.mid
+            └───tmp
+
+        A conversion counts as successful once its output exists and is not
+        empty, so every failure is attributed to its own source file. If a
+        batch times out, MuseScore may have been killed in the middle of
+        writing an output, so every output of the batch is discarded and its
+        files are retried one per job, so a single bad file can't fail its
+        whole batch.
+
+    Methods:
+        MuseScoreConverter(str, str, int, int, int) -> None
+        convert_many(list, object) -> dict
+    """
+
+    def __init__(
+        self,
+        executable: str,
+        path: str,
+        batch_size: int = BATCH_SIZE,
+        workers: int = WORKERS,
+        timeout: int = TIMEOUT,
+    ) -> None:
+        """Constructor for MuseScore Converting Class
+
+        Description:
+            Creates the cache folder if it doesn't exist and stores the
+            converter's settings.
+
+        Information:
+            :param executable: Path to the MuseScore executable
+            :type executable: str
+            :param path: Path to the cache folder
+            :type path: str
+            :param batch_size: Files converted by a single invocation
+            :type batch_size: int
+            :param workers: Invocations running at once
+            :type workers: int
+            :param timeout: Seconds a single invocation may run
+            :type timeout: int
+            :return: None
+            :rtype: None
+        """
+
+        os.makedirs(os.path.join(path, "tmp"), exist_ok=True)
+
+        self.EXECUTABLE = executable
+        self.PATH = path
+        self.BATCH_SIZE = batch_size
+        self.WORKERS = workers
+        self.TIMEOUT = timeout
+
+    def _hash(self, file_path: str) -> str:
+        """Return the SHA-256 hash of a file's content"""
+        digest = hashlib.sha256()
+        with open(file_path, "rb") as file:
+            for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def _run_batch(self, batch: list) -> tuple:
+        """Batch Running Method
+
+        Description:
+            Converts a batch of sources with one MuseScore invocation and
+            moves every successful output into the cache. Nothing is kept
+            from an invocation that timed out.
+
+        Information:
+            :param batch: Pairs of source hash and source path
+            :type batch: list[tuple[str, str]]
+            :return: Error message of each failed hash, and whether the
+                invocation timed out
+            :rtype: tuple[dict, bool]
+        """
+
+        # Write the batch's job file
+        jobs = [
+            {
+                "in": os.path.abspath(source),
+                "out": os.path.abspath(
+                    os.path.join(self.PATH, "tmp", f"{key}.mid")
+                ),
+            }
+            for key, source in batch
+        ]
+        job_path = os.path.join(self.PATH, "tmp", f"{batch[0][0]}.json")
+        with open(job_path, "w", encoding="utf-8") as file:
+            json.dump(jobs, file)
+
+        # Run MuseScore on the job file
+        timed_out = False
+        try:
+            with METRICS.track("convert"):
+                result = subprocess.run(
+                    [self.EXECUTABLE, "-j", job_path],
+                    capture_output=True,
+                    timeout=self.TIMEOUT,
+                )
+            message = (
+                f"MuseScore produced no output (exit {result.returncode}) "
+                + result.stderr.decode(errors="replace").strip()[-500:]
+            ).strip()
+        except subprocess.TimeoutExpired:
+            timed_out = True
+            message = f"MuseScore timed out after {self.TIMEOUT} seconds"
+        except OSError as e:
+            message = f"MuseScore could not be started: {e}"
+        os.remove(job_path)
+
+        # Move the completed outputs into the cache and note the failures
+        errors = {}
+        for (key, _), job in zip(batch, jobs):
+            if (
+                not timed_out
+                and os.path.exists(job["out"])
+                and os.path.getsize(job["out"])
+            ):
+                os.replace(job["out"], os.path.join(self.PATH, f"{key}.mid"))
+            else:
+                errors[key] = message
+                if os.path.exists(job["out"]):
+                    os.remove(job["out"])
+
+        # Count the converted and failed files
+        METRICS.count("files_total", len(batch) - len(errors), stage="convert")
+        METRICS.count("failures_total", len(errors), stage="convert")
+
+        return errors, timed_out
+
+    def convert_many(self, sources: list, error_func: object) -> dict:
+        """Batch Conversion Method
+
+        Description:
+            Converts every given MXL file to a MIDI file, skipping the ones
+            already in the cache. Sources with the same content are only
+            converted once. error_func is called with the source path and an
+            error message for every file that could not be converted.
+
+        Information:
+            :param sources: Paths of the MXL files to convert
+            :type sources: list[str]
+            :param error_func: Function to call for each failed file. Must
+                intake the source path and the error message
+            :type error_func: object
+            :return: Path of the converted MIDI file for each converted
+                source path
+            :rtype: dict
+        """
+
+        # Find the cached file of every source by its hash. Sources that
+        # can't be read are reported right away.
+        keys = {}
+        for source in sources:
+            try:
+                keys[source] = self._hash(source)
+            except OSError as e:
+                METRICS.count("failures_total", stage="convert")
+                error_func(source, f"MXL file could not be read: {e}")
+        pending = {}
+        for source, key in keys.items():
+            if not os.path.exists(os.path.join(self.PATH, f"{key}.mid")):
+                pending.setdefault(key, source)
+
+        # Group the pending sources into batches
+        pending = list(pending.items())
+        batches = [
+            pending[i : i + self.BATCH_SIZE]
+            for i in range(0, len(pending), self.BATCH_SIZE)
+        ]
+
+        # Run the batches on the pool. Files left unconverted by a timed out
+        # batch are retried one per batch.
+        errors = {}
+        with concurrent.futures.ThreadPoolExecutor(self.WORKERS) as executor:
+            futures = {
+                executor.submit(self._run_batch, batch): batch
+                for batch in batches
+            }
+            while futures:
+                done, _ = concurrent.futures.wait(
+                    futures, return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                for future in done:
+                    batch = futures.pop(future)
+                    failed, timed_out = future.result()
+                    if timed_out and len(batch) > 1:
+                        for key, source in batch:
+                            if key in failed:
+                                retry = executor.submit(
+                                    self._run_batch, [(key, source)]
+                                )
+                                futures[retry] = [(key, source)]
+                    else:
+                        errors.update(failed)
+
+        # Report the failures and return the converted files
+        converted = {}
+        for source, key in keys.items():
+            if key in errors:
+                error_func(source, errors[key])
+            else:
+                converted[source] = os.path.join(self.PATH, f"{key}.mid")
+
+        return converted
@@ -0,0 +1,353 @@
+"""
+File Name:      packed_dataset.py
+
+Authors:        Benjamin Herrera
+
+Date Created:   17 OCT 2026
+
+Date Modified:  17 OCT 2026
+
+Description:    Classes to write and memory-map datasets packed into large
+                blob files with NumPy offset indexes
+"""
+
+# Imports
+import os
+import json
+import bisect
+import shutil
+import numpy as np
+
+# Constants
+MANIFEST_VERSION = 1  # Versioning for the manifest's structure
+PACK_SIZE = 1024 * 1024 * 1024  # Bytes after which a shard's blob ends
+RECORD = np.dtype(
+    [
+        ("midi_offset", "<u8"),
+        ("midi_length", "<u8"),
+        ("text_offset", "<u8"),
+        ("text_length", "<u8"),
+    ]
+)  # Entry of a shard's index
+
+
+class PackedWriter:
+    """Packed Dataset Writing Class
+
+    Description:
+        Packs the MIDI bytes and text of every record into large blob files
+        instead of a file per record:
+
+            <path_to_folder>
+            ├───manifest.json
+            ├───shard-00000.bin
+            ├───shard-00000.idx.npy
+            ├───shard-00000.jsonl
+            └───<...>
+
+        A shard's blob holds the MIDI bytes and the UTF-8 text of its
+        records back to back. Its index is a NumPy array of RECORD entries
+        with the offset and length of both in the blob, and its JSON Lines
+        file holds the index document of every record, in the same order.
+        A shard ends once its blob holds PACK_SIZE bytes.
+
+        The dataset is written to a temp folder that replaces the folder
+        once it is closed, so a reader never sees a partial dataset.
+
+    Methods:
+        PackedWriter(str, int) -> None
+        write(dict, bytes, str) -> dict
+        close() -> dict
+    """
+
+    def __init__(self, path: str, pack_size: int = PACK_SIZE) -> None:
+        """Constructor for Packed Dataset Writing Class
+
+        Description:
+            Creates the temp folder the dataset is written to.
+
+        Information:
+            :param path: Path to the folder of the dataset
+            :type path: str
+            :param pack_size: Bytes after which a shard's blob ends
+            :type pack_size: int
+            :return: None
+            :rtype: None
+        """
+
+        self.PATH = os.path.abspath(path)
+        self.TEMP = f"{self.PATH}.{os.getpid()}.tmp"
+        self.PACK_SIZE = pack_size
+        shutil.rmtree(self.TEMP, ignore_errors=True)
+        os.makedirs(self.TEMP)
+
+        self.shards = []  # Manifest entries of the finished shards
+        self.records = 0  # Records written to the finished shards
+        self.blob = None  # Blob of the shard being written
+
+    def _open_shard(self) -> None:
+        """Start a new shard's blob and metadata files"""
+        stem = f"shard-{len(self.shards):05d}"
+        self.shard = {
+            "blob": f"{stem}.bin",
+            "index": f"{stem}.idx.npy",
+            "documents": f"{stem}.jsonl",
+            "first": self.records,
+            "records": 0,
+            "bytes": 0,
+        }
+        self.entries = []
+        self.blob = open(os.path.join(self.TEMP, self.shard["blob"]), "wb")
+        self.documents = open(
+            os.path.join(self.TEMP, self.shard["documents"]),
+            "w",
+            encoding="utf-8",
+        )
+
+    def _close_shard(self) -> None:
+        """Finish the current shard and save its index"""
+        self.blob.close()
+        self.documents.close()
+        self.blob = None
+        np.save(
+            os.path.join(self.TEMP, self.shard["index"]),
+            np.array(self.entries, dtype=RECORD),
+        )
+        self.records += self.shard["records"]
+        self.shards.append(self.shard)
+
+    def write(self, document: dict, midi: bytes, text: str) -> dict:
+        """Writing Method
+
+        Description:
+            Appends a record to the current shard, and starts a new shard
+            once the current one is full.
+
+        Information:
+            :param document: Index document of the record
+            :type document: dict
+            :param midi: Bytes of the record's MIDI file
+            :type midi: bytes
+            :param text: Text of the record
+            :type text: str
+            :return: The shard and position of the record in it
+            :rtype: dict
+        """
+
+        # Serialize the record first, so a document that can't be
+        # serialized leaves nothing behind
+        line = json.dumps(document) + "\n"
+        data = text.encode("utf-8")
+
+        if self.blob is None:
+            self._open_shard()
+
+        # Append the MIDI bytes and text to the blob
+        offset = self.shard["bytes"]
+        self.blob.write(midi)
+        self.blob.write(data)
+        self.entries.append((offset, len(midi), offset + len(midi), len(data)))
+        self.documents.write(line)
+
+        location = {
+            "shard": len(self.shards),
+            "record": self.shard["records"],
+        }
+        self.shard["records"] += 1
+        self.shard["bytes"] += len(midi) + len(data)
+
+        # End the shard once its blob is full
+        if self.shard["bytes"] >= self.PACK_SIZE:
+            self._close_shard()
+
+        return location
+
+    def close(self) -> dict:
+        """Closing Method
+
+        Description:
+            Finishes the last shard, writes the manifest, and swaps the
+            dataset in place of the folder.
+
+        Information:
+            :return: The manifest
+            :rtype: dict
+        """
+
+        if self.blob is not None:
+            self._close_shard()
+
+        # Write the manifest
+        manifest = {
+            "version": MANIFEST_VERSION,
+            "records": self.records,
+            "shards": self.shards,
+        }
+        with open(
+            os.path.join(self.TEMP, "manifest.json"), "w", encoding="utf-8"
+        ) as file:
+            json.dump(manifest, file, indent=4)
+
+        # Swap the new dataset in
+        shutil.rmtree(self.PATH, ignore_errors=True)
+        os.replace(self.TEMP, self.PATH)
+
+        return manifest
+
+
+class PackedShard:
+    """Packed Shard Class
+
+    Description:
+        Memory-maps a shard of a packed dataset. The MIDI bytes of a record
+        are returned as a read-only view of the mapped blob, so reading a
+        record copies nothing. Shards are independent of each other, so each
+        can be read by its own process.
+
+    Methods:
+        PackedShard(str, dict) -> None
+        midi(int) -> np.ndarray
+        text(int) -> str
+        documents() -> object
+    """
+
+    def __init__(self, path: str, shard: dict) -> None:
+        """Constructor for Packed Shard Class
+
+        Description:
+            Maps the shard's blob and index into memory.
+
+        Information:
+            :param path: Path to the folder of the dataset
+            :type path: str
+            :param shard: Manifest entry of the shard
+            :type shard: dict
+            :return: None
+            :rtype: None
+        """
+
+        self.PATH = path
+        self.SHARD = shard
+        self.index = np.load(os.path.join(path, shard["index"]), mmap_mode="r")
+
+        # An empty file can't be mapped
+        self.blob = (
+            np.memmap(
+                os.path.join(path, shard["blob"]), dtype=np.uint8, mode="r"
+            )
+            if shard["bytes"] > 0
+            else np.zeros(0, dtype=np.uint8)
+        )
+
+    def __len__(self) -> int:
+        """Return the number of records of the shard"""
+        return self.SHARD["records"]
+
+    def __iter__(self) -> object:
+        """Yield the MIDI bytes and text of every record in order"""
+        for position in range(len(self)):
+            yield self.midi(position), self.text(position)
+
+    def midi(self, position: int) -> np.ndarray:
+        """Return a view of the MIDI bytes of a record"""
+        entry = self.index[position]
+        offset = int(entry["midi_offset"])
+        return self.blob[offset : offset + int(entry["midi_length"])]
+
+    def text(self, position: int) -> str:
+        """Return the text of a record"""
+        entry = self.index[position]
+        offset = int(entry["text_offset"])
+        return bytes(
+            self.blob[offset : offset + int(entry["text_length"])]
+        ).decode("utf-8")
+
+    def documents(self) -> object:
+        """Yield the index document of every record in order"""
+        with open(
+            os.path.join(self.PATH, self.SHARD["documents"]),
+            "r",
+            encoding="utf-8",
+        ) as file:
+            for line in file:
+                yield json.loads(line)
+
+
+class PackedReader:
+    """Packed Dataset Reading Class
+
+    Description:
+        Reads a dataset written by PackedWriter. Shards are only mapped into
+        memory when a record of theirs is first read.
+
+            dataset = PackedReader("Ready/packed")
+            midi = dataset.midi(0)  # View of the blob, nothing is copied
+            for shard in dataset.shards():
+                for midi, text in shard:
+                    ...
+
+    Methods:
+        PackedReader(str) -> None
+        shard(int) -> PackedShard
+        shards() -> object
+        midi(int) -> np.ndarray
+        text(int) -> str
+    """
+
+    def __init__(self, path: str) -> None:
+        """Constructor for Packed Dataset Reading Class
+
+        Description:
+            Loads the manifest of the dataset.
+
+        Information:
+            :param path: Path to the folder of the dataset
+            :type path: str
+            :return: None
+            :rtype: None
+        """
+
+        with open(
+            os.path.join(path, "manifest.json"), "r", encoding="utf-8"
+        ) as file:
+            manifest = json.load(file)
+        if manifest.get("version") != MANIFEST_VERSION:
+            raise ValueError(f'Unsupported packed dataset "{path}"')
+
+        self.PATH = path
+        self.records = manifest["records"]
+        self.entries = manifest["shards"]
+        self.firsts = [shard["first"] for shard in self.entries]
+        self.opened = {}  # Mapped shards by number
+
+    def __len__(self) -> int:
+        """Return the number of records of the dataset"""
+        return self.records
+
+    def shard(self, number: int) -> PackedShard:
+        """Return a shard, mapping it on first use"""
+        if number not in self.opened:
+            self.opened[number] = PackedShard(self.PATH, self.entries[number])
+        return self.opened[number]
+
+    def shards(self) -> object:
+        """Yield every shard in order"""
+        for number in range(len(self.entries)):
+            yield self.shard(number)
+
+    def _locate(self, number: int) -> tuple:
+        """Return the shard and position in it of a record"""
+        if not 0 <= number < self.records:
+            raise IndexError(f"Record {number} is out of range")
+        shard = bisect.bisect_right(self.firsts, number) - 1
+        return self.shard(shard), number - self.firsts[shard]
+
+    def midi(self, number: int) -> np.ndarray:
+        """Return a view of the MIDI bytes of a record"""
+        shard, position = self._locate(number)
+        return shard.midi(position)
+
+    def text(self, number: int) -> str:
+        """Return the text of a record"""
+        shard, position = self._locate(number)
+        return shard.text(position)
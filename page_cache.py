@@ -0,0 +1,253 @@
+"""
+File Name:      page_cache.py
+
+Authors:        Benjamin Herrera
+
+Date Created:   17 OCT 2026
+
+Date Modified:  17 OCT 2026
+
+Description:    Class to handle a size-bounded on-disk cache of fetched web
+                pages
+"""
+
+# Imports
+import os
+import json
+import time
+import hashlib
+import threading
+import urllib.error
+import urllib.request
+
+# Constants
+MAX_BYTES = 512 * 1024 * 1024  # Size of the cache before pages are evicted
+MAX_AGE = 7 * 24 * 60 * 60  # Seconds a page is served without revalidation
+EVICT_RATIO = 0.9  # Fraction of the maximum size kept after an eviction
+TIMEOUT = 60  # Seconds allowed for a connection to respond
+NOT_MODIFIED = 304  # HTTP status for an unchanged page
+SERVER_ERROR = 500  # Lowest HTTP status of a failing server
+
+
+class PageCache:
+    """Page Caching Class
+
+    Description:
+        Caches the bodies of fetched pages on disk, so reruns and later
+        passes read pages from disk instead of refetching them:
+
+            <path_to_folder>
+            ├───<url_hash>.html
+            └───<url_hash>.json
+
+        The JSON file holds the page's URL and its ETag and Last-Modified
+        headers. Pages younger than max_age are served as they are. Older
+        pages are revalidated with a conditional request and only downloaded
+        again if they changed. In offline mode, pages are only ever served
+        from the cache.
+
+        The modification time of a page's JSON file is when it was last
+        validated, and that of its body is when it was last used. Once the
+        cache grows past max_bytes, the least recently used pages are
+        evicted.
+
+    Methods:
+        PageCache(str, int, int, bool) -> None
+        fetch(str) -> bytes
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_bytes: int = MAX_BYTES,
+        max_age: int = MAX_AGE,
+        offline: bool = False,
+    ) -> None:
+        """Constructor for Page Caching Class
+
+        Description:
+            Creates the cache folder if it doesn't exist and measures the
+            size of the pages already in it.
+
+        Information:
+            :param path: Path to the cache folder
+            :type path: str
+            :param max_bytes: Size of the cache before pages are evicted
+            :type max_bytes: int
+            :param max_age: Seconds a page is served without revalidation
+            :type max_age: int
+            :param offline: Whether to only serve pages from the cache
+            :type offline: bool
+            :return: None
+            :rtype: None
+        """
+
+        os.makedirs(path, exist_ok=True)
+
+        self.PATH = path
+        self.MAX_BYTES = max_bytes
+        self.MAX_AGE = max_age
+        self.OFFLINE = offline
+        self.lock = threading.Lock()  # Guards the size and evictions
+
+        # Size of the cached pages, kept up to date as pages are stored
+        self.size = sum(
+            entry.stat().st_size
+            for entry in os.scandir(path)
+            if entry.name.endswith(".html")
+        )
+
+    def _paths(self, url: str) -> tuple:
+        """Return the body and metadata paths of a URL"""
+        key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        return f"{self.PATH}/{key}.html", f"{self.PATH}/{key}.json"
+
+    def _read(self, body_path: str) -> bytes:
+        """Read a cached body and mark it as recently used"""
+        with open(body_path, "rb") as file:
+            body = file.read()
+        os.utime(body_path)
+        return body
+
+    def _store(self, url: str, body: bytes, headers: object) -> None:
+        """Page Storing Method
+
+        Description:
+            Writes a page's body and validators to the cache and evicts old
+            pages if the cache grew too large. Files are written under
+            temporary names unique to the process and thread and renamed,
+            so other processes and threads never read a partial page.
+
+        Information:
+            :param url: The URL of the page
+            :type url: str
+            :param body: The body of the page
+            :type body: bytes
+            :param headers: The response headers of the page
+            :type headers: http.client.HTTPMessage
+            :return: None
+            :rtype: None
+        """
+
+        body_path, meta_path = self._paths(url)
+        suffix = f"{os.getpid()}.{threading.get_ident()}.tmp"
+
+        # Write the validators and the body
+        meta = {
+            "url": url,
+            "etag": headers.get("ETag"),
+            "last_modified": headers.get("Last-Modified"),
+        }
+        with open(f"{meta_path}.{suffix}", "w") as file:
+            json.dump(meta, file)
+        with open(f"{body_path}.{suffix}", "wb") as file:
+            file.write(body)
+
+        # Replace the old copy and evict pages once the cache is too large
+        with self.lock:
+            old_size = (
+                os.path.getsize(body_path) if os.path.exists(body_path) else 0
+            )
+            os.replace(f"{meta_path}.{suffix}", meta_path)
+            os.replace(f"{body_path}.{suffix}", body_path)
+            self.size += len(body) - old_size
+            if self.size > self.MAX_BYTES:
+                self._evict()
+
+    def _evict(self) -> None:
+        """Eviction Method
+
+        Description:
+            Removes the least recently used pages until the cache is back
+            under EVICT_RATIO of its maximum size. The folder is rescanned
+            first, as other processes may have added or removed pages. Must
+            be called with the lock held.
+
+        Information:
+            :return: None
+            :rtype: None
+        """
+
+        # List the cached bodies from least to most recently used
+        pages = sorted(
+            (
+                (entry.stat().st_mtime, entry.stat().st_size, entry.path)
+                for entry in os.scandir(self.PATH)
+                if entry.name.endswith(".html")
+            ),
+        )
+        self.size = sum(size for _, size, _ in pages)
+
+        # Remove pages until the cache is small enough
+        for _, size, body_path in pages:
+            if self.size <= self.MAX_BYTES * EVICT_RATIO:
+                break
+            for file_path in (body_path, body_path[:-5] + ".json"):
+                try:
+                    os.remove(file_path)
+                except FileNotFoundError:
+                    pass
+            self.size -= size
+
+    def fetch(self, url: str) -> bytes:
+        """Page Fetching Method
+
+        Description:
+            Returns the body of a page, from the cache when possible. A stale
+            cached page is revalidated with If-None-Match/If-Modified-Since
+            and kept if the server answers 304 Not Modified. If the server
+            can't be reached or answers with a 5xx error, a cached copy is
+            served regardless of its age.
+            In offline mode, a page missing from the cache raises
+            FileNotFoundError.
+
+        Information:
+            :param url: The URL of the page
+            :type url: str
+            :return: The body of the page
+            :rtype: bytes
+        """
+
+        body_path, meta_path = self._paths(url)
+        cached = os.path.exists(body_path) and os.path.exists(meta_path)
+
+        # Serve from the cache when offline or when the page is fresh
+        if cached and (
+            self.OFFLINE
+            or time.time() - os.path.getmtime(meta_path) < self.MAX_AGE
+        ):
+            return self._read(body_path)
+        if self.OFFLINE:
+            raise FileNotFoundError(f"Page not cached: {url}")
+
+        # Make the request conditional on the cached copy's validators
+        request = urllib.request.Request(url)
+        if cached:
+            with open(meta_path, "r") as file:
+                meta = json.load(file)
+            if meta["etag"] is not None:
+                request.add_header("If-None-Match", meta["etag"])
+            if meta["last_modified"] is not None:
+                request.add_header("If-Modified-Since", meta["last_modified"])
+
+        try:
+            with urllib.request.urlopen(request, timeout=TIMEOUT) as response:
+                body = response.read()
+                headers = response.headers
+
+        # Keep the cached copy if it is unchanged or the server is down
+        except urllib.error.HTTPError as e:
+            if cached and e.code == NOT_MODIFIED:
+                os.utime(meta_path)  # Restart the page's freshness
+                return self._read(body_path)
+            if cached and e.code >= SERVER_ERROR:
+                return self._read(body_path)
+            raise
+        except urllib.error.URLError:
+            if cached:
+                return self._read(body_path)
+            raise
+
+        self._store(url, body, headers)  # Cache the new copy
+
+        return body
@@ -0,0 +1,301 @@
+"""
+File Name:      pipeline.py
+
+Authors:        Benjamin Herrera
+
+Date Created:   17 OCT 2026
+
+Date Modified:  17 OCT 2026
+
+Description:    Class to run items through a chain of stages connected by
+                bounded queues
+"""
+
+# Imports
+import time
+import queue
+import threading
+from metrics import METRICS
+
+# Constants
+QUEUE_SIZE = 256  # Items a stage's queue holds before its producer blocks
+REPORT_INTERVAL = 30  # Seconds between progress reports
+DONE = object()  # Marks the end of a stage's input
+
+
+class Stage:
+    """Stage Class
+
+    Description:
+        Holds a pipeline stage's function, its input queue, its workers, and
+        its counters.
+
+    Methods:
+        Stage(str, object, int, int) -> None
+    """
+
+    def __init__(
+        self, name: str, func: object, workers: int, queue_size: int
+    ) -> None:
+        """Constructor for Stage Class
+
+        Description:
+            Creates the stage's bounded input queue and zeroes its counters.
+
+        Information:
+            :param name: Name of the stage in reports
+            :type name: str
+            :param func: Function run on each item. Returns an iterable of
+                the items to pass to the next stage
+            :type func: object
+            :param workers: Number of threads running the function
+            :type workers: int
+            :param queue_size: Items the input queue holds
+            :type queue_size: int
+            :return: None
+            :rtype: None
+        """
+
+        self.name = name
+        self.func = func
+        self.workers = workers
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.lock = threading.Lock()
+        self.processed = 0  # Items completed
+        self.errors = 0  # Items that raised an exception
+        self.busy = 0.0  # Seconds spent in the function
+        self.active = workers  # Workers that haven't finished
+
+
+class Pipeline:
+    """Pipeline Class
+
+    Description:
+        Runs items from a source through a chain of stages. Each stage has
+        its own worker threads and a bounded input queue, so a stage that
+        falls behind fills its queue and blocks the stage before it, all the
+        way back to the source. Memory use therefore stays flat however
+        many items the source yields.
+
+        Each stage function takes one item and returns an iterable of items
+        for the next stage, which allows a stage to drop an item or fan it
+        out. The items returned by the last stage are discarded. An item
+        whose function raises is reported to the error function and dropped
+        without stopping the pipeline.
+
+        While running, the pipeline periodically prints, for every stage,
+        the items processed, the errors, the queue depth, and the share of
+        time its workers were busy. A stage with a full queue and busy
+        workers is the bottleneck.
+
+            pipeline = Pipeline(error_func=print)
+            pipeline.add_stage("extract", extract, workers=2)
+            pipeline.add_stage("download", download, workers=16)
+            pipeline.run(cursor)
+
+    Methods:
+        Pipeline(object, int, int) -> None
+        add_stage(str, object, int) -> None
+        stats() -> dict
+        run(object) -> dict
+    """
+
+    def __init__(
+        self,
+        error_func: object = None,
+        queue_size: int = QUEUE_SIZE,
+        report_interval: int = REPORT_INTERVAL,
+    ) -> None:
+        """Constructor for Pipeline Class
+
+        Description:
+            Creates a pipeline with no stages.
+
+        Information:
+            :param error_func: Function to call when an item fails. Must
+                intake the stage name, the item, and the exception
+            :type error_func: object
+            :param queue_size: Items each stage's queue holds
+            :type queue_size: int
+            :param report_interval: Seconds between progress reports, or
+                None to disable them
+            :type report_interval: int
+            :return: None
+            :rtype: None
+        """
+
+        self.ERROR_FUNC = error_func
+        self.QUEUE_SIZE = queue_size
+        self.REPORT_INTERVAL = report_interval
+        self.stages = []
+
+    def add_stage(self, name: str, func: object, workers: int = 1) -> None:
+        """Stage Adding Method
+
+        Description:
+            Appends a stage to the end of the pipeline.
+
+        Information:
+            :param name: Name of the stage in reports
+            :type name: str
+            :param func: Function run on each item. Returns an iterable of
+                the items to pass to the next stage
+            :type func: object
+            :param workers: Number of threads running the function
+            :type workers: int
+            :return: None
+            :rtype: None
+        """
+
+        self.stages.append(Stage(name, func, workers, self.QUEUE_SIZE))
+
+    def _work(self, index: int) -> None:
+        """Worker Method
+
+        Description:
+            Runs a stage's function on items from its queue until the end of
+            its input, passing the results to the next stage. The last worker
+            of a stage to finish marks the end of the next stage's input, even
+            if the worker itself fails, so the pipeline always drains.
+
+        Information:
+            :param index: Position of the stage in the pipeline
+            :type index: int
+            :return: None
+            :rtype: None
+        """
+
+        stage = self.stages[index]
+        following = (
+            self.stages[index + 1] if index + 1 < len(self.stages) else None
+        )
+
+        try:
+            while True:
+                item = stage.queue.get()
+                if item is DONE:
+                    break
+
+                # Run the function and forward its results
+                start = time.monotonic()
+                failed = False
+                try:
+                    for result in stage.func(item) or ():
+                        if following is not None:
+                            following.queue.put(result)
+
+                # Report the item and keep going
+                except Exception as e:
+                    failed = True
+                    self._report_error(stage.name, item, e)
+
+                with stage.lock:
+                    stage.busy += time.monotonic() - start
+                    stage.processed += 1
+                    stage.errors += failed
+
+        # Pass the end of the input on once every worker is done
+        finally:
+            with stage.lock:
+                stage.active -= 1
+                last = stage.active == 0
+            if last and following is not None:
+                for _ in range(following.workers):
+                    following.queue.put(DONE)
+
+    def _report_error(self, name: str, item: object, error: Exception) -> None:
+        """Pass a failed item to the error function, which must not raise"""
+        if self.ERROR_FUNC is None:
+            return
+        try:
+            self.ERROR_FUNC(name, item, error)
+        except Exception as e:
+            print(f"Error function failed in {name} stage: {e}")
+
+    def stats(self) -> dict:
+        """Statistics Method
+
+        Description:
+            Returns the counters and queue depth of every stage.
+
+        Information:
+            :return: Statistics of each stage by name
+            :rtype: dict
+        """
+
+        return {
+            stage.name: {
+                "processed": stage.processed,
+                "errors": stage.errors,
+                "queued": stage.queue.qsize(),
+                "busy": stage.busy,
+            }
+            for stage in self.stages
+        }
+
+    def _report(self, start: float, previous: dict) -> dict:
+        """Print the progress of every stage and return the statistics"""
+        stats = self.stats()
+        elapsed = time.monotonic() - start
+        for stage in self.stages:
+            current = stats[stage.name]
+            METRICS.set("queue_depth", current["queued"], stage=stage.name)
+            busy = (
+                current["busy"] - previous.get(stage.name, {}).get("busy", 0.0)
+            ) / (self.REPORT_INTERVAL * stage.workers)
+            print(
+                f"[{elapsed:.0f}s] {stage.name}: "
+                + f"{current['processed']} done, "
+                + f"{current['errors']} failed, "
+                + f"{current['queued']}/{self.QUEUE_SIZE} queued, "
+                + f"{busy:.0%} busy"
+            )
+        return stats
+
+    def run(self, source: object) -> dict:
+        """Run Method
+
+        Description:
+            Feeds every item of the source into the first stage and waits
+            until every stage has finished.
+
+        Information:
+            :param source: Iterable of the items to process
+            :type source: object
+            :return: Final statistics of each stage by name
+            :rtype: dict
+        """
+
+        # Start every stage's workers
+        threads = [
+            threading.Thread(target=self._work, args=(index,), daemon=True)
+            for index, stage in enumerate(self.stages)
+            for _ in range(stage.workers)
+        ]
+        for thread in threads:
+            thread.start()
+
+        # Report progress until the pipeline finishes
+        finished = threading.Event()
+
+        def monitor() -> None:
+            start, previous = time.monotonic(), {}
+            while not finished.wait(self.REPORT_INTERVAL):
+                previous = self._report(start, previous)
+
+        if self.REPORT_INTERVAL is not None:
+            threading.Thread(target=monitor, daemon=True).start()
+
+        # Feed the source, blocking whenever the first queue is full
+        first = self.stages[0]
+        for item in source:
+            first.queue.put(item)
+        for _ in range(first.workers):
+            first.queue.put(DONE)
+
+        # Wait for every stage to finish
+        for thread in threads:
+            thread.join()
+        finished.set()
+
+        return self.stats()
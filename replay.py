@@ -0,0 +1,255 @@
+"""
+File Name:      replay.py
+
+Authors:        Benjamin Herrera
+
+Date Created:   17 OCT 2026
+
+Date Modified:  17 OCT 2026
+
+Description:    Script to retry only the items recorded in a data handle's
+                error store, instead of rerunning the whole pipeline
+"""
+
+# Imports
+import sort_filter
+from source_index import SourceIndex
+from midi_check import INVALID
+from metrics import METRICS
+import concurrent.futures
+import os
+
+# Constants
+RAW_LOC = "Data/Raw/"  # Folder of the downloaded dataset
+SOURCE_LOC = sort_filter.SOURCE_LOC  # Source folder of the sorted dataset
+TARGET_LOC = sort_filter.TARGET_LOC  # Folder of the sorted dataset
+INDEX_STORE = "mongo"  # Scratch index store, or "sqlite" to run locally
+DOWNLOAD_WORKERS = 16  # Threads retrying failed downloads
+BATCH_SIZE = 500  # Error records fetched per cursor batch
+METRICS_LOC = sort_filter.METRICS_LOC  # Stats folder
+CLASSES = (
+    "network",
+    "invalid",
+    "missing",
+    "conversion",
+    "copy",
+)  # Error classes, see classify
+
+
+def classify(record: dict) -> str:
+    """Classification Method
+
+    Description:
+        Sort an error record into the stage that has to run again:
+
+            "network"       A file of the document couldn't be downloaded
+            "invalid"       No downloaded MIDI file of the document is
+                            valid
+            "missing"       The document had no valid MIDI or MXL file, or
+                            the file it failed on doesn't exist anymore
+            "conversion"    MuseScore couldn't compile the document's MXL
+                            file
+            "copy"          The document's MIDI file couldn't be copied or
+                            packed
+
+    Information:
+        :param record: The error record
+        :type record: dict
+        :return: The class of the error, one of CLASSES
+        :rtype: str
+    """
+
+    link = str(record.get("link", ""))
+    error = record.get("error", "")
+
+    if link.startswith(("http://", "https://")):
+        return "invalid" if error.startswith(INVALID) else "network"
+    elif error.startswith(("No .MID", INVALID)) or not os.path.exists(link):
+        return "missing"
+    elif os.path.splitext(link)[1].lower() == ".mxl":
+        return "conversion"
+    return "copy"
+
+
+def retry_download(record: dict) -> bool:
+    """Retry Download Method
+
+    Description:
+        Insert the document of a network error again with the same ID.
+        Files downloaded by the failed insertion are kept, so only the
+        missing ones are downloaded.
+
+    Information:
+        :param record: The error record
+        :type record: dict
+        :return: Whether every file of the document is now downloaded
+        :rtype: bool
+    """
+
+    data = record["data"]
+    custom_id, count = data["_id"].rsplit("_", 1)
+
+    # Older records only hold the link that failed
+    links = record.get("links") or [
+        file["url"] for file in data.get("files", []) if "url" in file
+    ] + [record["link"]]
+
+    return (
+        sort_filter.DATA_HANDLE.insert(
+            method=data["method"],
+            title=data["title"],
+            composer=data["composer"],
+            text=data["text"],
+            url=data["link"],
+            links=list(dict.fromkeys(links)),
+            custom_id=custom_id,
+            count=int(count),
+        )
+        is not None
+    )
+
+
+def replay(
+    target_loc: str = TARGET_LOC,
+    source_loc: str = SOURCE_LOC,
+    store: str = INDEX_STORE,
+    workers: int = DOWNLOAD_WORKERS,
+    musescore: str = sort_filter.MUSESCORE,
+    convert_cache: str = sort_filter.CONVERT_CACHE,
+    metrics_loc: str = METRICS_LOC,
+    sharded: bool = False,
+) -> dict:
+    """Replay Method
+
+    Description:
+        Retry the items in the error store of a data handle, grouped by the
+        class of their error (see classify), each class running only its
+        own stage:
+
+            "network"       Downloads are retried by a pool of threads
+            "invalid"       The MIDI files are validated again, in case
+                            they were replaced
+            "missing"       The source folder is scanned again and the
+                            best valid MIDI files are copied, or the MXL
+                            files compiled if there is none
+            "conversion"    The MXL files are compiled in MuseScore batches
+            "copy"          The files are copied by a pool of threads
+
+        The records of the items that succeed are removed from the store,
+        and the index and errors are compiled again. Items that fail again
+        keep their first error record.
+
+        Items are always copied, as the packed dataset is only written as a
+        whole by sort_filter.
+
+    Information:
+        :param target_loc: Path to the folder of the data handle
+        :type target_loc: str
+        :param source_loc: Path to the source folder of the data handle
+        :type source_loc: str
+        :param store: Scratch index store of the data handle
+        :type store: str
+        :param workers: Threads retrying failed downloads
+        :type workers: int
+        :param musescore: Path to the MuseScore executable
+        :type musescore: str
+        :param convert_cache: Path to the folder of compiled files
+        :type convert_cache: str
+        :param metrics_loc: Path to the metrics folder
+        :type metrics_loc: str
+        :param sharded: Whether the handle exports compressed shards
+        :type sharded: bool
+        :return: The number of records replayed and recovered by class
+        :rtype: dict
+    """
+
+    sort_filter.open_target(target_loc, store, metrics_loc, sharded=sharded)
+    data_handle = sort_filter.DATA_HANDLE
+
+    # Group the error records by class
+    data_handle.flush()
+    groups = {name: [] for name in CLASSES}
+    for record in data_handle.STORE.iterate("error", BATCH_SIZE):
+        groups[classify(record)].append(record)
+
+    recovered = {name: [] for name in CLASSES}
+
+    # Retry the downloads
+    with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+        results = executor.map(retry_download, groups["network"])
+        for record, result in zip(groups["network"], results):
+            if result:
+                recovered["network"].append(record["_id"])
+
+    # Validate the invalid items' files again
+    if groups["invalid"] != []:
+        ids = [record["_id"] for record in groups["invalid"]]
+        failed = set(data_handle.validate(ids=ids))
+        recovered["invalid"] = [id for id in ids if id not in failed]
+
+    # Look the missing items up in the source folder again
+    copies = [(record["link"], record["data"]) for record in groups["copy"]]
+    pending = [
+        (record["data"], record["link"]) for record in groups["conversion"]
+    ]
+    if groups["missing"] != []:
+        source_files = SourceIndex(source_loc).scan()
+        for record in groups["missing"]:
+            files = source_files.get(record["_id"], {})
+            mid_files = files.get(".mid", []) + files.get(".midi", [])
+            mxl_files = files.get(".mxl", [])
+            mid_file, midi = None, None
+            if mid_files != []:
+                # Validate the files again, as they may have been replaced
+                mid_file, midi = sort_filter.best_midi({}, mid_files)
+            if midi is not None and "error" not in midi:
+                copies.append((mid_file, {**record["data"], "midi": midi}))
+            elif mxl_files != []:
+                pending.append((record["data"], mxl_files[0]))
+
+    # Copy the files and compile the MXL files
+    results = data_handle.copy_many(copies)
+    done = {copy[1]["_id"] for copy, result in zip(copies, results) if result}
+    done.update(
+        item["_id"]
+        for item in sort_filter.convert(pending, musescore, convert_cache)
+    )
+    for name in ("missing", "conversion", "copy"):
+        recovered[name] = [
+            record["_id"] for record in groups[name] if record["_id"] in done
+        ]
+
+    # Remove the records of the recovered items
+    for name in CLASSES:
+        failed = len(groups[name]) - len(recovered[name])
+        METRICS.count(
+            "files_total", len(recovered[name]), stage="replay", error=name
+        )
+        METRICS.count("failures_total", failed, stage="replay", error=name)
+    data_handle.remove_errors(
+        [id for name in CLASSES for id in recovered[name]]
+    )
+    data_handle.compile_index_and_errors()
+
+    return {
+        name: {
+            "replayed": len(groups[name]),
+            "recovered": len(recovered[name]),
+        }
+        for name in CLASSES
+    }
+
+
+# Main run thread
+if __name__ == "__main__":
+    # Replay the failed downloads, then the failed sorting
+    for path, source, sharded in (
+        (RAW_LOC, RAW_LOC, True),
+        (TARGET_LOC, SOURCE_LOC, False),
+    ):
+        counts = replay(path, source, sharded=sharded)
+        for name, count in counts.items():
+            print(
+                f"{path} {name}: {count['recovered']}/{count['replayed']}"
+                + " recovered"
+            )
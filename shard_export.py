@@ -0,0 +1,415 @@
+"""
+File Name:      shard_export.py
+
+Authors:        Benjamin Herrera
+
+Date Created:   17 OCT 2026
+
+Date Modified:  17 OCT 2026
+
+Description:    Classes to write and read exports split into compressed JSON
+                Lines shards with a manifest and per-record offset tables
+"""
+
+# Imports
+import os
+import gzip
+import json
+import uuid
+import bisect
+from bson.json_util import loads
+
+# zstd compression is only available with the zstandard package
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Constants
+MANIFEST_VERSION = 1  # Versioning for the manifest's structure
+COMPRESSION = "gzip"  # Compression of the shards, "gzip" or "zstd"
+SHARD_SIZE = 64 * 1024 * 1024  # Uncompressed bytes after which a shard ends
+BLOCK_SIZE = 64 * 1024  # Uncompressed bytes after which a block is compressed
+EXTENSIONS = {"gzip": "gz", "zstd": "zst"}  # Shard extension by compression
+
+
+def compress(data: bytes, compression: str) -> bytes:
+    """Compress a block into a standalone gzip member or zstd frame"""
+    if compression == "zstd":
+        return zstandard.ZstdCompressor().compress(data)
+    return gzip.compress(data, mtime=0)
+
+
+def decompress(data: bytes, compression: str) -> bytes:
+    """Decompress a single block"""
+    if compression == "zstd":
+        return zstandard.ZstdDecompressor().decompress(data)
+    return gzip.decompress(data)
+
+
+class ShardWriter:
+    """Shard Writing Class
+
+    Description:
+        Writes the records of an export to size-bounded shards in a "shards"
+        folder, and a manifest next to them:
+
+            <path_to_folder>
+            ├───<name>.manifest.json
+            └───shards
+                ├───<name>-<generation>-00000.jsonl.gz
+                ├───<name>-<generation>-00000.offsets.json
+                └───<...>
+
+        A shard is JSON Lines cut into blocks of about BLOCK_SIZE bytes, each
+        compressed on its own, like BGZF. The blocks are plain gzip members
+        (or zstd frames) one after the other, so a shard also decompresses as
+        a whole with the usual tools. A shard ends once it holds SHARD_SIZE
+        uncompressed bytes.
+
+        The manifest lists the shards in order with their record counts and
+        the compressed offset and length of their blocks. The offset table
+        of a shard holds, for every record, its ID, its block, and its byte
+        offset in the decompressed block, so a single record can be read by
+        decompressing a single block.
+
+        Every export gets a new generation of shard files. The manifest is
+        swapped in once the export is complete, so a reader never sees a
+        partial export. The shards of the previous generation are kept until
+        the next export, so readers that loaded the previous manifest can
+        finish reading, and those of older generations are removed.
+
+    Methods:
+        ShardWriter(str, str, str, int, int) -> None
+        write(str, str) -> None
+        close() -> dict
+    """
+
+    def __init__(
+        self,
+        path: str,
+        name: str,
+        compression: str = COMPRESSION,
+        shard_size: int = SHARD_SIZE,
+        block_size: int = BLOCK_SIZE,
+    ) -> None:
+        """Constructor for Shard Writing Class
+
+        Description:
+            Creates the shards folder if it doesn't exist and starts a new
+            generation of shards.
+
+        Information:
+            :param path: Path to the folder of the export
+            :type path: str
+            :param name: Name of the export, like "index_en"
+            :type name: str
+            :param compression: Compression of the shards, "gzip" or "zstd"
+            :type compression: str
+            :param shard_size: Uncompressed bytes after which a shard ends
+            :type shard_size: int
+            :param block_size: Uncompressed bytes after which a block is
+                compressed
+            :type block_size: int
+            :return: None
+            :rtype: None
+        """
+
+        # Check that the compression is available
+        if compression not in EXTENSIONS:
+            raise ValueError(f'Unknown compression "{compression}"')
+        if compression == "zstd" and zstandard is None:
+            raise ValueError('zstd shards need the "zstandard" package')
+
+        self.PATH = path
+        self.NAME = name
+        self.COMPRESSION = compression
+        self.SHARD_SIZE = shard_size
+        self.BLOCK_SIZE = block_size
+        self.GENERATION = uuid.uuid4().hex[:8]
+        self.FOLDER = os.path.join(path, "shards")
+        self.MANIFEST = os.path.join(path, f"{name}.manifest.json")
+        os.makedirs(self.FOLDER, exist_ok=True)
+
+        self.shards = []  # Manifest entries of the finished shards
+        self.records = 0  # Records written to the finished shards
+        self.file = None  # Shard being written
+        self.block = []  # Lines of the block being filled
+
+    def _open_shard(self) -> None:
+        """Start a new shard file and its offset table"""
+        stem = f"{self.NAME}-{self.GENERATION}-{len(self.shards):05d}"
+        self.shard = {
+            "file": f"shards/{stem}.jsonl.{EXTENSIONS[self.COMPRESSION]}",
+            "offsets": f"shards/{stem}.offsets.json",
+            "first": self.records,
+            "records": 0,
+            "bytes": 0,
+            "compressed_bytes": 0,
+            "blocks": [],
+        }
+        self.offsets = []
+        self.block_bytes = 0
+        self.file = open(os.path.join(self.PATH, self.shard["file"]), "wb")
+
+    def _write_block(self) -> None:
+        """Compress the lines of the current block and append them"""
+        data = compress(b"".join(self.block), self.COMPRESSION)
+        self.file.write(data)
+        self.shard["blocks"].append(
+            [self.shard["compressed_bytes"], len(data)]
+        )
+        self.shard["compressed_bytes"] += len(data)
+        self.block = []
+        self.block_bytes = 0
+
+    def _close_shard(self) -> None:
+        """Finish the current shard and write its offset table"""
+        if self.block != []:
+            self._write_block()
+        self.file.close()
+        self.file = None
+
+        with open(
+            os.path.join(self.PATH, self.shard["offsets"]),
+            "w",
+            encoding="utf-8",
+        ) as file:
+            json.dump(self.offsets, file)
+
+        self.records += self.shard["records"]
+        self.shards.append(self.shard)
+
+    def write(self, id: str, line: str) -> None:
+        """Writing Method
+
+        Description:
+            Appends a record to the current shard, compressing the current
+            block and starting a new shard as they fill up.
+
+        Information:
+            :param id: The ID of the record
+            :type id: str
+            :param line: The record serialized as a single line of JSON
+            :type line: str
+            :return: None
+            :rtype: None
+        """
+
+        if self.file is None:
+            self._open_shard()
+
+        # Add the line to the block and note where it starts
+        data = (line + "\n").encode("utf-8")
+        self.offsets.append(
+            [str(id), len(self.shard["blocks"]), self.block_bytes]
+        )
+        self.block.append(data)
+        self.block_bytes += len(data)
+        self.shard["records"] += 1
+        self.shard["bytes"] += len(data)
+
+        # Compress full blocks and end full shards
+        if self.shard["bytes"] >= self.SHARD_SIZE:
+            self._close_shard()
+        elif self.block_bytes >= self.BLOCK_SIZE:
+            self._write_block()
+
+    def close(self) -> dict:
+        """Closing Method
+
+        Description:
+            Finishes the last shard, swaps in the manifest, and removes the
+            shards of the exports with the same name before the previous one.
+
+        Information:
+            :return: The manifest
+            :rtype: dict
+        """
+
+        if self.file is not None:
+            self._close_shard()
+
+        # Write the manifest under a temp name and swap it in
+        manifest = {
+            "version": MANIFEST_VERSION,
+            "name": self.NAME,
+            "compression": self.COMPRESSION,
+            "records": self.records,
+            "shards": self.shards,
+        }
+        temp_name = f"{self.MANIFEST}.{os.getpid()}.tmp"
+        with open(temp_name, "w", encoding="utf-8") as file:
+            json.dump(manifest, file, indent=4)
+
+        # Note the shards of the previous manifest, which readers may still
+        # be using, before swapping in the new one
+        kept = set()
+        try:
+            with open(self.MANIFEST, "r", encoding="utf-8") as file:
+                for shard in json.load(file)["shards"]:
+                    kept.add(os.path.basename(shard["file"]))
+                    kept.add(os.path.basename(shard["offsets"]))
+        except (FileNotFoundError, ValueError, KeyError):
+            pass
+        os.replace(temp_name, self.MANIFEST)
+
+        # Remove the shards of the generations before the previous one
+        current = f"{self.NAME}-{self.GENERATION}-"
+        for file_name in os.listdir(self.FOLDER):
+            if (
+                file_name.startswith(f"{self.NAME}-")
+                and not file_name.startswith(current)
+                and file_name not in kept
+            ):
+                os.remove(os.path.join(self.FOLDER, file_name))
+
+        return manifest
+
+
+class ShardReader:
+    """Shard Reading Class
+
+    Description:
+        Reads an export written by ShardWriter through its manifest. Only
+        the manifest is loaded up front, so opening an export costs the same
+        however many records it holds. Shards are streamed one block at a
+        time, and the offset table of a shard is only loaded when a record
+        of it is looked up.
+
+            reader = ShardReader("Raw/index_en.manifest.json")
+            for shard in reader.shards:
+                for document in reader.read_shard(shard):
+                    ...
+
+    Methods:
+        ShardReader(str) -> None
+        read_shard(dict) -> object
+        offsets(dict) -> list
+        get(int) -> dict
+        find(str) -> dict
+    """
+
+    def __init__(self, manifest_file: str) -> None:
+        """Constructor for Shard Reading Class
+
+        Description:
+            Loads the manifest of an export.
+
+        Information:
+            :param manifest_file: Path to the manifest of the export
+            :type manifest_file: str
+            :return: None
+            :rtype: None
+        """
+
+        with open(manifest_file, "r", encoding="utf-8") as file:
+            manifest = json.load(file)
+        if manifest.get("version") != MANIFEST_VERSION:
+            raise ValueError(f'Unsupported manifest "{manifest_file}"')
+
+        self.PATH = os.path.dirname(os.path.abspath(manifest_file))
+        self.COMPRESSION = manifest["compression"]
+        self.records = manifest["records"]
+        self.shards = manifest["shards"]
+        self.firsts = [shard["first"] for shard in self.shards]
+        self.cached = (None, None)  # Last loaded shard and offset table
+
+    def __len__(self) -> int:
+        """Return the number of records of the export"""
+        return self.records
+
+    def __iter__(self) -> object:
+        """Yield every record of the export in order"""
+        for shard in self.shards:
+            yield from self.read_shard(shard)
+
+    def _read_block(self, file: object, block: list) -> bytes:
+        """Read and decompress a block of an open shard file"""
+        file.seek(block[0])
+        return decompress(file.read(block[1]), self.COMPRESSION)
+
+    def read_shard(self, shard: dict) -> object:
+        """Shard Reading Method
+
+        Description:
+            Yields the records of a shard in order, decompressing a block at
+            a time.
+
+        Information:
+            :param shard: Manifest entry of the shard
+            :type shard: dict
+            :return: Iterator over the records
+            :rtype: object
+        """
+
+        with open(os.path.join(self.PATH, shard["file"]), "rb") as file:
+            for block in shard["blocks"]:
+                for line in self._read_block(file, block).splitlines():
+                    yield loads(line)
+
+    def offsets(self, shard: dict) -> list:
+        """Offset Table Method
+
+        Description:
+            Loads the offset table of a shard: the ID, block, and offset in
+            the decompressed block of every record.
+
+        Information:
+            :param shard: Manifest entry of the shard
+            :type shard: dict
+            :return: ID, block, and offset of each record of the shard
+            :rtype: list[list]
+        """
+
+        if self.cached[0] is not shard:
+            path = os.path.join(self.PATH, shard["offsets"])
+            with open(path, "r", encoding="utf-8") as file:
+                self.cached = (shard, json.load(file))
+        return self.cached[1]
+
+    def _read_record(self, shard: dict, position: int) -> dict:
+        """Read a record of a shard by its position in the shard"""
+        _, block, start = self.offsets(shard)[position]
+        with open(os.path.join(self.PATH, shard["file"]), "rb") as file:
+            data = self._read_block(file, shard["blocks"][block])
+        return loads(data[start : data.index(b"\n", start)])
+
+    def get(self, number: int) -> dict:
+        """Record Lookup Method
+
+        Description:
+            Returns a record by its position in the export, reading only the
+            block that holds it.
+
+        Information:
+            :param number: Position of the record in the export
+            :type number: int
+            :return: The record
+            :rtype: dict
+        """
+
+        if not 0 <= number < self.records:
+            raise IndexError(f"Record {number} is out of range")
+        shard = self.shards[bisect.bisect_right(self.firsts, number) - 1]
+        return self._read_record(shard, number - shard["first"])
+
+    def find(self, id: str) -> dict:
+        """ID Lookup Method
+
+        Description:
+            Returns the record with the given ID, searching the offset tables
+            one shard at a time.
+
+        Information:
+            :param id: The ID of the record
+            :type id: str
+            :return: The record, or None if there is none
+            :rtype: dict
+        """
+
+        for shard in self.shards:
+            for position, entry in enumerate(self.offsets(shard)):
+                if entry[0] == str(id):
+                    return self._read_record(shard, position)
+        return None
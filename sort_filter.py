@@ -11,96 +11,516 @@ Description:    Script to sort and filter out a downloaded dataset of digital
 
 # Imports
 from data_handle import DataHandle
+from musescore_handle import MuseScoreConverter
+from source_index import SourceIndex
+from shard_export import ShardReader
+from packed_dataset import PackedWriter
+from midi_check import validate_file, validate_files, score
+from metrics import METRICS
 from tqdm import tqdm
+from bson.json_util import loads
 import concurrent.futures
 import json
-import glob
 import os
 
 # Constants
 SOURCE_LOC = "D:\\Projects\\VIVY\\Data\\Raw\\"
 TARGET_LOC = "D:\\Projects\\VIVY\\Data\\Ready\\"
-DATA_HANDLE = DataHandle(TARGET_LOC)
-SOURCE_INDEX = json.load(open(f"{SOURCE_LOC}\\index.json"))
+INDEX_STORE = "mongo"  # Scratch index store, or "sqlite" to run locally
+WORKERS = 8  # Processes copying files
+SOURCE_MANIFEST = "index_en.manifest.json"  # Sharded export of the source
+SOURCE_LOG = "index_en.log.jsonl"  # Source records logged since its export
+COPY_MODE = "reflink"  # First copy mode tried, see file_copy.copy_file
+PACKED = False  # Pack the MIDI files into "<target>/packed" instead of a tree
 MUSESCORE = "D:\\Programs\\MuseScore\\bin\\MuseScore3.exe"
+CONVERT_CACHE = "D:\\Projects\\VIVY\\Data\\Cache\\MuseScore\\"
+CONVERT_BATCH_SIZE = 50  # MXL files converted per MuseScore invocation
+CONVERT_WORKERS = 2  # MuseScore invocations running at once
+CONVERT_TIMEOUT = 600  # Seconds a MuseScore invocation may run
+METRICS_LOC = "D:\\Projects\\VIVY\\Data\\Metrics\\"  # Stats folder
+METRICS_PORT = 9465  # Port of the Prometheus endpoint on localhost
+DATA_HANDLE = None  # Data handle of the target folder, set by open_target
+PACKING = False  # Whether MIDI files are left to be packed, set by open_target
 
 
-def process(item: dict) -> None:
+def open_target(
+    target_loc: str,
+    store: str,
+    metrics_loc: str,
+    packed: bool = False,
+    copy_mode: str = COPY_MODE,
+    sharded: bool = False,
+) -> None:
+    """Target Opening Method
+
+    Description:
+        Open the data handle of the target folder and configure the metrics
+        of the current process. Runs in the main process and, as the pool's
+        initializer, in every worker process.
+
+    Information:
+        :param target_loc: Path to the target folder
+        :type target_loc: str
+        :param store: Scratch index store of the target's data handle
+        :type store: str
+        :param metrics_loc: Path to the metrics folder
+        :type metrics_loc: str
+        :param packed: Whether MIDI files are left to be packed
+        :type packed: bool
+        :param copy_mode: First copy mode tried by the data handle
+        :type copy_mode: str
+        :param sharded: Whether the data handle exports compressed shards
+        :type sharded: bool
+        :return: None
+        :rtype: None
+    """
+
+    global DATA_HANDLE, PACKING
+    PACKING = packed
+    METRICS.configure(metrics_loc)
+    DATA_HANDLE = DataHandle(
+        target_loc, store=store, copy_mode=copy_mode, sharded=sharded
+    )
+
+
+def best_midi(item: dict, mid_files: list) -> tuple:
+    """Best MIDI Method
+
+    Description:
+        Pick the best of a document's MIDI files, see midi_check.score.
+        Files are ranked with the validation results recorded in the
+        document's file records by DataHandle.validate, and files without
+        one are validated here.
+
+    Information:
+        :param item: Dictionary/document the files belong to
+        :type item: dict
+        :param mid_files: Paths of the document's MIDI files
+        :type mid_files: list[str]
+        :return: The path of the best file and its validation result
+        :rtype: tuple[str, dict]
+    """
+
+    checked = {
+        file["name"]: file["midi"]
+        for file in item.get("files", [])
+        if "midi" in file
+    }
+    results = {
+        path: checked.get(os.path.basename(path)) or validate_file(path)
+        for path in mid_files
+    }
+    path = max(mid_files, key=lambda path: score(results[path]))
+    return path, results[path]
+
+
+def process(item: dict, files: dict) -> tuple:
     """Process Method
 
     Description:
-        For the given dictionary instance, copy or compile MIDI files to
-        transfer over to a DB that handles filtered and sorted MIDI files
+        For the given dictionary instance, copy the best valid MIDI file to
+        transfer over to a DB that handles filtered and sorted MIDI files.
+        The file's validation result is added to the item as "midi". Items
+        without a valid MIDI file but with an MXL file are returned so their
+        MIDI files can be compiled in batches afterwards. When packing, items
+        are returned with their MIDI file instead of copied, so the main
+        process can pack them.
 
     Information:
         :param item: Dictionary/document to process for filtering/sorting
         :type item: dict
-        :return: None
-        :rtype: None
+        :param files: Paths of the document's files by extension, as listed
+            by the source index
+        :type files: dict
+        :return: The item and its MXL file if it needs compiling, or its
+            MIDI file if it is to be packed, else None
+        :rtype: tuple[dict, str]
     """
 
-    # Get file paths that have the ".mid" file type
-    mid_files = glob.glob(
-        f"{SOURCE_LOC}\\data\\{item['_id']}\\*.mid"
-    ) + glob.glob(f"{SOURCE_LOC}\\data\\{item['_id']}\\*.midi")
-    mxl_files = glob.glob(f"{SOURCE_LOC}\\data\\{item['_id']}\\*.mxl")
-
-    # Copy file to the target DB if the mid_files list is not empty
-    if mid_files != []:
-        DATA_HANDLE.copy(from_path=mid_files[0], index_doc=item)
-
-    # If no MIDI files are present, compile MIDI file from an existing MXL file
-    elif mxl_files != []:
-        filename = (
-            mxl_files[-1].split("\\")[-1].split(".")[0]
-        )  # Get name of the MXL file
-
-        filepath = "\\".join(
-            mxl_files[-1].split("\\")[:-1]
-        )  # Get file path to the MXL file
-
-        # Try to convert and copy data
-        try:
-            os.system(
-                f"{MUSESCORE} {mxl_files[0]} -o {filepath}\\{filename}.mid"
-            )  # Compile the MXL file
-
-            # Copy data
-            DATA_HANDLE.copy(
-                from_path=f"{filepath}\\{filename}.mid", index_doc=item
-            )
+    with METRICS.track("document"):
+        # Get file paths that have the ".mid" file type
+        mid_files = files.get(".mid", []) + files.get(".midi", [])
+        mxl_files = files.get(".mxl", [])
+
+        # Pick the best of the MIDI files
+        mid_file, midi = None, None
+        if mid_files != []:
+            mid_file, midi = best_midi(item, mid_files)
+            if "error" not in midi:
+                item = {**item, "midi": midi}
+
+        # Leave the file to be packed if a valid MIDI file was found
+        if "midi" in item and PACKING:
+            return item, mid_file
+
+        # Copy file to the target DB if a valid MIDI file was found
+        elif "midi" in item:
+            DATA_HANDLE.copy(from_path=mid_file, index_doc=item)
 
-            os.remove(f"{filepath}\\{filename}.mid")  # Delete compiled file
+        # If no valid MIDI files are present, leave the MXL file to be
+        # compiled
+        elif mxl_files != []:
+            return item, mxl_files[0]
 
-        # Catch error and handle
-        except Exception as e:
-            # Call error handle method
+        # Report the invalid MIDI file
+        elif midi is not None:
             DATA_HANDLE.error_handle(
-                data=item, error=str(e), link=mxl_files[0]
+                data=item, error=midi["error"], link=mid_file
             )
 
-            return  # return
+        # Report error if no file was file
+        else:
+            DATA_HANDLE.error_handle(
+                data=item,
+                error="No .MID, .MIDI, or .MXL file found",
+                link=item["_id"],
+            )
+
+        return  # return
+
+
+def read_log(log_file: str) -> dict:
+    """Return the records of a checkpoint log by ID, the last one winning"""
+    logged = {}
+    if os.path.exists(log_file):
+        with open(log_file, "r", encoding="utf-8") as file:
+            for line in file:
+                if line.strip() != "":
+                    document = loads(line)
+                    logged[str(document["_id"])] = document
+    return logged
+
+
+def process_shard(
+    manifest_file: str, shard: dict, files: dict, skip: set = frozenset()
+) -> list:
+    """Process Shard Method
+
+    Description:
+        Process every document of a shard of the source's sharded export,
+        streaming the shard a block at a time. Documents with a newer record
+        in the source's checkpoint log are skipped.
+
+    Information:
+        :param manifest_file: Path to the manifest of the export
+        :type manifest_file: str
+        :param shard: Manifest entry of the shard
+        :type shard: dict
+        :param files: Paths of the files of each document of the shard by
+            extension, as listed by the source index
+        :type files: dict
+        :param skip: IDs of the documents to skip
+        :type skip: set[str]
+        :return: The items and MXL or MIDI files returned by process
+        :rtype: list[tuple[dict, str]]
+    """
 
-    # Report error if no file was file
-    else:
-        DATA_HANDLE.error_handle(
-            data=item,
-            error="No .MID, .MIDI, or .MXL file found",
-            link=item["_id"],
+    reader = ShardReader(manifest_file)
+    return [
+        result
+        for result in (
+            process(item, files.get(item["_id"], {}))
+            for item in reader.read_shard(shard)
+            if str(item["_id"]) not in skip
         )
+        if result is not None
+    ]
 
-    return  # return
 
+def collect(results: list, packer: PackedWriter = None) -> list:
+    """Collect Method
+
+    Description:
+        Pack the MIDI files returned by process as soon as they arrive, so
+        the main process doesn't hold them until every document is done.
+
+    Information:
+        :param results: The items and MXL or MIDI files returned by process
+        :type results: list[tuple[dict, str]]
+        :param packer: Writer of the packed dataset, or None to copy
+        :type packer: PackedWriter
+        :return: The items and MXL files left to compile
+        :rtype: list[tuple[dict, str]]
+    """
+
+    pending = []
+    for item, file in results:
+        if os.path.splitext(file)[1].lower() == ".mxl" or packer is None:
+            pending.append((item, file))
+        else:
+            DATA_HANDLE.pack(packer, file, item)
+    return pending
+
+
+def process_export(
+    executor: object,
+    manifest_file: str,
+    source_files: dict,
+    workers: int,
+    progress: bool,
+    packer: PackedWriter = None,
+) -> list:
+    """Process Export Method
+
+    Description:
+        Spread the shards of the source's sharded export across the pool's
+        worker processes. Only a couple of shards per worker are in flight
+        at a time, and the MIDI files of a shard are packed as soon as it
+        is done, so the memory use of the main process doesn't grow with
+        the size of the export.
+
+        The export and the source's checkpoint log together are the state
+        of the source, so the documents logged since the export are
+        processed from the log instead of the export.
+
+    Information:
+        :param executor: Pool of worker processes
+        :type executor: concurrent.futures.Executor
+        :param manifest_file: Path to the manifest of the export
+        :type manifest_file: str
+        :param source_files: Paths of each document's files by extension
+        :type source_files: dict
+        :param workers: Processes copying files
+        :type workers: int
+        :param progress: Whether to show a progress bar
+        :type progress: bool
+        :param packer: Writer of the packed dataset, or None to copy
+        :type packer: PackedWriter
+        :return: The items and MXL files left to compile
+        :rtype: list[tuple[dict, str]]
+    """
+
+    reader = ShardReader(manifest_file)
+    logged = read_log(os.path.join(os.path.dirname(manifest_file), SOURCE_LOG))
+    shards = iter(reader.shards)
+    running = {}
+    pending = []
+
+    def submit() -> None:
+        """Submit the next shard along with the files of its documents"""
+        shard = next(shards, None)
+        if shard is not None:
+            ids = [id for id, _, _ in reader.offsets(shard)]
+            files = {id: source_files.get(id, {}) for id in ids}
+            skip = {id for id in ids if id in logged}
+            future = executor.submit(
+                process_shard, manifest_file, shard, files, skip
+            )
+            running[future] = shard["records"] - len(skip)
+            bar.total -= len(skip)  # Counted with the logged documents
+
+    with tqdm(total=len(reader) + len(logged), disable=not progress) as bar:
+        for _ in range(2 * workers):
+            submit()
+
+        # Collect finished shards and keep the workers fed
+        while running:
+            done, _ = concurrent.futures.wait(
+                running, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            for future in done:
+                pending.extend(collect(future.result(), packer))
+                bar.update(running.pop(future))
+                submit()
+
+        # Process the documents logged since the export
+        for result in executor.map(
+            process,
+            logged.values(),
+            (source_files.get(id, {}) for id in logged),
+        ):
+            if result is not None:
+                pending.extend(collect([result], packer))
+            bar.update(1)
+
+    return pending
+
+
+def convert(
+    pending: list,
+    musescore: str = MUSESCORE,
+    convert_cache: str = CONVERT_CACHE,
+    packer: PackedWriter = None,
+) -> list:
+    """Convert Method
+
+    Description:
+        Compile MIDI files from the MXL files of the given items in MuseScore
+        batches, validate them, and copy the compiled files over to the DB,
+        or pack them if a packed dataset writer is given. Items whose MXL
+        file could not be compiled into a valid MIDI file are reported
+        through the error handle.
+
+    Information:
+        :param pending: Items and their MXL files to compile
+        :type pending: list[tuple[dict, str]]
+        :param musescore: Path to the MuseScore executable
+        :type musescore: str
+        :param convert_cache: Path to the folder of compiled files
+        :type convert_cache: str
+        :param packer: Writer of the packed dataset, or None to copy
+        :type packer: PackedWriter
+        :return: The items whose compiled MIDI file was copied or packed
+        :rtype: list[dict]
+    """
+
+    # Items by MXL file, to attribute the results back to them
+    items = {}
+    for item, mxl_file in pending:
+        items.setdefault(mxl_file, []).append(item)
+
+    def error_func(mxl_file: str, error: str) -> None:
+        """Report a failed compilation for every item of the MXL file"""
+        for item in items[mxl_file]:
+            DATA_HANDLE.error_handle(data=item, error=error, link=mxl_file)
+
+    # Compile the MXL files
+    converter = MuseScoreConverter(
+        musescore,
+        convert_cache,
+        batch_size=CONVERT_BATCH_SIZE,
+        workers=CONVERT_WORKERS,
+        timeout=CONVERT_TIMEOUT,
+    )
+    converted = converter.convert_many(list(items), error_func)
+
+    # Validate the compiled files
+    checked = validate_files(list(converted.values()), CONVERT_WORKERS)
+
+    # Copy the valid compiled files, named after their MXL file
+    copies = []
+    done = []
+    for mxl_file, mid_file in converted.items():
+        if "error" in checked[mid_file]:
+            error_func(mxl_file, checked[mid_file]["error"])
+            continue
+        filename = os.path.basename(mxl_file).split(".")[0]
+        for item in items[mxl_file]:
+            item = {**item, "midi": checked[mid_file]}
+            if packer is not None:
+                if DATA_HANDLE.pack(packer, mid_file, item) is not None:
+                    done.append(item)
+            else:
+                copies.append((mid_file, item, f"{filename}.mid"))
+    results = DATA_HANDLE.copy_many(copies)
+
+    return done + [
+        copy[1] for copy, result in zip(copies, results) if result is not None
+    ]
+
+
+def run(
+    source_loc: str = SOURCE_LOC,
+    target_loc: str = TARGET_LOC,
+    store: str = INDEX_STORE,
+    workers: int = WORKERS,
+    musescore: str = MUSESCORE,
+    convert_cache: str = CONVERT_CACHE,
+    metrics_loc: str = METRICS_LOC,
+    progress: bool = True,
+    packed: bool = PACKED,
+    copy_mode: str = COPY_MODE,
+) -> None:
+    """Run Method
+
+    Description:
+        Sort and filter every document of the source folder into the target
+        folder: copy the MIDI files over with a pool of worker processes,
+        compile the MIDI files of the documents that only have MXL files,
+        and compile the target's index and errors.
+
+        The source documents are read shard by shard from the source's
+        sharded export if it has one, else they are loaded from its
+        index.json.
+
+        If packed is True, the MIDI files and texts are instead packed by
+        the main process into a memory-mappable dataset in "<target>/packed"
+        (see PackedWriter), and the index entries point into it.
+
+    Information:
+        :param source_loc: Path to the source folder
+        :type source_loc: str
+        :param target_loc: Path to the target folder
+        :type target_loc: str
+        :param store: Scratch index store of the target's data handle
+        :type store: str
+        :param workers: Processes copying files
+        :type workers: int
+        :param musescore: Path to the MuseScore executable
+        :type musescore: str
+        :param convert_cache: Path to the folder of compiled files
+        :type convert_cache: str
+        :param metrics_loc: Path to the metrics folder
+        :type metrics_loc: str
+        :param progress: Whether to show a progress bar
+        :type progress: bool
+        :param packed: Whether to pack the files instead of copying them
+        :type packed: bool
+        :param copy_mode: First copy mode tried when copying files
+        :type copy_mode: str
+        :return: None
+        :rtype: None
+    """
+
+    open_target(target_loc, store, metrics_loc, packed, copy_mode)
+
+    # List the files of the source documents in a single pass
+    source_files = SourceIndex(source_loc).scan()
+    manifest_file = os.path.join(source_loc, SOURCE_MANIFEST)
+
+    # Pack the MIDI files as the workers return them
+    packer = None
+    if packed:
+        packer = PackedWriter(os.path.join(target_loc, "packed"))
 
-# Main run thread
-if __name__ == "__main__":
     # MultiThreading process to quickly download content
-    with concurrent.futures.ProcessPoolExecutor(max_workers=8) as executor:
-        _ = list(
-            tqdm(executor.map(process, SOURCE_INDEX), total=len(SOURCE_INDEX))
-        )
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=open_target,
+        initargs=(target_loc, store, metrics_loc, packed, copy_mode),
+    ) as executor:
+        # Stream the documents of the sharded export
+        if os.path.exists(manifest_file):
+            pending = process_export(
+                executor,
+                manifest_file,
+                source_files,
+                workers,
+                progress,
+                packer,
+            )
+
+        # Otherwise load every document of index.json
+        else:
+            with open(os.path.join(source_loc, "index.json"), "r") as file:
+                source_index = json.load(file)
+            pending = []
+            for result in tqdm(
+                executor.map(
+                    process,
+                    source_index,
+                    (source_files.get(i["_id"], {}) for i in source_index),
+                ),
+                total=len(source_index),
+                disable=not progress,
+            ):
+                if result is not None:
+                    pending.extend(collect([result], packer))
+
+    # Compile and copy the items that only have MXL files
+    convert(pending, musescore, convert_cache, packer)
+    if packer is not None:
+        packer.close()  # Swap in the packed dataset
 
     DATA_HANDLE.compile_index_and_errors()  # Compile index into a JSON file
 
+
+# Main run thread
+if __name__ == "__main__":
+    METRICS.configure(METRICS_LOC)
+    METRICS.serve(METRICS_PORT)  # Publish the stats file and endpoint
+
+    run()  # Sort and filter the source folder into the target folder
+
     # Print message that sorting was complete
     print("Sorting and Filtering Completed")
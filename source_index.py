@@ -0,0 +1,138 @@
+"""
+File Name:      source_index.py
+
+Authors:        Benjamin Herrera
+
+Date Created:   17 OCT 2026
+
+Date Modified:  17 OCT 2026
+
+Description:    Class to index the files of a downloaded dataset's document
+                folders in a single pass
+"""
+
+# Imports
+import os
+import json
+
+CACHE_VERSION = 1  # Versioning for the cache file's structure
+
+
+class SourceIndex:
+    """Source Indexing Class
+
+    Description:
+        Lists the files of every document folder under "<path>/data" with a
+        single walk and groups them by extension:
+
+            {
+                "<document_id>": {
+                    ".mid": ["<path>/data/<document_id>/song.mid"],
+                    ".mxl": ["<path>/data/<document_id>/song.mxl"]
+                },
+                ...
+            }
+
+        The listing is cached in a JSON file along with the modification
+        time of every document folder. Later scans only list the folders
+        whose modification time changed, which is every folder that had a
+        file added, removed, or renamed.
+
+    Methods:
+        SourceIndex(str, str) -> None
+        scan() -> dict
+    """
+
+    def __init__(self, path: str, cache_file: str = None) -> None:
+        """Constructor for Source Indexing Class
+
+        Description:
+            Stores the dataset's folder and the path of the cache file, which
+            defaults to "<path>/source_index.json".
+
+        Information:
+            :param path: Path to the dataset's folder
+            :type path: str
+            :param cache_file: Path to the cache file
+            :type cache_file: str
+            :return: None
+            :rtype: None
+        """
+
+        self.PATH = path
+        self.DATA = os.path.join(path, "data")
+        self.CACHE = (
+            os.path.join(path, "source_index.json")
+            if cache_file is None
+            else cache_file
+        )
+
+    def _load(self) -> dict:
+        """Return the cached listing, or nothing if there is no usable one"""
+        try:
+            with open(self.CACHE, "r", encoding="utf-8") as file:
+                cache = json.load(file)
+        except (OSError, ValueError):
+            return {}
+        return cache["dirs"] if cache.get("version") == CACHE_VERSION else {}
+
+    def _save(self, dirs: dict) -> None:
+        """Write the listing to the cache file"""
+        with open(f"{self.CACHE}.tmp", "w", encoding="utf-8") as file:
+            json.dump({"version": CACHE_VERSION, "dirs": dirs}, file)
+        os.replace(f"{self.CACHE}.tmp", self.CACHE)
+
+    def scan(self) -> dict:
+        """Scanning Method
+
+        Description:
+            Walks the data folder once with os.scandir, relisting only the
+            document folders that changed since the cached listing, and saves
+            the new listing to the cache file.
+
+        Information:
+            :return: Paths of each document's files by extension
+            :rtype: dict
+        """
+
+        cached = self._load()
+        dirs = {}
+
+        # List every document folder, reusing the unchanged ones
+        with os.scandir(self.DATA) as entries:
+            for entry in entries:
+                if not entry.is_dir():
+                    continue
+                mtime = entry.stat().st_mtime_ns
+                if (
+                    entry.name in cached
+                    and cached[entry.name]["mtime"] == mtime
+                ):
+                    dirs[entry.name] = cached[entry.name]
+                    continue
+
+                # Group the folder's files by lowercase extension
+                files = {}
+                with os.scandir(entry.path) as children:
+                    for child in children:
+                        if child.is_file():
+                            extension = os.path.splitext(child.name)[1]
+                            files.setdefault(extension.lower(), []).append(
+                                child.name
+                            )
+                for names in files.values():
+                    names.sort()
+                dirs[entry.name] = {"mtime": mtime, "files": files}
+
+        self._save(dirs)  # Cache the listing for the next scan
+
+        # Resolve the file names to paths
+        return {
+            id: {
+                extension: [
+                    os.path.join(self.DATA, id, name) for name in names
+                ]
+                for extension, names in folder["files"].items()
+            }
+            for id, folder in dirs.items()
+        }
@@ -0,0 +1,636 @@
+"""
+File Name:      work_queue.py
+
+Authors:        Benjamin Herrera
+
+Date Created:   17 OCT 2026
+
+Date Modified:  17 OCT 2026
+
+Description:    Classes to share documents between workers on any number of
+                machines through leases in MongoDB or SQLite
+"""
+
+# Imports
+import os
+import abc
+import time
+import uuid
+import socket
+import sqlite3
+import threading
+from pymongo import ASCENDING, UpdateOne
+from mongo_handle import MongoHandle
+
+# Constants
+LEASE = 300  # Seconds a claim lasts without a heartbeat
+MAX_ATTEMPTS = 3  # Claims of a document before it is marked as failed
+POLL_INTERVAL = 10  # Seconds between claims while others hold every lease
+BUSY_TIMEOUT = 30  # Seconds a SQLite write waits for another writer
+STATES = ("pending", "leased", "done", "failed")  # States of a document
+
+
+class WorkQueue(abc.ABC):
+    """Work Queue Class
+
+    Description:
+        Hands out document IDs to workers that may run on any number of
+        machines. Every ID is in one of STATES:
+
+            pending     Waiting to be claimed
+            leased      Claimed by a worker until its lease runs out
+            done        Completed by a worker
+            failed      Failed or lost MAX_ATTEMPTS times
+
+        A worker atomically claims a batch of pending IDs, which leases them
+        to it for LEASE seconds. While it works on them, a heartbeat thread
+        extends the leases of the IDs it holds. If the worker dies, its
+        leases run out and the IDs are claimed again by another worker, so
+        results must be committed idempotently: completing an ID twice has
+        no further effect.
+
+        Leases are compared to the workers' clocks, which must be kept in
+        sync (NTP) to well within LEASE.
+
+        Subclasses implement enqueue, counts, and the methods starting with
+        an underscore.
+
+            queue = MongoWorkQueue("cpdlCOL")
+            queue.enqueue(ids)
+            queue.start()
+            for batch in queue.batches(50):
+                ...
+                queue.complete(batch)
+            queue.stop()
+
+    Methods:
+        WorkQueue(int, int) -> None
+        enqueue(list) -> None
+        counts() -> dict
+        claim(int) -> list
+        heartbeat() -> int
+        complete(list) -> None
+        fail(list) -> None
+        reclaim() -> int
+        batches(int, int) -> object
+        start() -> None
+        stop() -> None
+    """
+
+    def __init__(
+        self, lease: int = LEASE, max_attempts: int = MAX_ATTEMPTS
+    ) -> None:
+        """Constructor for Work Queue Class
+
+        Description:
+            Names the worker after its machine and process, and starts with
+            no IDs held.
+
+        Information:
+            :param lease: Seconds a claim lasts without a heartbeat
+            :type lease: int
+            :param max_attempts: Claims of an ID before it is marked as
+                failed
+            :type max_attempts: int
+            :return: None
+            :rtype: None
+        """
+
+        self.LEASE = lease
+        self.MAX_ATTEMPTS = max_attempts
+        self.WORKER = (
+            f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        )
+        self.held = set()  # IDs leased to this worker
+        self.held_lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    @abc.abstractmethod
+    def enqueue(self, ids: list) -> None:
+        """Enqueuing Method
+
+        Description:
+            Adds IDs as pending. IDs already in the queue are left as they
+            are, so every worker can enqueue the same IDs.
+
+        Information:
+            :param ids: The IDs to add
+            :type ids: list[str]
+            :return: None
+            :rtype: None
+        """
+
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def counts(self) -> dict:
+        """Return the number of IDs in each state"""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def _claim(self, count: int, now: float) -> list:
+        """Lease up to count pending or expired IDs, returning them"""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def _extend(self, ids: list, lease_until: float) -> list:
+        """Extend the leases this worker still holds, returning their IDs"""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def _complete(self, ids: list) -> None:
+        """Mark the IDs as done"""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def _fail(self, ids: list) -> None:
+        """Put the IDs back to pending, or failed once out of attempts"""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def _reclaim(self, now: float) -> int:
+        """Reclaim the expired leases, returning how many there were"""
+        raise NotImplementedError
+
+    def claim(self, count: int) -> list:
+        """Claiming Method
+
+        Description:
+            Leases up to count IDs that are pending, or whose lease ran out,
+            to this worker. Two workers never get the same ID from the same
+            round of claims.
+
+        Information:
+            :param count: The most IDs to claim
+            :type count: int
+            :return: The claimed IDs
+            :rtype: list[str]
+        """
+
+        ids = self._claim(count, time.time())
+        with self.held_lock:
+            self.held.update(ids)
+        return ids
+
+    def heartbeat(self) -> int:
+        """Heartbeat Method
+
+        Description:
+            Extends the leases of every ID this worker holds. IDs whose lease
+            was lost, because it ran out and another worker claimed them,
+            are no longer held.
+
+        Information:
+            :return: Number of leases extended
+            :rtype: int
+        """
+
+        with self.held_lock:
+            ids = list(self.held)
+        if ids == []:
+            return 0
+
+        kept = set(self._extend(ids, time.time() + self.LEASE))
+        with self.held_lock:
+            self.held -= set(ids) - kept
+        return len(kept)
+
+    def complete(self, ids: list) -> None:
+        """Mark the IDs as done, whoever holds them"""
+        self._complete(ids)
+        with self.held_lock:
+            self.held -= set(ids)
+
+    def fail(self, ids: list) -> None:
+        """Hand the IDs held by this worker back, or fail them for good"""
+        self._fail(ids)
+        with self.held_lock:
+            self.held -= set(ids)
+
+    def reclaim(self) -> int:
+        """Reclaiming Method
+
+        Description:
+            Puts the IDs whose lease ran out back to pending, or marks them
+            as failed once they used up their attempts. Claims already take
+            expired leases, so this only keeps the counts accurate.
+
+        Information:
+            :return: Number of IDs reclaimed
+            :rtype: int
+        """
+
+        return self._reclaim(time.time())
+
+    def batches(
+        self, batch_size: int, poll_interval: int = POLL_INTERVAL
+    ) -> object:
+        """Batches Method
+
+        Description:
+            Yields batches of claimed IDs until no ID is pending or leased.
+            While other workers hold every remaining lease, waits in case
+            one of them dies and its leases run out.
+
+        Information:
+            :param batch_size: IDs claimed at a time
+            :type batch_size: int
+            :param poll_interval: Seconds between claims while waiting
+            :type poll_interval: int
+            :return: Iterator over the batches of IDs
+            :rtype: object
+        """
+
+        while True:
+            ids = self.claim(batch_size)
+            if ids != []:
+                yield ids
+                continue
+
+            # Stop once no ID is left to process by anyone
+            self.reclaim()
+            counts = self.counts()
+            if counts["pending"] == 0 and counts["leased"] == 0:
+                return
+            time.sleep(poll_interval)
+
+    def start(self) -> None:
+        """Start the heartbeat thread"""
+        self.stopped.clear()
+
+        def beat() -> None:
+            while not self.stopped.wait(self.LEASE / 3):
+                try:
+                    self.heartbeat()
+                except Exception as e:
+                    print(f"Work queue heartbeat failed: {e}")
+
+        self.thread = threading.Thread(target=beat, daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        """Stop the heartbeat thread"""
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+
+class MongoWorkQueue(WorkQueue):
+    """MongoDB Work Queue Class
+
+    Description:
+        Keeps the queue in the "VIVYDownload_en.<name>_QUEUE" collection,
+        one document per ID:
+
+            {
+                "_id": "<document ID>",
+                "state": "leased",
+                "owner": "<host>:<pid>:<token>",
+                "lease_until": 1760659200.0,
+                "attempts": 1,
+                "claim": "<token of the claim>"
+            }
+
+        A claim picks candidate IDs, leases those still available with a
+        single update_many tagged with a new token, and reads back the IDs
+        that carry its token. Each document is updated atomically, so a
+        candidate taken by another worker in the meantime is skipped.
+
+    Methods:
+        MongoWorkQueue(str, int, int) -> None
+        enqueue(list) -> None
+        counts() -> dict
+    """
+
+    def __init__(
+        self, name: str, lease: int = LEASE, max_attempts: int = MAX_ATTEMPTS
+    ) -> None:
+        """Constructor for MongoDB Work Queue Class
+
+        Description:
+            Gets the queue's collection and indexes it for claims.
+
+        Information:
+            :param name: Prefix of the collection name
+            :type name: str
+            :param lease: Seconds a claim lasts without a heartbeat
+            :type lease: int
+            :param max_attempts: Claims of an ID before it is marked as
+                failed
+            :type max_attempts: int
+            :return: None
+            :rtype: None
+        """
+
+        super().__init__(lease, max_attempts)
+        self.COL = MongoHandle().get_client()["VIVYDownload_en"][
+            f"{name}_QUEUE"
+        ]
+        self.COL.create_index(
+            [("state", ASCENDING), ("lease_until", ASCENDING)]
+        )
+        self.COL.create_index("claim")
+
+    def _available(self, now: float) -> dict:
+        """Return the filter of the IDs a worker may claim"""
+        return {
+            "$or": [
+                {"state": "pending"},
+                {"state": "leased", "lease_until": {"$lt": now}},
+            ],
+            "attempts": {"$lt": self.MAX_ATTEMPTS},
+        }
+
+    def enqueue(self, ids: list) -> None:
+        """Upsert the IDs as pending if they're new"""
+        if ids == []:
+            return
+        self.COL.bulk_write(
+            [
+                UpdateOne(
+                    {"_id": id},
+                    {"$setOnInsert": {"state": "pending", "attempts": 0}},
+                    upsert=True,
+                )
+                for id in ids
+            ],
+            ordered=False,
+        )
+
+    def counts(self) -> dict:
+        """Count the IDs in each state"""
+        counts = dict.fromkeys(STATES, 0)
+        for group in self.COL.aggregate(
+            [{"$group": {"_id": "$state", "count": {"$sum": 1}}}]
+        ):
+            counts[group["_id"]] = group["count"]
+        return counts
+
+    def _claim(self, count: int, now: float) -> list:
+        """Lease available candidates tagged with a new claim token"""
+        available = self._available(now)
+        candidates = [
+            document["_id"]
+            for document in self.COL.find(available, {"_id": 1}).limit(count)
+        ]
+        if candidates == []:
+            return []
+
+        token = uuid.uuid4().hex
+        self.COL.update_many(
+            {"$and": [{"_id": {"$in": candidates}}, available]},
+            {
+                "$set": {
+                    "state": "leased",
+                    "owner": self.WORKER,
+                    "lease_until": now + self.LEASE,
+                    "claim": token,
+                },
+                "$inc": {"attempts": 1},
+            },
+        )
+        return [
+            document["_id"]
+            for document in self.COL.find({"claim": token}, {"_id": 1})
+        ]
+
+    def _extend(self, ids: list, lease_until: float) -> list:
+        """Extend the leases still owned by this worker"""
+        owned = {
+            "_id": {"$in": ids},
+            "state": "leased",
+            "owner": self.WORKER,
+        }
+        self.COL.update_many(owned, {"$set": {"lease_until": lease_until}})
+        return [document["_id"] for document in self.COL.find(owned)]
+
+    def _complete(self, ids: list) -> None:
+        """Mark the IDs as done"""
+        self.COL.update_many(
+            {"_id": {"$in": ids}, "state": {"$ne": "done"}},
+            {"$set": {"state": "done"}, "$unset": {"lease_until": ""}},
+        )
+
+    def _fail(self, ids: list) -> None:
+        """Fail the IDs out of attempts and hand the others back"""
+        owned = {"_id": {"$in": ids}, "state": "leased", "owner": self.WORKER}
+        self.COL.update_many(
+            {**owned, "attempts": {"$gte": self.MAX_ATTEMPTS}},
+            {"$set": {"state": "failed"}},
+        )
+        self.COL.update_many(owned, {"$set": {"state": "pending"}})
+
+    def _reclaim(self, now: float) -> int:
+        """Hand back or fail the IDs whose lease ran out"""
+        expired = {"state": "leased", "lease_until": {"$lt": now}}
+        self.COL.update_many(
+            {**expired, "attempts": {"$gte": self.MAX_ATTEMPTS}},
+            {"$set": {"state": "failed"}},
+        )
+        return self.COL.update_many(
+            expired, {"$set": {"state": "pending"}}
+        ).modified_count
+
+
+class SQLiteWorkQueue(WorkQueue):
+    """SQLite Work Queue Class
+
+    Description:
+        Keeps the queue in a SQLite database, as a stand-in for MongoDB when
+        every worker runs on one machine:
+
+            <path_to_folder>
+            └───queue.sqlite3
+
+        Claims run in an immediate transaction, which keeps every other
+        writer out until the claimed IDs are leased.
+
+    Methods:
+        SQLiteWorkQueue(str, int, int) -> None
+        enqueue(list) -> None
+        counts() -> dict
+    """
+
+    def __init__(
+        self, path: str, lease: int = LEASE, max_attempts: int = MAX_ATTEMPTS
+    ) -> None:
+        """Constructor for SQLite Work Queue Class
+
+        Description:
+            Creates the database and its table in the given folder if they
+            don't exist.
+
+        Information:
+            :param path: Path to the folder of the queue
+            :type path: str
+            :param lease: Seconds a claim lasts without a heartbeat
+            :type lease: int
+            :param max_attempts: Claims of an ID before it is marked as
+                failed
+            :type max_attempts: int
+            :return: None
+            :rtype: None
+        """
+
+        super().__init__(lease, max_attempts)
+        os.makedirs(path, exist_ok=True)
+        self.FILE = os.path.join(path, "queue.sqlite3")
+        self.connection = None
+        self.pid = None
+        self.lock = threading.Lock()
+
+        # Switch the database to WAL mode and create the table
+        with self.lock:
+            connection = self._connect()
+            connection.execute("PRAGMA journal_mode=WAL")
+            with connection:
+                connection.execute(
+                    "CREATE TABLE IF NOT EXISTS queue (_id TEXT PRIMARY KEY, "
+                    + "state TEXT NOT NULL, owner TEXT, lease_until REAL, "
+                    + "attempts INTEGER NOT NULL DEFAULT 0)"
+                )
+                connection.execute(
+                    "CREATE INDEX IF NOT EXISTS queue_state "
+                    + "ON queue (state, lease_until)"
+                )
+
+    def _connect(self) -> sqlite3.Connection:
+        """Return the connection of the current process"""
+        if self.pid != os.getpid():
+            self.connection = sqlite3.connect(
+                self.FILE,
+                timeout=BUSY_TIMEOUT,
+                isolation_level=None,
+                check_same_thread=False,
+            )
+            self.pid = os.getpid()
+        return self.connection
+
+    def _run(self, statements: list) -> list:
+        """Run statements in one immediate transaction, return their rows"""
+        with self.lock:
+            connection = self._connect()
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                rows = [
+                    connection.execute(sql, params).fetchall()
+                    for sql, params in statements
+                ]
+                connection.execute("COMMIT")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+        return rows
+
+    @staticmethod
+    def _in(ids: list) -> str:
+        """Return the placeholders of an IN clause"""
+        return ", ".join("?" * len(ids))
+
+    def enqueue(self, ids: list) -> None:
+        """Insert the IDs as pending if they're new"""
+        with self.lock:
+            connection = self._connect()
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                connection.executemany(
+                    "INSERT OR IGNORE INTO queue (_id, state) "
+                    + "VALUES (?, 'pending')",
+                    [(str(id),) for id in ids],
+                )
+                connection.execute("COMMIT")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+
+    def counts(self) -> dict:
+        """Count the IDs in each state"""
+        counts = dict.fromkeys(STATES, 0)
+        (rows,) = self._run(
+            [("SELECT state, COUNT(*) FROM queue GROUP BY state", ())]
+        )
+        counts.update(dict(rows))
+        return counts
+
+    def _claim(self, count: int, now: float) -> list:
+        """Select and lease available IDs in one transaction"""
+        with self.lock:
+            connection = self._connect()
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                ids = [
+                    row[0]
+                    for row in connection.execute(
+                        "SELECT _id FROM queue WHERE (state = 'pending' OR "
+                        + "(state = 'leased' AND lease_until < ?)) "
+                        + "AND attempts < ? LIMIT ?",
+                        (now, self.MAX_ATTEMPTS, count),
+                    )
+                ]
+                connection.execute(
+                    "UPDATE queue SET state = 'leased', owner = ?, "
+                    + "lease_until = ?, attempts = attempts + 1 "
+                    + f"WHERE _id IN ({self._in(ids)})",
+                    [self.WORKER, now + self.LEASE, *ids],
+                )
+                connection.execute("COMMIT")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+        return ids
+
+    def _extend(self, ids: list, lease_until: float) -> list:
+        """Extend the leases still owned by this worker"""
+        owned = (
+            f"_id IN ({self._in(ids)}) AND state = 'leased' AND owner = ?",
+            [*ids, self.WORKER],
+        )
+        _, rows = self._run(
+            [
+                (
+                    f"UPDATE queue SET lease_until = ? WHERE {owned[0]}",
+                    [lease_until, *owned[1]],
+                ),
+                (f"SELECT _id FROM queue WHERE {owned[0]}", owned[1]),
+            ]
+        )
+        return [row[0] for row in rows]
+
+    def _complete(self, ids: list) -> None:
+        """Mark the IDs as done"""
+        self._run(
+            [
+                (
+                    "UPDATE queue SET state = 'done', lease_until = NULL "
+                    + f"WHERE _id IN ({self._in(ids)})",
+                    [str(id) for id in ids],
+                )
+            ]
+        )
+
+    def _fail(self, ids: list) -> None:
+        """Fail the IDs out of attempts and hand the others back"""
+        self._run(
+            [
+                (
+                    "UPDATE queue SET state = CASE WHEN attempts >= ? "
+                    + "THEN 'failed' ELSE 'pending' END "
+                    + f"WHERE _id IN ({self._in(ids)}) "
+                    + "AND state = 'leased' AND owner = ?",
+                    [self.MAX_ATTEMPTS, *[str(id) for id in ids], self.WORKER],
+                )
+            ]
+        )
+
+    def _reclaim(self, now: float) -> int:
+        """Hand back or fail the IDs whose lease ran out"""
+        with self.lock:
+            cursor = self._connect().execute(
+                "UPDATE queue SET state = CASE WHEN attempts >= ? "
+                + "THEN 'failed' ELSE 'pending' END "
+                + "WHERE state = 'leased' AND lease_until < ?",
+                (self.MAX_ATTEMPTS, now),
+            )
+        return cursor.rowcount